@@ -0,0 +1,87 @@
+import math
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status
+    and a Retry-After hint in seconds."""
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounds the number of requests parsing XML at once in this process.
+
+    Up to `limit` requests run; up to `queue_size` more wait, each for at
+    most `max_wait` seconds. Anything beyond that is turned away at once
+    with 429, and a waiter whose deadline passes gets 503, so an overload
+    costs the rejected requests a fast error instead of slowing everyone.
+    Retry-After is estimated from the recent time a request holds a slot.
+    """
+
+    # Weight of the newest observation in the running service time average
+    SMOOTHING = 0.2
+
+    def __init__(self, limit, queue_size, max_wait):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._service_time = 1.0  # Seconds a request holds a slot, smoothed
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if needed.
+
+        Returns a token to pass to release(); raises Overloaded.
+        """
+        with self._cond:
+            if self._active < self.limit and not self._waiting:
+                return self._admit()
+            if self._waiting >= self.queue_size:
+                self.stats["rejected"] += 1
+                raise Overloaded("Server is busy, try again shortly", 429, self._retry_after())
+
+            self.stats["queued"] += 1
+            self._waiting += 1
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self._active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["timed_out"] += 1
+                        raise Overloaded("Timed out waiting for capacity, try again shortly",
+                                         503, self._retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            return self._admit()
+
+    def _admit(self):
+        # Caller holds the lock
+        self._active += 1
+        self.stats["admitted"] += 1
+        return time.perf_counter()
+
+    def release(self, token):
+        elapsed = time.perf_counter() - token
+        with self._cond:
+            self._active -= 1
+            self._service_time += self.SMOOTHING * (elapsed - self._service_time)
+            self._cond.notify()
+
+    def _retry_after(self):
+        # Time for the running and queued requests to drain, in whole seconds
+        backlog = self._active + self._waiting
+        return max(1, math.ceil(self._service_time * backlog / self.limit))
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self.stats, active=self._active, waiting=self._waiting,
+                        limit=self.limit, queue_size=self.queue_size)
@@ -1,16 +1,223 @@
+import functools
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
 import os
-from flask import Flask, request, jsonify
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from flask import Flask, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import xml.etree.ElementTree as ET
 
+import metrics
+import profiling
+from admission import AdmissionController, Overloaded
+from jobs import JobManager, JobStore, QueueFull
+from market_conditions import SCOPES, normalize_postal_code, summarize_market, trend_series
+from market_model import DEFAULT_FEATURES, FEATURES, MarketModel, compare_report
+from pdf_cache import FileCache
+from portfolio import PortfolioStore
+from result_cache import ResultCache, hash_stream
+from revision_diff import diff_results, record_digest
+from sensitivity import adjustment_sensitivity, comparable_sensitivity, monte_carlo
+from spatial import NearbySales, locate_comparables
+from summary import encode_json, summary_statistics, to_columnar
+from uad_checks import validate_portfolio, validate_report
+from upload_stream import (DigestOnly, PacedStream, UploadError, iter_upload, read_upload_bytes,
+                           stream_upload, strip_compression_suffix)
+from xml_parsing import (CHUNK_SIZE, EmbeddedFileParser, StreamingReportParser, XMLLimitError,
+                         parse_report)
+
 app = Flask(__name__)
 CORS(app)  # Enable cross-origin requests.
+metrics.init_app(app)  # Request timing, Server-Timing headers and /metrics
+profiling.init_app(app)  # Stored request profiles, when PROFILE_TOKEN is set
+
+# Largest request body accepted, in bytes (compressed size for compressed
+# uploads, whose expanded size is bounded separately)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 128 * 1024 * 1024))
+
+# Requests that parse XML are admitted PARSE_CONCURRENCY at a time per
+# process; up to PARSE_QUEUE_SIZE more wait up to PARSE_QUEUE_TIMEOUT
+# seconds, the rest are shed with 429/503 and Retry-After.
+admission = AdmissionController(
+    limit=int(os.environ.get('PARSE_CONCURRENCY', 2)),
+    queue_size=int(os.environ.get('PARSE_QUEUE_SIZE', 8)),
+    max_wait=float(os.environ.get('PARSE_QUEUE_TIMEOUT', 5)),
+)
+
+# Longest a single read of a request body may block, in seconds. Bodies
+# must also keep up MIN_UPLOAD_RATE (see upload_stream.PacedStream).
+UPLOAD_READ_TIMEOUT = float(os.environ.get('UPLOAD_READ_TIMEOUT', 10))
+
+# Batch analysis settings
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 100))
+# How pool processes are started. Forking a threaded gunicorn worker would
+# copy locks other request threads hold at that moment into the child;
+# forkserver (spawn where it is unavailable) starts them from a clean,
+# single-threaded process instead.
+POOL_START_METHOD = os.environ.get('POOL_START_METHOD', 'forkserver')
+
+_process_pool = None  # Created on first use so importing the app stays cheap
+
+# Largest scaling grid accepted by /api/sensitivity
+MAX_SCALING_FACTORS = 1000
+
+# Largest sample count accepted by /api/simulate
+MAX_SIMULATION_SAMPLES = int(os.environ.get('MAX_SIMULATION_SAMPLES', 10_000_000))
+# Largest chunk_size accepted by /api/simulate; monte_carlo() shrinks chunks
+# further so one never holds more than MAX_CHUNK_CELLS draws
+MAX_SIMULATION_CHUNK = 1_000_000
+
+# Bump whenever calculate_sensitivity output changes so cached results are
+# not served for the old format.
+RESULT_VERSION = '12'
+
+# Results cached by upload content hash: in-process LRU backed by SQLite.
+# Set RESULT_CACHE_PATH to an empty string to keep the memory tier only.
+result_cache = ResultCache(
+    os.environ.get(
+        'RESULT_CACHE_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result_cache.sqlite3'),
+    ),
+    RESULT_VERSION,
+    max_entries=int(os.environ.get('RESULT_CACHE_ENTRIES', 256)),
+    max_memory_bytes=int(os.environ.get('RESULT_CACHE_MEMORY_BYTES', 64 * 1024 * 1024)),
+    max_disk_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+    max_age=int(os.environ.get('RESULT_CACHE_MAX_AGE', 7 * 24 * 3600)),
+)
+
+# Every analyzed report is persisted here in the background. Set
+# PORTFOLIO_PATH to an empty string to disable the store.
+PORTFOLIO_PATH = os.environ.get(
+    'PORTFOLIO_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'portfolio.sqlite3'),
+)
+portfolio = PortfolioStore(PORTFOLIO_PATH) if PORTFOLIO_PATH else None
+
+# Regression of the portfolio's closed sales on their characteristics
+market_model = MarketModel(portfolio) if portfolio is not None else None
+
+# Spatial index over every located comparable in the portfolio
+nearby_sales = NearbySales(portfolio) if portfolio is not None else None
+
+# Decoded embedded PDFs, keyed by the digest of the report they came from
+pdf_cache = FileCache(
+    os.environ.get(
+        'PDF_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdf_cache'),
+    ),
+    max_bytes=int(os.environ.get('PDF_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024)),
+)
+
+def build_adjustment_grid(properties, indexes):
+    """Lay out per-property adjustment indexes as a dense grid.
+
+    Rows follow `properties` (subject first), columns are every adjustment
+    type seen in the report in order of first appearance. Cells without a
+    line are None.
+    """
+    types = []
+    seen = set()
+    for index in indexes:
+        for key in index:
+            if key not in seen:
+                seen.add(key)
+                types.append(key)
+
+    descriptions = []
+    amounts = []
+    for index in indexes:
+        row = [index.get(key, (None, None)) for key in types]
+        descriptions.append([cell[0] for cell in row])
+        amounts.append([cell[1] for cell in row])
+
+    return {
+        "properties": [prop["property_type"] for prop in properties],
+        "types": types,
+        "descriptions": descriptions,
+        "amounts": amounts,
+    }
+
+XML_PARSE_ERROR = "Failed to parse XML file. Ensure it is well-formed."
+
+# SHA-256 hex digest of an uploaded document
+REPORT_DIGEST = re.compile(r'[0-9a-f]{64}')
 
 def calculate_sensitivity(xml_file):
     try:
-        # Parse the XML file
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
+        # Stream the XML file through the extractor. Only the comparable
+        # sale records are kept; the embedded PDF is never loaded.
+        extracted = parse_report(xml_file)
+    except XMLLimitError as e:
+        return {"error": f"{XML_PARSE_ERROR} {e}"}
+    except ET.ParseError:
+        return {"error": XML_PARSE_ERROR}
+    except Exception as e:
+        return {"error": f"An unexpected error occurred: {str(e)}"}
+    return summarize_report(extracted)
+
+def subject_row(fields, extra_fields):
+    """Result row of the subject from its extracted fields."""
+    pre_adj = fields["pre_adj"]
+    # Subject property does not have AdjustedSalesPriceAmount
+    subject_property = {
+        "property_type": "Subject",  # Add property type
+        "address": f"{fields['street']}, {fields['street2']}".strip(", "),
+        "pre_adj": pre_adj if pre_adj is not None else "N/A",
+        "post_adj": "",  # Not applicable for subject property
+        "comp_type": "",  # Not applicable for subject property
+        "total_adj_percent": "",  # Not applicable for subject property
+        "sale_date": "",  # Not applicable for subject property
+        "project_name": fields["project_name"],
+        "postal_code": fields["postal_code"],
+        "latitude": fields["latitude"],
+        "longitude": fields["longitude"],
+    }
+    subject_property.update((name, fields[name]) for name in extra_fields)
+    return subject_property
+
+def comparable_row(fields, extra_fields, comp_number):
+    """Result row of the comp_number-th comparable from its extracted fields."""
+    pre_adj = fields["pre_adj"]
+    post_adj = fields["post_adj"]
+    total_adj_percent = fields["total_adj_percent"]
+    gross_adj_percent = fields["gross_adj_percent"]
+    # The total is reported unsigned, with a positive/negative indicator
+    total_adj_amount = fields["total_adj_amount"]
+    if total_adj_amount is not None and fields["total_adj_positive"] == "N":
+        total_adj_amount = -total_adj_amount
+    comparable = {
+        "property_type": f"Comparable {comp_number}",  # Add property type
+        "address": f"{fields['street']}, {fields['street2']}".strip(", "),
+        "pre_adj": pre_adj if pre_adj is not None else "N/A",
+        "post_adj": post_adj if post_adj is not None else "N/A",
+        "comp_type": fields["comp_type"],
+        "total_adj_percent": total_adj_percent if total_adj_percent is not None else "N/A",
+        "gross_adj_percent": gross_adj_percent if gross_adj_percent is not None else "N/A",
+        "total_adj_amount": total_adj_amount if total_adj_amount is not None else "N/A",
+        "sale_date": fields["sale_date"],  # Include sale date
+        "project_name": fields["project_name"],
+        "mls_number": fields["mls_number"],
+        "postal_code": fields["postal_code"],
+        "latitude": fields["latitude"],
+        "longitude": fields["longitude"],
+        "proximity": fields["proximity"],
+    }
+    comparable.update((name, fields[name]) for name in extra_fields)
+    return comparable
+
+def summarize_report(extracted):
+    """Build the analysis result from parse_report() output."""
+    try:
+        report = extracted["report"]
+        extra_fields = extracted["profile"].extra_fields  # Form specific fields
 
         # Initialize lists and variables
         comparables = []
@@ -18,81 +225,32 @@ def calculate_sensitivity(xml_file):
         comp_number = 0  # Initialize comparable number
         pre_adj_values = []  # To calculate pre-adjustment range
         post_adj_values = []  # To calculate post-adjustment range
+        subject_adjustments = {}  # Adjustment index of the subject
+        comp_adjustments = []  # Adjustment index of each comparable
 
-        # Iterate over all "COMPARABLE_SALE" elements
-        for comp in root.findall(".//COMPARABLE_SALE"):
-            # Extract PropertySequenceIdentifier
-            property_sequence_id = comp.get("PropertySequenceIdentifier")
-
-            # Extract values from attributes
-            pre_adj = comp.get("PropertySalesAmount")
-            post_adj = comp.get("AdjustedSalesPriceAmount")  # Only applicable for comparables
-            total_adj_percent = comp.get("SalePriceTotalAdjustmentNetPercent")
-            location = comp.find(".//LOCATION")
-
-            # Extract address components with default values
-            if location is not None:
-                street = location.get("PropertyStreetAddress", "Unknown")
-                street2 = location.get("PropertyStreetAddress2", "")  # Capture PropertyStreetAddress2
-                address = f"{street}, {street2}".strip(", ")
-            else:
-                address = "Unknown"
-
-            # Extract ComparableType from SalesConcessions _Description
-            comp_type = "Unknown"
-            for adjustment in comp.findall(".//SALE_PRICE_ADJUSTMENT"):
-                if adjustment.get("_Type") == "SalesConcessions":
-                    comp_type = adjustment.get("_Description", "Unknown")
-                    break  # Use the first SalesConcessions description found
-
-            # Replace "ArmLth" with "Sale" for comparables
-            if comp_type == "ArmLth":
-                comp_type = "Sale"
-
-            # Extract Date of Sale from _Description
-            sale_date = "N/A"
-            for adjustment in comp.findall(".//SALE_PRICE_ADJUSTMENT"):
-                if adjustment.get("_Type") == "DateOfSale":
-                    description = adjustment.get("_Description", "")
-                    if "s" in description:
-                        sale_date = description.split(";")[0].replace("s", "").strip()
-                    break
-
-            # Convert to float if possible
-            try:
-                pre_adj = float(pre_adj) if pre_adj is not None else None
-                post_adj = float(post_adj) if post_adj is not None else None
-            except ValueError:
-                pre_adj = None
-                post_adj = None
+        # Iterate over the extracted "COMPARABLE_SALE" records; the fields
+        # were pulled out while parsing according to the form's profile
+        for record in extracted["comparables"]:
+            fields = record["fields"]
+            pre_adj = fields["pre_adj"]
+            post_adj = fields["post_adj"]  # Only applicable for comparables
+            comp_type = fields["comp_type"]
+
+            # Adjustment lines indexed by type while parsing
+            adjustments = record["adjustments"]
 
             # Determine if this is the subject property or a comparable
-            if property_sequence_id == "0":
-                # Subject property does not have AdjustedSalesPriceAmount
-                subject_property = {
-                    "property_type": "Subject",  # Add property type
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": "",  # Not applicable for subject property
-                    "comp_type": "",  # Not applicable for subject property
-                    "total_adj_percent": "",  # Not applicable for subject property
-                    "sale_date": "",  # Not applicable for subject property
-                }
+            if fields["sequence"] == "0":
+                subject_property = subject_row(fields, extra_fields)
+                subject_adjustments = adjustments
             else:
                 # Comparables include AdjustedSalesPriceAmount
                 comp_number += 1
-                comparables.append({
-                    "property_type": f"Comparable {comp_number}",  # Add property type
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": post_adj if post_adj is not None else "N/A",
-                    "comp_type": comp_type,
-                    "total_adj_percent": total_adj_percent if total_adj_percent is not None else "N/A",
-                    "sale_date": sale_date,  # Include sale date
-                })
+                comp_adjustments.append(adjustments)
+                comparables.append(comparable_row(fields, extra_fields, comp_number))
 
                 # Add to ranges if it's a valid comparable sale
-                if post_adj is not None and comp_type == "Sale":
+                if pre_adj is not None and post_adj is not None and comp_type == "Sale":
                     pre_adj_values.append(pre_adj)
                     post_adj_values.append(post_adj)
 
@@ -102,6 +260,9 @@ def calculate_sensitivity(xml_file):
         if not comparables:
             return {"error": "No valid comparable data found in the XML file."}
 
+        # Distance and bearing of each comparable from the subject
+        locate_comparables(subject_property, comparables)
+
         # Calculate pre-adjustment and post-adjustment ranges
         pre_adj_range = {
             "min": min(pre_adj_values) if pre_adj_values else "N/A",
@@ -112,564 +273,708 @@ def calculate_sensitivity(xml_file):
             "max": max(post_adj_values) if post_adj_values else "N/A",
         }
 
-        # Return the subject property, comparables, and ranges
+        adjustment_grid = build_adjustment_grid(
+            [subject_property] + comparables,
+            [subject_adjustments] + comp_adjustments,
+        )
+
+        # Return the subject property, comparables, ranges and adjustment grid
         return {
+            "report": {
+                "file_identifier": report.get("file_identifier"),
+                "form_type": report.get("form_type"),
+                "form_name": report.get("form_name"),
+                "signed_date": report.get("signed_date"),
+                "effective_date": report.get("effective_date"),
+                "postal_code": report.get("postal_code"),
+            },
             "subject_property": subject_property,
             "comparables": comparables,
             "pre_adj_range": pre_adj_range,
             "post_adj_range": post_adj_range,
+            "summary": summary_statistics(subject_property, comparables),
+            "adjustment_grid": adjustment_grid,
+            # Line items, totals and percentages checked against each other
+            # and against the net/gross adjustment guidelines
+            "validation": validate_report(comparables, adjustment_grid),
+            # Market conditions grid, filed under the subject's ZIP code
+            "market_conditions": summarize_market(
+                extracted["market"],
+                report.get("postal_code") or subject_property["postal_code"],
+                report.get("effective_date") or report.get("signed_date"),
+            ),
         }
 
-    except ET.ParseError:
-        return {"error": "Failed to parse XML file. Ensure it is well-formed."}
     except ValueError as e:
         return {"error": f"Invalid data in XML file: {str(e)}"}
     except Exception as e:
         return {"error": f"An unexpected error occurred: {str(e)}"}
-    try:
-        # Parse the XML file
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
 
-        # Initialize lists and variables
-        comparables = []
-        subject_property = None
-        comp_number = 0  # Initialize comparable number
+def admitted(view):
+    """Run the view holding a parse slot from the admission controller.
+
+    The slot is taken when the first bytes of the body arrive, so a client
+    that connects and then stalls never holds one, and slow senders are
+    cut off by PacedStream and a socket read timeout (gunicorn only) while
+    the body is still parsed as it streams in. A view that never reads its
+    body takes no slot. A streamed response keeps the slot until its body
+    has been sent, since that is when the parsing happens.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        tokens = []
+
+        def admit():
+            with metrics.stage('admission'):
+                tokens.append(admission.acquire())
+
+        def release():
+            # Called at the end of a streamed body and again on close
+            if tokens:
+                admission.release(tokens.pop())
+
+        client = request.environ.get('gunicorn.socket')
+        if client is not None:
+            # Reset to blocking by gunicorn for the connection's next request
+            client.settimeout(UPLOAD_READ_TIMEOUT)
+        request.stream = PacedStream(request.stream, on_data=admit)
+        try:
+            response = view(*args, **kwargs)
+        except BaseException:
+            release()
+            raise
+        if isinstance(response, app.response_class) and response.is_streamed:
+            body = response.response
+
+            def releasing():
+                try:
+                    yield from body
+                finally:
+                    release()
+
+            response.response = releasing()
+            response.call_on_close(release)
+        else:
+            release()
+        return response
+    return wrapper
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    # Raised by the first read of the body in an admitted() view
+    return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+
+@app.errorhandler(UploadError)
+def upload_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({'error': f"Upload exceeds the limit of {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
 
-        # Iterate over all "COMPARABLE_SALE" elements
-        for comp in root.findall(".//COMPARABLE_SALE"):
-            # Extract PropertySequenceIdentifier
-            property_sequence_id = comp.get("PropertySequenceIdentifier")
-
-            # Extract values from attributes
-            pre_adj = comp.get("PropertySalesAmount")
-            post_adj = comp.get("AdjustedSalesPriceAmount")  # Only applicable for comparables
-            total_adj_percent = comp.get("SalePriceTotalAdjustmentNetPercent")
-            location = comp.find(".//LOCATION")
-
-            # Extract address components with default values
-            if location is not None:
-                street = location.get("PropertyStreetAddress", "Unknown")
-                street2 = location.get("PropertyStreetAddress2", "")  # Capture PropertyStreetAddress2
-                address = f"{street}, {street2}".strip(", ")
-            else:
-                address = "Unknown"
-
-            # Extract ComparableType from SalesConcessions _Description
-            comp_type = "Unknown"
-            for adjustment in comp.findall(".//SALE_PRICE_ADJUSTMENT"):
-                if adjustment.get("_Type") == "SalesConcessions":
-                    comp_type = adjustment.get("_Description", "Unknown")
-                    break  # Use the first SalesConcessions description found
-
-            # Replace "ArmLth" with "Sale" for comparables
-            if comp_type == "ArmLth":
-                comp_type = "Sale"
-
-            # Extract Date of Sale from _Description
-            sale_date = "N/A"
-            for adjustment in comp.findall(".//SALE_PRICE_ADJUSTMENT"):
-                if adjustment.get("_Type") == "DateOfSale":
-                    description = adjustment.get("_Description", "")
-                    if "s" in description:
-                        sale_date = description.split(";")[0].replace("s", "").strip()
-                    break
-
-            # Convert to float if possible
+@app.route('/api/calculate', methods=['POST'])
+@admitted
+@profiling.profiled
+def calculate():
+    # The body is hashed and parsed chunk by chunk as it is received rather
+    # than spooled by the form parser first. Accepts multipart/form-data
+    # with a "file" part, or a bare XML body (?filename= names it). The body
+    # may be sent with Content-Encoding gzip/zstd, and the file itself may
+    # be compressed (report.xml.gz); both are decompressed as they stream.
+    # ?format=columnar returns the comparables as one typed array per field;
+    # ?format=ndjson streams one record per line while the upload is parsed
+    # A request naming its document with X-Report-Digest (the SHA-256 of the
+    # uncompressed XML, as in earlier responses) is answered from the result
+    # cache when it can be, without parsing the body. The body is still
+    # hashed: digests appear in other responses, so a claim alone must not
+    # unlock a cached result.
+    response_format = request.args.get('format', 'rows')
+    if response_format not in ('rows', 'columnar', 'ndjson'):
+        return jsonify({'error': 'format must be "rows", "columnar" or "ndjson"'}), 400
+
+    claimed = request.headers.get('X-Report-Digest', '').strip().lower()
+    if not REPORT_DIGEST.fullmatch(claimed) or profiling.active():
+        claimed = None
+    if claimed:
+        cached = cached_result(claimed, columnar=response_format == 'columnar')
+        if cached is not None:
             try:
-                pre_adj = float(pre_adj) if pre_adj is not None else None
-                post_adj = float(post_adj) if post_adj is not None else None
-            except ValueError:
-                pre_adj = None
-                post_adj = None
-
-            # Determine if this is the subject property or a comparable
-            if property_sequence_id == "0":
-                # Subject property does not have AdjustedSalesPriceAmount
-                subject_property = {
-                    "property_type": "Subject",  # Add property type
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": "",  # Not applicable for subject property
-                    "comp_type": "",  # Not applicable for subject property
-                    "total_adj_percent": "",  # Not applicable for subject property
-                    "sale_date": "",  # Not applicable for subject property
-                }
-            else:
-                # Comparables include AdjustedSalesPriceAmount
-                comp_number += 1
-                comparables.append({
-                    "property_type": f"Comparable {comp_number}",  # Add property type
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": post_adj if post_adj is not None else "N/A",
-                    "comp_type": comp_type,
-                    "total_adj_percent": total_adj_percent if total_adj_percent is not None else "N/A",
-                    "sale_date": sale_date,  # Include sale date
-                })
-
-        # Ensure there are comparables to display
-        if not subject_property:
-            return {"error": "No subject property found in the XML file."}
-        if not comparables:
-            return {"error": "No valid comparable data found in the XML file."}
+                with metrics.stage('ingest'):
+                    upload = stream_upload(request.stream, request.content_type,
+                                           filename=request.args.get('filename'),
+                                           content_encoding=request.headers.get('Content-Encoding'),
+                                           parser=DigestOnly())
+            except UploadError as e:
+                return jsonify({'error': str(e)}), e.status
+            if upload.digest != claimed:
+                return jsonify({'error': 'X-Report-Digest does not match the uploaded document'}), 409
+            headers = {'X-Cache': 'HIT', 'X-Report-Digest': claimed}
+            if response_format == 'ndjson':
+                return app.response_class(cached_records(app.json.loads(cached)),
+                                          mimetype='application/x-ndjson', headers=headers)
+            return app.response_class(cached, mimetype='application/json', headers=headers)
+
+    if response_format == 'ndjson':
+        parser = StreamingReportParser()
+        progress = iter_upload(request.stream, request.content_type,
+                               filename=request.args.get('filename'),
+                               content_encoding=request.headers.get('Content-Encoding'),
+                               parser=parser)
+        try:
+            upload = next(progress)
+        except UploadError as e:
+            return jsonify({'error': str(e)}), e.status
+        return app.response_class(
+            stream_with_context(stream_records(parser.target, upload, progress)),
+            mimetype='application/x-ndjson',
+        )
 
-        # Return the subject property and comparables
-        return {
-            "subject_property": subject_property,
-            "comparables": comparables,
-        }
+    try:
+        with metrics.stage('ingest'):
+            upload = stream_upload(request.stream, request.content_type,
+                                   filename=request.args.get('filename'),
+                                   content_encoding=request.headers.get('Content-Encoding'))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+
+    if upload.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
 
-    except ET.ParseError:
-        return {"error": "Failed to parse XML file. Ensure it is well-formed."}
-    except ValueError as e:
-        return {"error": f"Invalid data in XML file: {str(e)}"}
+    try:
+        payload, hit = analyze_streamed(upload, columnar=response_format == 'columnar', checked=claimed)
+        return app.response_class(payload, mimetype='application/json',
+                                  headers={'X-Cache': 'HIT' if hit else 'MISS',
+                                           'X-Report-Digest': upload.digest})
     except Exception as e:
-        return {"error": f"An unexpected error occurred: {str(e)}"}
+        metrics.ERRORS.labels('exception').inc()
+        return jsonify({'error': str(e)}), 500
+
+def stream_records(target, upload, progress):
+    """NDJSON lines of an analysis, sent as the upload is parsed.
+
+    The subject goes out first, then each comparable as soon as its
+    COMPARABLE_SALE element closes, long before the embedded PDF that
+    trails the document has been read. The last line is the summary: the
+    rest of the result, plus "locations" with the subject coordinates and
+    the distance and bearing of every comparable, which are only known
+    once all comparables are in. A failure is reported as a final
+    {"type": "error"} line. The full result is cached and recorded as for
+    the other formats.
+    """
+    sent = 0  # Records of target.comparables handled so far
+    comp_number = 0
+    subject_found = False
+    pending = []  # Comparables seen before the subject
     try:
-        # Parse the XML file
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-
-        # Initialize lists and variables
-        comparables = []
-        subject_property = None
-        comp_number = 0  # Initialize comparable number
-
-        # Iterate over all "COMPARABLE_SALE" elements
-        for comp in root.findall(".//COMPARABLE_SALE"):
-            # Extract PropertySequenceIdentifier
-            property_sequence_id = comp.get("PropertySequenceIdentifier")
-            print(f"Found PropertySequenceIdentifier: {property_sequence_id}")  # Debug log
-
-            # Extract values from attributes
-            pre_adj = comp.get("PropertySalesAmount")
-            post_adj = comp.get("AdjustedSalesPriceAmount")  # Only applicable for comparables
-            total_adj_percent = comp.get("SalePriceTotalAdjustmentNetPercent")
-            sale_date = comp.get("SaleDate")  # Extract the sale date
-            location = comp.find(".//LOCATION")
-
-            # Extract address components with default values
-            if location is not None:
-                street = location.get("PropertyStreetAddress", "Unknown")
-                street2 = location.get("PropertyStreetAddress2", "")  # Capture PropertyStreetAddress2
-                address = f"{street}, {street2}".strip(", ")
-            else:
-                address = "Unknown"
-
-            # Extract ComparableType from SalesConcessions _Description
-            comp_type = "Unknown"
-            for adjustment in comp.findall(".//SALE_PRICE_ADJUSTMENT"):
-                if adjustment.get("_Type") == "SalesConcessions":
-                    comp_type = adjustment.get("_Description", "Unknown")
-                    break  # Use the first SalesConcessions description found
-
-            # Replace "ArmLth" with "Sale" for comparables
-            if comp_type == "ArmLth":
-                comp_type = "Sale"
-
-            # Convert to float if possible
-            try:
-                pre_adj = float(pre_adj) if pre_adj is not None else None
-                post_adj = float(post_adj) if post_adj is not None else None
-            except ValueError:
-                pre_adj = None
-                post_adj = None
-
-            # Determine if this is the subject property or a comparable
-            if property_sequence_id == "0":
-                # Subject property does not have AdjustedSalesPriceAmount
-                subject_property = {
-                    "property_type": "Subject",  # Add property type
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": "N/A",  # Not applicable for subject property
-                    "comp_type": "N/A",  # Not applicable for subject property
-                    "total_adj_percent": "N/A",  # Not applicable for subject property
-                    "sale_date": "N/A",  # Not applicable for subject property
-                }
-            else:
-                # Comparables include AdjustedSalesPriceAmount
+        for upload in itertools.chain([upload], progress):
+            records = target.comparables
+            while sent < len(records):
+                fields = records[sent]["fields"]
+                sent += 1
+                if fields["sequence"] == "0":
+                    if not subject_found:
+                        subject_found = True
+                        yield encode_json({'type': 'subject',
+                                           'property': subject_row(fields, target.profile.extra_fields)})
+                        yield from pending
+                        pending = []
+                    continue
                 comp_number += 1
-                comparables.append({
-                    "property_type": f"Comparable {comp_number}",  # Add property type
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": post_adj if post_adj is not None else "N/A",
-                    "comp_type": comp_type,
-                    "total_adj_percent": total_adj_percent if total_adj_percent is not None else "N/A",
-                    "sale_date": sale_date if sale_date is not None else "N/A",  # Include sale date
-                })
-
-        # Ensure there are comparables to display
-        if not subject_property:
-            return {"error": "No subject property found in the XML file."}
-        if not comparables:
-            return {"error": "No valid comparable data found in the XML file."}
-
-        # Return the subject property and comparables
-        return {
-            "subject_property": subject_property,
-            "comparables": comparables,
-        }
-
-    except ET.ParseError:
-        return {"error": "Failed to parse XML file. Ensure it is well-formed."}
-    except ValueError as e:
-        return {"error": f"Invalid data in XML file: {str(e)}"}
+                line = encode_json({'type': 'comparable',
+                                    'property': comparable_row(fields, target.profile.extra_fields,
+                                                               comp_number)})
+                if subject_found:
+                    yield line
+                else:
+                    pending.append(line)
+
+        if upload.filename == '':
+            yield encode_json({'type': 'error', 'error': 'No selected file'})
+            return
+        metrics.UPLOAD_BYTES.observe(upload.size)
+        try:
+            results = summarize_report(upload.extracted())
+        except XMLLimitError as e:
+            results = {"error": f"{XML_PARSE_ERROR} {e}"}
+        except ET.ParseError:
+            results = {"error": XML_PARSE_ERROR}
+        store_result(upload.digest, upload.filename, results)
+    except UploadError as e:
+        results = {'error': str(e)}
     except Exception as e:
-        return {"error": f"An unexpected error occurred: {str(e)}"}
-    try:
-        # Parse the XML file
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
+        metrics.ERRORS.labels('exception').inc()
+        results = {'error': str(e)}
+
+    if 'error' in results:
+        yield encode_json({'type': 'error', 'error': results['error']})
+        return
+    yield summary_record(results)
+
+def summary_record(results):
+    """The closing NDJSON line: the result without its rows, plus "locations"."""
+    summary = {name: value for name, value in results.items()
+               if name not in ('subject_property', 'comparables')}
+    subject_property = results['subject_property']
+    summary['locations'] = {
+        'subject': {name: subject_property[name] for name in ('latitude', 'longitude', 'location_source')},
+        'comparables': [{'distance_miles': comp['distance_miles'], 'bearing': comp['bearing']}
+                        for comp in results['comparables']],
+    }
+    return encode_json(dict(summary, type='summary'))
+
+def cached_records(results):
+    """NDJSON lines of a finished result, in the order stream_records() sends them."""
+    yield encode_json({'type': 'subject', 'property': results['subject_property']})
+    for comp in results['comparables']:
+        yield encode_json({'type': 'comparable', 'property': comp})
+    yield summary_record(results)
+
+def cached_result(digest, columnar=False):
+    """Cached serialized result of a document digest, or None."""
+    with metrics.stage('cache'):
+        return result_cache.get(f'{digest}.columnar' if columnar else digest)
+
+def analyze_streamed(upload, columnar=False, checked=None):
+    """Analyze an already streamed upload through the result cache.
+
+    Returns the serialized result and whether it came from the cache. The
+    columnar layout is cached under its own key next to the row layout.
+    The upload has been parsed as it was received, so a hit here only
+    saves the analysis; `checked` is a digest already looked up (and
+    missed) before the body was read.
+    """
+    metrics.UPLOAD_BYTES.observe(upload.size)
+    key = f'{upload.digest}.columnar' if columnar else upload.digest
+    # A profiled request analyzes the upload even if the result is cached
+    if not profiling.active() and upload.digest != checked:
+        cached = cached_result(upload.digest, columnar)
+        if cached is not None:
+            return cached, True
+
+    with metrics.stage('analyze'):
+        try:
+            results = summarize_report(upload.extracted())
+        except XMLLimitError as e:
+            results = {"error": f"{XML_PARSE_ERROR} {e}"}
+        except ET.ParseError:
+            results = {"error": XML_PARSE_ERROR}
+    payload = store_result(upload.digest, upload.filename, results)
+    if columnar and 'error' not in results:
+        with metrics.stage('serialize'):
+            payload = encode_json(to_columnar(results))
+        result_cache.put(key, payload)
+    return payload, False
+
+def analyze_upload(file):
+    """Analyze an uploaded file through the result cache.
+
+    Returns the serialized result and whether it came from the cache.
+    """
+    # Identical uploads are served from the result cache
+    with metrics.stage('hash'):
+        digest = hash_stream(file.stream)
+    metrics.UPLOAD_BYTES.observe(file.stream.seek(0, os.SEEK_END))
+    file.stream.seek(0)
+    if not profiling.active():
+        with metrics.stage('cache'):
+            cached = result_cache.get(digest)
+        if cached is not None:
+            return cached, True
+
+    with metrics.stage('parse'):
+        results = calculate_sensitivity(file)
+    return store_result(digest, file.filename, results), False
+
+def store_result(digest, filename, results):
+    """Serialize a result; cache and record it unless it is an error."""
+    with metrics.stage('serialize'):
+        payload = (app.json.dumps(results) + '\n').encode('utf-8')
+    if 'error' in results:
+        metrics.ERRORS.labels(metrics.error_type(results['error'])).inc()
+    else:
+        metrics.COMPARABLES_EXTRACTED.observe(len(results['comparables']))
+        result_cache.put(digest, payload)
+        if portfolio is not None:
+            portfolio.record(digest, filename, results)
+    return payload
+
+def scaling_factors(args):
+    """Scaling grid from factor_min/factor_max/factor_step request values."""
+    factor_min = float(args.get('factor_min', 0.0))
+    factor_max = float(args.get('factor_max', 2.0))
+    factor_step = float(args.get('factor_step', 0.05))
+    if factor_step <= 0 or factor_max < factor_min:
+        raise ValueError('factor_step must be positive and factor_max >= factor_min')
+    count = int(round((factor_max - factor_min) / factor_step)) + 1
+    if count > MAX_SCALING_FACTORS:
+        raise ValueError(f'At most {MAX_SCALING_FACTORS} scaling factors are allowed')
+    return [round(factor_min + i * factor_step, 6) for i in range(count)]
+
+def simulation_options(args):
+    """Keyword arguments for monte_carlo() from request values."""
+    samples = int(args.get('samples', 100000))
+    if not 1 <= samples <= MAX_SIMULATION_SAMPLES:
+        raise ValueError(f'samples must be between 1 and {MAX_SIMULATION_SAMPLES}')
+    distribution = args.get('distribution', 'normal')
+    if distribution not in ('normal', 'uniform', 'triangular'):
+        raise ValueError('distribution must be normal, uniform or triangular')
+    correlation = args.get('correlation', 'line')
+    if correlation not in ('line', 'type'):
+        raise ValueError('correlation must be line or type')
+    uncertainty_by_type = json.loads(args.get('uncertainty_by_type') or '{}')
+    if not isinstance(uncertainty_by_type, dict):
+        raise ValueError('uncertainty_by_type must be a JSON object')
+    seed = args.get('seed')
+    chunk_size = int(args.get('chunk_size', 250000))
+    if not 1 <= chunk_size <= MAX_SIMULATION_CHUNK:
+        raise ValueError(f'chunk_size must be between 1 and {MAX_SIMULATION_CHUNK}')
+    return {
+        'samples': samples,
+        'uncertainty': float(args.get('uncertainty', 0.10)),
+        'uncertainty_by_type': uncertainty_by_type,
+        'distribution': distribution,
+        'correlation': correlation,
+        'seed': int(seed) if seed not in (None, '') else None,
+        'chunk_size': chunk_size,
+    }
+
+@app.route('/api/simulate', methods=['POST'])
+@admitted
+@profiling.profiled
+def simulate():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
 
-        # Initialize lists and variables
-        comparables = []
-        subject_property = None
-        comp_number = 0  # Initialize comparable number
+    file = request.files['file']
 
-        # Iterate over all "COMPARABLE_SALE" elements
-        for comp in root.findall(".//COMPARABLE_SALE"):
-            # Extract PropertySequenceIdentifier
-            property_sequence_id = comp.get("PropertySequenceIdentifier")
-            print(f"Found PropertySequenceIdentifier: {property_sequence_id}")  # Debug log
-
-            # Extract values from attributes
-            pre_adj = comp.get("PropertySalesAmount")
-            post_adj = comp.get("AdjustedSalesPriceAmount")  # Only applicable for comparables
-            total_adj_percent = comp.get("SalePriceTotalAdjustmentNetPercent")
-            location = comp.find(".//LOCATION")
-
-            # Extract address components with default values
-            if location is not None:
-                street = location.get("PropertyStreetAddress", "Unknown")
-                street2 = location.get("PropertyStreetAddress2", "")  # Capture PropertyStreetAddress2
-                address = f"{street}, {street2}".strip(", ")
-            else:
-                address = "Unknown"
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
 
-            # Extract ComparableType from SalesConcessions _Description
-            comp_type = "Unknown"
-            for adjustment in comp.findall(".//SALE_PRICE_ADJUSTMENT"):
-                if adjustment.get("_Type") == "SalesConcessions":
-                    comp_type = adjustment.get("_Description", "Unknown")
-                    break  # Use the first SalesConcessions description found
+    try:
+        options = simulation_options(request.values)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-            # Convert to float if possible
-            try:
-                pre_adj = float(pre_adj) if pre_adj is not None else None
-                post_adj = float(post_adj) if post_adj is not None else None
-            except ValueError:
-                pre_adj = None
-                post_adj = None
+    try:
+        payload, _ = analyze_upload(file)
+        results = app.json.loads(payload)
+        if 'error' in results:
+            return jsonify(results)
+        return jsonify(monte_carlo(results, **options))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-            # Determine if this is the subject property or a comparable
-            if property_sequence_id == "0":
-                # Subject property does not have AdjustedSalesPriceAmount
-                subject_property = {
-                    "property_type": "Subject",  # Add property type
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": "N/A",  # Not applicable for subject property
-                    "comp_type": "N/A",  # Not applicable for subject property
-                    "total_adj_percent": "N/A",  # Not applicable for subject property
-                }
-            else:
-                # Comparables include AdjustedSalesPriceAmount
-                comp_number += 1
-                comparables.append({
-                    "property_type": f"Comparable {comp_number}",  # Add property type
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": post_adj if post_adj is not None else "N/A",
-                    "comp_type": comp_type,
-                    "total_adj_percent": total_adj_percent if total_adj_percent is not None else "N/A",
-                })
+@app.route('/api/sensitivity', methods=['POST'])
+@admitted
+@profiling.profiled
+def sensitivity():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
 
-        # Ensure there are comparables to display
-        if not subject_property:
-            return {"error": "No subject property found in the XML file."}
-        if not comparables:
-            return {"error": "No valid comparable data found in the XML file."}
+    file = request.files['file']
 
-        # Return the subject property and comparables
-        return {
-            "subject_property": subject_property,
-            "comparables": comparables,
-        }
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
 
-    except ET.ParseError:
-        return {"error": "Failed to parse XML file. Ensure it is well-formed."}
-    except ValueError as e:
-        return {"error": f"Invalid data in XML file: {str(e)}"}
-    except Exception as e:
-        return {"error": f"An unexpected error occurred: {str(e)}"}
     try:
-        # Parse the XML file
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-
-        # Initialize lists and variables
-        comparables = []
-        subject_property = None
-        comp_number = 0  # Initialize comparable number
-
-        # Iterate over all "COMPARABLE_SALE" elements
-        for comp in root.findall(".//COMPARABLE_SALE"):
-            # Extract PropertySequenceIdentifier
-            property_sequence_id = comp.get("PropertySequenceIdentifier")
-            print(f"Found PropertySequenceIdentifier: {property_sequence_id}")  # Debug log
-
-            # Extract values from attributes
-            pre_adj = comp.get("PropertySalesAmount")
-            post_adj = comp.get("AdjustedSalesPriceAmount")  # Only applicable for comparables
-            total_adj_percent = comp.get("SalePriceTotalAdjustmentNetPercent")
-            location = comp.find(".//LOCATION")
-
-            # Extract address components with default values
-            if location is not None:
-                street = location.get("PropertyStreetAddress", "Unknown")
-                city = location.get("PropertyCity", "Unknown")
-                state = location.get("PropertyState", "Unknown")
-                postal_code = location.get("PropertyPostalCode", "Unknown")
-                address = f"{street}, {city}, {state} {postal_code}"
-            else:
-                address = "Unknown"
+        factors = scaling_factors(request.values)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-            # Extract ComparableType from SalesConcessions _Description
-            comp_type = "Unknown"
-            for adjustment in comp.findall(".//SALE_PRICE_ADJUSTMENT"):
-                if adjustment.get("_Type") == "SalesConcessions":
-                    comp_type = adjustment.get("_Description", "Unknown")
-                    break  # Use the first SalesConcessions description found
+    try:
+        payload, _ = analyze_upload(file)
+        results = app.json.loads(payload)
+        if 'error' in results:
+            return jsonify(results)
+        return jsonify(adjustment_sensitivity(results, factors))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def comp_sensitivity(record, factors):
+    """Sensitivity of one comparable record through the result cache.
+
+    Returns the analysis and whether it came from the cache.
+    """
+    key = f'comp.{record_digest(record, factors)}'
+    cached = result_cache.get(key)
+    if cached is not None:
+        return json.loads(cached), True
+    amounts = {t: line['amount'] for t, line in record['lines'].items()
+               if line['amount'] is not None}
+    analysis = comparable_sensitivity(record['row']['post_adj'], amounts, factors)
+    result_cache.put(key, encode_json(analysis))
+    return analysis, False
+
+@app.route('/api/diff', methods=['POST'])
+@admitted
+def diff_revisions():
+    # Two revisions of the same report as "old" and "new" file parts
+    for name in ('old', 'new'):
+        if name not in request.files:
+            return jsonify({'error': f'No {name} file part'}), 400
+        if request.files[name].filename == '':
+            return jsonify({'error': f'No selected {name} file'}), 400
 
-            # Convert to float if possible
-            try:
-                pre_adj = float(pre_adj) if pre_adj is not None else None
-                post_adj = float(post_adj) if post_adj is not None else None
-            except ValueError:
-                pre_adj = None
-                post_adj = None
+    try:
+        factors = scaling_factors(request.values)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-            # Determine if this is the subject property or a comparable
-            if property_sequence_id == "0":
-                # Subject property does not have AdjustedSalesPriceAmount
-                subject_property = {
-                    "comp_number": "Subject",
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": "",  # Not applicable for subject property
-                    "comp_type": "",  # Not applicable for subject property
-                    "total_adj_percent": "",  # Not applicable for subject property
-                }
-            else:
-                # Comparables include AdjustedSalesPriceAmount
-                comp_number += 1
-                comparables.append({
-                    "comp_number": f"Comp {comp_number}",
-                    "address": address,
-                    "pre_adj": pre_adj if pre_adj is not None else "N/A",
-                    "post_adj": post_adj if post_adj is not None else "N/A",
-                    "comp_type": comp_type,
-                    "total_adj_percent": total_adj_percent if total_adj_percent is not None else "N/A",
-                })
+    try:
+        results = {}
+        for name in ('old', 'new'):
+            payload, _ = analyze_upload(request.files[name])
+            results[name] = app.json.loads(payload)
+            if 'error' in results[name]:
+                return jsonify({'error': f'{name}: {results[name]["error"]}'})
+
+        diff, records = diff_results(results['old'], results['new'])
+        diff['report'] = {name: result['report'] for name, result in results.items()}
+
+        # Per-comparable sensitivity of the new revision. Results are cached
+        # by comparable content. An unchanged comp hashes the same as its old
+        # revision, so it carries the old revision's analysis (computed once
+        # and cached if not seen before). Only changed and added comps that
+        # are not in the cache count as recomputed.
+        diff['sensitivity'] = []
+        reused = recomputed = 0
+        for record, status in records:
+            row = record['row']
+            analysis = None
+            if isinstance(row['post_adj'], (int, float)):
+                analysis, cached = comp_sensitivity(record, factors)
+                if cached or status == 'unchanged':
+                    reused += 1
+                else:
+                    recomputed += 1
+            diff['sensitivity'].append({
+                'property_type': row['property_type'],
+                'status': status,
+                'analysis': analysis,
+            })
+        diff['reused'] = reused
+        diff['recomputed'] = recomputed
+        return jsonify(diff)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Asynchronous analysis jobs, run on the shared process pool
+JOB_MAX_WAIT = 30  # Longest long-poll a client may request, in seconds
+# Job states are shared through SQLite so that any worker process can
+# answer a poll. Set JOB_STORE_PATH to an empty string for a single process.
+JOB_STORE_PATH = os.environ.get(
+    'JOB_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.sqlite3'),
+)
+job_manager = JobManager(
+    lambda: get_process_pool(),
+    max_pending=int(os.environ.get('JOB_QUEUE_SIZE', 32)),
+    retention=int(os.environ.get('JOB_RETENTION', 600)),
+    timeout=int(os.environ.get('JOB_TIMEOUT', 600)),
+    store=JobStore(JOB_STORE_PATH) if JOB_STORE_PATH else None,
+)
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
 
-        # Ensure there are comparables to display
-        if not subject_property:
-            return {"error": "No subject property found in the XML file."}
-        if not comparables:
-            return {"error": "No valid comparable data found in the XML file."}
+    file = request.files['file']
 
-        # Return the subject property and comparables
-        return {
-            "subject_property": subject_property,
-            "comparables": comparables,
-        }
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
 
-    except ET.ParseError:
-        return {"error": "Failed to parse XML file. Ensure it is well-formed."}
+    # Compressed files (report.xml.gz) are expanded here so the digest
+    # matches the one /api/calculate computes for the same document
+    try:
+        data = read_upload_bytes(file.stream)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    filename = strip_compression_suffix(file.filename)
+    digest = hashlib.sha256(data).hexdigest()
+    cached = result_cache.get(digest)
+    try:
+        if cached is not None:
+            job = job_manager.complete(filename, app.json.loads(cached))
+        else:
+
+            def on_result(result):
+                result_cache.put(digest, (app.json.dumps(result) + '\n').encode('utf-8'))
+                if portfolio is not None:
+                    portfolio.record(digest, filename, result)
+
+            job = job_manager.submit(filename, analyze_bytes, data, on_result=on_result)
+    except QueueFull:
+        return jsonify({'error': 'Too many jobs in progress, try again shortly'}), 503, {'Retry-After': '5'}
+
+    response = jsonify(job.to_dict(include_result=False))
+    response.status_code = 202
+    response.headers['Location'] = f'/api/jobs/{job.id}'
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # ?wait=N holds the request open up to N seconds until the job finishes
+    try:
+        wait = min(float(request.args.get('wait', 0)), JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+
+    job = job_manager.get(job_id, wait=wait)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/portfolio/comparables', methods=['GET'])
+def portfolio_comparables():
+    # Earlier uses of a comparable, by MLS number, address, project and/or sale month
+    if portfolio is None:
+        return jsonify({'error': 'Portfolio store is disabled'}), 404
+    try:
+        uses = portfolio.comparable_uses(
+            mls_number=request.args.get('mls'),
+            address=request.args.get('address'),
+            project_name=request.args.get('project'),
+            sale_month_from=request.args.get('from'),
+            sale_month_to=request.args.get('to'),
+            limit=min(int(request.args.get('limit', 100)), 1000),
+        )
     except ValueError as e:
-        return {"error": f"Invalid data in XML file: {str(e)}"}
-    except Exception as e:
-        return {"error": f"An unexpected error occurred: {str(e)}"}
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'uses': uses, 'count': len(uses)})
+
+# Largest radius accepted by /api/portfolio/nearby, in miles
+MAX_NEARBY_RADIUS = 25
+
+@app.route('/api/portfolio/nearby', methods=['GET'])
+def portfolio_nearby():
+    # Closed sales within ?radius= miles of ?lat=&lon=, or of the subject of
+    # a stored report (?report=<digest>, excluding that report's own comps)
+    # when the report gives the subject's coordinates; ?months=12 keeps the
+    # last 12 sale months up to ?as_of=yyyy-mm
+    if nearby_sales is None:
+        return jsonify({'error': 'Portfolio store is disabled'}), 404
     try:
-        # Parse the XML file
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-
-        # Initialize lists and variables
-        comparables = []
-        subject_property = None
-        comp_number = 0  # Initialize comparable number
-
-        # Iterate over all "COMPARABLE_SALE" elements
-        for comp in root.findall(".//COMPARABLE_SALE"):
-            # Extract PropertySequenceIdentifier
-            property_sequence_id = comp.get("PropertySequenceIdentifier")
-            print(f"Found PropertySequenceIdentifier: {property_sequence_id}")  # Debug log
-
-            # Extract values from attributes
-            pre_adj = comp.get("PropertySalesAmount")
-            post_adj = comp.get("AdjustedSalesPriceAmount")
-            total_adj_percent = comp.get("SalePriceTotalAdjustmentNetPercent")
-            location = comp.find(".//LOCATION")
-
-            # Extract address components with default values
-            if location is not None:
-                street = location.get("PropertyStreetAddress", "Unknown")
-                city = location.get("PropertyCity", "Unknown")
-                state = location.get("PropertyState", "Unknown")
-                postal_code = location.get("PropertyPostalCode", "Unknown")
-                address = f"{street}, {city}, {state} {postal_code}"
-            else:
-                address = "Unknown"
-
-            # Extract ComparableType from SalesConcessions _Description
-            comp_type = "Unknown"
-            for adjustment in comp.findall(".//SALE_PRICE_ADJUSTMENT"):
-                if adjustment.get("_Type") == "SalesConcessions":
-                    comp_type = adjustment.get("_Description", "Unknown")
-                    break  # Use the first SalesConcessions description found
-
-            # Skip if pre_adj or post_adj is missing
-            if pre_adj is None or post_adj is None:
-                continue
-
-            # Convert to float
-            try:
-                pre_adj = float(pre_adj)
-                post_adj = float(post_adj)
-            except ValueError:
-                continue
-
-            # Determine if this is the subject property or a comparable
-            if property_sequence_id == "0":
-                subject_property = {
-                    "comp_number": "Subject",
-                    "address": address,
-                    "pre_adj": pre_adj,
-                    "post_adj": post_adj,
-                    "comp_type": comp_type,
-                    "total_adj_percent": total_adj_percent,
-                }
-            else:
-                comp_number += 1
-                comparables.append({
-                    "comp_number": f"Comp {comp_number}",
-                    "address": address,
-                    "pre_adj": pre_adj,
-                    "post_adj": post_adj,
-                    "comp_type": comp_type,
-                    "total_adj_percent": total_adj_percent,
-                })
-
-        # Ensure there are comparables to display
-        if not subject_property:
-            return {"error": "No subject property found in the XML file."}
-        if not comparables:
-            return {"error": "No valid comparable data found in the XML file."}
-
-        # Return the subject property and comparables
-        return {
-            "subject_property": subject_property,
-            "comparables": comparables,
-        }
-
-    except ET.ParseError:
-        return {"error": "Failed to parse XML file. Ensure it is well-formed."}
+        report_id = request.args.get('report')
+        if report_id:
+            location = portfolio.subject_location(report_id)
+            if location is None:
+                return jsonify({'error': 'No reported subject location for this report'}), 404
+            lat, lon = location
+        else:
+            lat, lon = float(request.args['lat']), float(request.args['lon'])
+        radius = float(request.args.get('radius', 0.5))
+        if not 0 < radius <= MAX_NEARBY_RADIUS:
+            raise ValueError(f'radius must be between 0 and {MAX_NEARBY_RADIUS} miles')
+        months = request.args.get('months')
+        start = time.perf_counter()
+        sales = nearby_sales.query(
+            lat, lon, radius,
+            months=int(months) if months else None,
+            as_of=request.args.get('as_of'),
+            exclude_report=report_id,
+            limit=min(int(request.args.get('limit', 100)), 1000),
+        )
+    except KeyError:
+        return jsonify({'error': 'lat and lon, or report, are required'}), 400
     except ValueError as e:
-        return {"error": f"Invalid data in XML file: {str(e)}"}
-    except Exception as e:
-        return {"error": f"An unexpected error occurred: {str(e)}"}
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'center': {'latitude': lat, 'longitude': lon},
+        'sales': sales,
+        'count': len(sales),
+        'query_ms': round((time.perf_counter() - start) * 1000, 3),
+    })
+
+@app.route('/api/portfolio/validation', methods=['GET'])
+def portfolio_validation():
+    # Consistency and guideline checks over every stored comparable at once;
+    # ?limit= caps the findings listed
+    if portfolio is None:
+        return jsonify({'error': 'Portfolio store is disabled'}), 404
     try:
-        # Parse the XML file
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-
-        # Initialize lists and variables
-        comparables = []
-        subject_property = None
-        comp_number = 0  # Initialize comparable number
-
-        # Iterate over all "COMPARABLE_SALE" elements
-        for comp in root.findall(".//COMPARABLE_SALE"):
-            # Extract values from attributes
-            pre_adj = comp.get("PropertySalesAmount")
-            post_adj = comp.get("AdjustedSalesPriceAmount")
-            total_adj_percent = comp.get("SalePriceTotalAdjustmentNetPercent")
-            location = comp.find(".//LOCATION")
-
-            # Extract address components with default values
-            if location is not None:
-                street = location.get("PropertyStreetAddress", "Unknown")
-                city = location.get("PropertyCity", "Unknown")
-                state = location.get("PropertyState", "Unknown")
-                postal_code = location.get("PropertyPostalCode", "Unknown")
-                address = f"{street}, {city}, {state} {postal_code}"
-            else:
-                address = "Unknown"
-
-            # Extract ComparableType from SalesConcessions _Description
-            comp_type = "Unknown"
-            for adjustment in comp.findall(".//SALE_PRICE_ADJUSTMENT"):
-                if adjustment.get("_Type") == "SalesConcessions":
-                    comp_type = adjustment.get("_Description", "Unknown")
-                    break  # Use the first SalesConcessions description found
-
-            # Skip if pre_adj or post_adj is missing
-            if pre_adj is None or post_adj is None:
-                continue
-
-            # Convert to float
-            try:
-                pre_adj = float(pre_adj)
-                post_adj = float(post_adj)
-            except ValueError:
-                continue
-
-            # Determine if this is the subject property or a comparable
-            if comp.get("PropertySequenceIdentifier") == "0":
-                subject_property = {
-                    "comp_number": "Subject",
-                    "address": address,
-                    "pre_adj": pre_adj,
-                    "post_adj": post_adj,
-                    "comp_type": comp_type,
-                    "total_adj_percent": total_adj_percent,
-                }
-            else:
-                comp_number += 1
-                comparables.append({
-                    "comp_number": f"Comp {comp_number}",
-                    "address": address,
-                    "pre_adj": pre_adj,
-                    "post_adj": post_adj,
-                    "comp_type": comp_type,
-                    "total_adj_percent": total_adj_percent,
-                })
-
-        # Ensure there are comparables to display
-        if not subject_property:
-            return {"error": "No subject property found in the XML file."}
-        if not comparables:
-            return {"error": "No valid comparable data found in the XML file."}
-
-        # Return the subject property and comparables
-        return {
-            "subject_property": subject_property,
-            "comparables": comparables,
-        }
-
-    except ET.ParseError:
-        return {"error": "Failed to parse XML file. Ensure it is well-formed."}
+        limit = min(int(request.args.get('limit', 100)), 10000)
     except ValueError as e:
-        return {"error": f"Invalid data in XML file: {str(e)}"}
-    except Exception as e:
-        return {"error": f"An unexpected error occurred: {str(e)}"}
-
-@app.route('/api/calculate', methods=['POST'])
-def calculate():
+        return jsonify({'error': str(e)}), 400
+    start = time.perf_counter()
+    with metrics.stage('load'):
+        data = portfolio.validation_data()
+    with metrics.stage('validate'):
+        sweep = validate_portfolio(data, limit)
+    sweep['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+    return jsonify(sweep)
+
+def market_options(args):
+    """Keyword arguments for MarketModel.fit() from request values."""
+    area = args.get('area', '')
+    digits = int(args.get('digits', len(area) if area else 5))
+    if not 0 <= digits <= 5:
+        raise ValueError('digits must be between 0 and 5')
+    features = tuple(args.get('features', ','.join(DEFAULT_FEATURES)).split(','))
+    unknown = [name for name in features if name not in FEATURES]
+    if unknown or not features:
+        raise ValueError(f'features must be a comma separated list of {", ".join(FEATURES)}')
+    confidence = float(args.get('confidence', 0.95))
+    if not 0 < confidence < 1:
+        raise ValueError('confidence must be between 0 and 1')
+    return {'area_digits': digits, 'features': features, 'confidence': confidence}
+
+@app.route('/api/market/adjustments', methods=['GET'])
+def market_adjustments():
+    # Market-implied per-unit adjustments by postal area (?area=84405, or
+    # ?digits=3 for every 3-digit area; digits=0 pools the whole portfolio)
+    if market_model is None:
+        return jsonify({'error': 'Portfolio store is disabled'}), 404
+    try:
+        options = market_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    start = time.perf_counter()
+    area = request.args.get('area')
+    areas = market_model.fit(areas=[area[:options['area_digits']]] if area else None, **options)
+    if area and not areas:
+        return jsonify({'error': f'No closed sales in area {area}'}), 404
+    return jsonify({'areas': areas, 'elapsed_seconds': round(time.perf_counter() - start, 3)})
+
+@app.route('/api/market/conditions', methods=['GET'])
+def market_conditions():
+    # Market conditions trend per quarter for a ZIP code (?postal_code=84404,
+    # or the ZIP of a stored report with ?report=<digest>), optionally only
+    # some ?types=MedianSalesPrice,TotalSales; ?scope=project for the condo
+    # project grid
+    if portfolio is None:
+        return jsonify({'error': 'Portfolio store is disabled'}), 404
+    report_id = request.args.get('report')
+    if report_id:
+        postal_code = portfolio.market_postal_code(report_id)
+        if postal_code is None:
+            return jsonify({'error': 'No market conditions for this report'}), 404
+    else:
+        postal_code = normalize_postal_code(request.args.get('postal_code'))
+        if postal_code is None:
+            return jsonify({'error': 'A five digit postal_code, or report, is required'}), 400
+    scope = request.args.get('scope', 'neighborhood')
+    if scope not in SCOPES:
+        return jsonify({'error': f'scope must be one of {", ".join(SCOPES)}'}), 400
+    types = request.args.get('types')
+
+    start = time.perf_counter()
+    rollups = portfolio.market_rollups(postal_code, scope, types.split(',') if types else None)
+    return jsonify({
+        'postal_code': postal_code,
+        'scope': scope,
+        'series': trend_series(rollups),
+        'query_ms': round((time.perf_counter() - start) * 1000, 3),
+    })
+
+@app.route('/api/market/compare', methods=['POST'])
+@admitted
+def market_compare():
+    # The uploaded report's adjustments against the market rates of its
+    # area, by default the most common postal code of its comparables
+    if market_model is None:
+        return jsonify({'error': 'Portfolio store is disabled'}), 404
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
 
@@ -678,13 +983,186 @@ def calculate():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    if file:
-        try:
-            results = calculate_sensitivity(file)
+    try:
+        options = market_options(request.values)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        payload, _ = analyze_upload(file)
+        results = app.json.loads(payload)
+        if 'error' in results:
             return jsonify(results)
+
+        area = request.values.get('area', '')[:options['area_digits']]
+        if not area:
+            codes = [comp['postal_code'] for comp in results['comparables'] if comp.get('postal_code')]
+            area = max(set(codes), key=codes.count)[:options['area_digits']] if codes else ''
+        fits = market_model.fit(areas=[area], **options)
+        if not fits:
+            return jsonify({'error': f'No closed sales in area {area}'}), 404
+        if 'error' in fits[0]:
+            return jsonify(fits[0])
+        return jsonify({
+            'market': fits[0],
+            'comparables': compare_report(results, fits[0], options['features']),
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/pdf', methods=['POST'])
+@admitted
+def embedded_pdf():
+    # The base64 text of the EMBEDDED_FILE is decoded as the upload streams
+    # in and written straight to the PDF cache; it is never held in memory.
+    # Accepts the same bodies as /api/calculate.
+    temp = pdf_cache.create()
+    try:
+        upload = stream_upload(request.stream, request.content_type,
+                               filename=request.args.get('filename'),
+                               content_encoding=request.headers.get('Content-Encoding'),
+                               parser=EmbeddedFileParser(temp))
+        embedded = upload.extracted()
+    except UploadError as e:
+        pdf_cache.discard(temp)
+        return jsonify({'error': str(e)}), e.status
+    except XMLLimitError as e:
+        pdf_cache.discard(temp)
+        return jsonify({'error': f'{XML_PARSE_ERROR} {e}'}), 400
+    except (ET.ParseError, ValueError):
+        pdf_cache.discard(temp)
+        return jsonify({'error': XML_PARSE_ERROR}), 400
+    except Exception:
+        pdf_cache.discard(temp)
+        raise
+
+    if embedded is None:
+        pdf_cache.discard(temp)
+        return jsonify({'error': 'No embedded PDF found in the XML file.'}), 404
+
+    path = pdf_cache.commit(temp, upload.digest)
+    name = os.path.splitext(upload.filename or 'report')[0] + '.pdf'
+    return send_pdf(path, upload.digest, name)
+
+@app.route('/api/pdf/<digest>', methods=['GET'])
+def cached_pdf(digest):
+    # Digests are the X-Report-Digest of an earlier upload (and the
+    # portfolio report_id)
+    try:
+        path = pdf_cache.get(digest)
+    except ValueError:
+        return jsonify({'error': 'Invalid report digest'}), 400
+    if path is None:
+        return jsonify({'error': 'No cached PDF for this report'}), 404
+    return send_pdf(path, digest, f'{digest[:12]}.pdf')
+
+def send_pdf(path, digest, name):
+    """Stream a cached PDF from disk in fixed-size blocks."""
+    response = send_file(path, mimetype='application/pdf', download_name=name,
+                         etag=digest, conditional=True, max_age=3600)
+    response.headers['X-Report-Digest'] = digest
+    return response
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    stats = result_cache.snapshot()
+    stats['pdf'] = pdf_cache.snapshot()
+    return jsonify(stats)
+
+def get_process_pool():
+    """Return the shared process pool used for CPU-bound parsing."""
+    global _process_pool
+    if _process_pool is None:
+        method = POOL_START_METHOD
+        if method not in multiprocessing.get_all_start_methods():
+            method = 'spawn'
+        _process_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS,
+                                            mp_context=multiprocessing.get_context(method))
+    return _process_pool
+
+def analyze_bytes(data):
+    """Run calculate_sensitivity on an in-memory document (pool entry point)."""
+    return calculate_sensitivity(io.BytesIO(data))
+
+def collect_batch_files(uploads):
+    """Expand uploaded parts into (filename, bytes) pairs.
+
+    Plain parts are taken as XML documents; ZIP archives contribute every
+    .xml member. Repeated names get a " (n)" suffix so results stay keyed
+    by filename.
+    """
+    files = []
+    for upload in uploads:
+        if upload.filename == '':
+            continue
+        data = upload.read()
+        if upload.filename.lower().endswith('.zip') or zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    name = info.filename
+                    if info.is_dir() or name.startswith('__MACOSX/'):
+                        continue
+                    if name.lower().endswith('.xml'):
+                        files.append((os.path.basename(name), archive.read(info)))
+        else:
+            files.append((upload.filename, data))
+
+    named = []
+    counts = {}
+    for name, data in files:
+        counts[name] = counts.get(name, 0) + 1
+        if counts[name] > 1:
+            name = f"{name} ({counts[name]})"
+        named.append((name, data))
+    return named
+
+@app.route('/api/calculate/batch', methods=['POST'])
+@admitted
+def calculate_batch():
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    if not uploads:
+        return jsonify({'error': 'No file part'}), 400
+
+    try:
+        files = collect_batch_files(uploads)
+    except zipfile.BadZipFile:
+        return jsonify({'error': 'Uploaded archive is not a valid ZIP file'}), 400
+
+    if not files:
+        return jsonify({'error': 'No XML files found in the upload'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'Too many files in batch (limit {BATCH_MAX_FILES})'}), 413
+
+    start = time.perf_counter()
+
+    # Fan the documents out to the process pool, then gather in upload order
+    pool = get_process_pool()
+    futures = [
+        (name, hashlib.sha256(data).hexdigest(), pool.submit(analyze_bytes, data))
+        for name, data in files
+    ]
+    results = {}
+    for name, digest, future in futures:
+        try:
+            results[name] = future.result()
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            results[name] = {'error': f'An unexpected error occurred: {str(e)}'}
+        if portfolio is not None:
+            portfolio.record(digest, name, results[name])
+
+    failed = sum(1 for result in results.values() if 'error' in result)
+    totals = {
+        'files': len(results),
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'comparables': sum(len(result.get('comparables', [])) for result in results.values()),
+        'elapsed_seconds': round(time.perf_counter() - start, 3),
+    }
+
+    return jsonify({'results': results, 'totals': totals})
 
 if __name__ == '__main__':
+    # Development server only; in production run gunicorn with
+    # gunicorn.conf.py (see there). FLASK_DEBUG=1 enables the debugger.
     port = int(os.environ.get('PORT', 8080))  # Default to 8080 if PORT is not set
-    app.run(debug=True, port=port)
\ No newline at end of file
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', port=port)
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Benchmarks measure the parse path: no result caching, no portfolio writes
+os.environ.setdefault("RESULT_CACHE_PATH", "")
+os.environ.setdefault("RESULT_CACHE_ENTRIES", "0")
+os.environ.setdefault("PORTFOLIO_PATH", "")
+
+# Make the backend modules importable when run from any directory
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
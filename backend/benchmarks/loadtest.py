@@ -0,0 +1,159 @@
+"""Closed-loop HTTP load test for /api/calculate.
+
+Start the server, e.g. from backend/:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+then, from backend/benchmarks:
+
+    python loadtest.py ../../13-185-1W.xml --concurrency 16 --duration 30
+    python loadtest.py ../../13-185-1W.xml --unique     # defeat the result cache
+
+Each of --concurrency client threads keeps one request in flight on its
+own keep-alive connection for --duration seconds. --unique appends a
+distinct XML comment to every upload so each request is a cache miss and
+measures the full parse path; without it most requests are cache hits.
+--digest sends the document's SHA-256 as X-Report-Digest, which lets the
+server answer a repeat upload from the cache without parsing it.
+Clients that are shed with 429/503 wait for the Retry-After the server
+sends before their next request, as well-behaved clients do
+(--no-backoff retries at once). Prints requests per second, latency
+percentiles of successful and shed requests, status codes and the
+X-Cache hit ratio.
+"""
+import argparse
+import hashlib
+import http.client
+import itertools
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+def _multipart(document, filename):
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/xml\r\n\r\n"
+    ).encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return head + document + tail, f"multipart/form-data; boundary={boundary}"
+
+
+def _percentile(ordered, q):
+    if not ordered:
+        return float("nan")
+    index = min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(url, document, filename, concurrency, duration, unique, backoff=True, digest=False):
+    target = urlsplit(url)
+    path = (target.path or "/api/calculate") + (f"?{target.query}" if target.query else "")
+    counter = itertools.count()
+    deadline = time.monotonic() + duration
+    latencies = []
+    shed = []
+    statuses = Counter()
+    cache = Counter()
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+        local_latencies, local_shed, local_statuses, local_cache = [], [], Counter(), Counter()
+        while time.monotonic() < deadline:
+            body = document
+            if unique:
+                body = document + f"<!-- load test {next(counter)} -->".encode("ascii")
+            payload, content_type = _multipart(body, filename)
+            headers = {"Content-Type": content_type}
+            if digest:
+                headers["X-Report-Digest"] = hashlib.sha256(body).hexdigest()
+            start = time.perf_counter()
+            try:
+                conn.request("POST", path, body=payload, headers=headers)
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                local_statuses["connection error"] += 1
+                conn.close()
+                conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+                continue
+            elapsed = time.perf_counter() - start
+            local_statuses[response.status] += 1
+            if response.status in (429, 503):
+                local_shed.append(elapsed)
+                if backoff:
+                    pause = float(response.getheader("Retry-After", 1))
+                    time.sleep(min(pause, max(0.0, deadline - time.monotonic())))
+                continue
+            local_latencies.append(elapsed)
+            local_cache[response.getheader("X-Cache", "-")] += 1
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            shed.extend(local_shed)
+            statuses.update(local_statuses)
+            cache.update(local_cache)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    shed.sort()
+    return {
+        "requests": len(latencies) + len(shed),
+        "served": len(latencies),
+        "elapsed": elapsed,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p90_ms": _percentile(latencies, 90) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else float("nan")) * 1000,
+        "shed_p50_ms": _percentile(shed, 50) * 1000,
+        "shed_p99_ms": _percentile(shed, 99) * 1000,
+        "statuses": dict(statuses),
+        "cache": dict(cache),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the /api/calculate endpoint.")
+    parser.add_argument("report", help="appraisal XML file to upload")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/api/calculate")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--unique", action="store_true",
+                        help="make every upload distinct so none is served from the cache")
+    parser.add_argument("--no-backoff", action="store_true",
+                        help="retry shed requests at once instead of honoring Retry-After")
+    parser.add_argument("--digest", action="store_true",
+                        help="send X-Report-Digest so cached results skip the parse")
+    args = parser.parse_args(argv)
+
+    with open(args.report, "rb") as f:
+        document = f.read()
+
+    stats = run(args.url, document, args.report.rsplit("/", 1)[-1],
+                args.concurrency, args.duration, args.unique, backoff=not args.no_backoff,
+                digest=args.digest)
+    print(f"{stats['requests']} requests in {stats['elapsed']:.1f}s "
+          f"with {args.concurrency} clients ({len(document) / 1e6:.1f} MB report)")
+    print(f"  {stats['rps']:.1f} requests/s served ({stats['served']} not shed)")
+    print(f"  latency p50 {stats['p50_ms']:.1f} ms, p90 {stats['p90_ms']:.1f} ms, "
+          f"p99 {stats['p99_ms']:.1f} ms, max {stats['max_ms']:.1f} ms")
+    if stats["served"] < stats["requests"]:
+        print(f"  shed latency p50 {stats['shed_p50_ms']:.1f} ms, p99 {stats['shed_p99_ms']:.1f} ms")
+    print(f"  status {stats['statuses']}  X-Cache {stats['cache']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Synthetic MISMO 2.6 GSE appraisal generator for benchmarks.
+
+Produces documents shaped like the sample reports in the repository root:
+REPORT/FORM with market inventory, an EMBEDDED_FILE PDF payload (base64,
+76-character lines), and a SALES_COMPARISON section with the subject
+(PropertySequenceIdentifier 0) followed by the comparables. Line amounts,
+totals and net/gross percentages are internally consistent.
+
+Usage:
+    python synthetic.py OUTPUT.xml [--comps 6] [--adjustments 24] [--pdf-bytes 2000000]
+"""
+import argparse
+import base64
+import random
+from xml.sax.saxutils import quoteattr
+
+# Adjustment lines in the order the sample reports list them
+ADJUSTMENT_TYPES = [
+    ("SalesConcessions", "ArmLth", False),
+    ("FinancingConcessions", "Conv;0", True),
+    ("DateOfSale", None, False),
+    ("Location", "N;Res;", True),
+    ("PropertyRights", "Fee Simple", False),
+    ("SiteArea", "0.19 ac", True),
+    ("View", "N;Res;", True),
+    ("DesignStyle", "DT2;2Stry", True),
+    ("Quality", "Q4", True),
+    ("Age", "30", True),
+    ("Condition", "C4", True),
+    ("BasementArea", "574sf574sfin", True),
+    ("BasementFinish", "1rr0br1.0ba0o", True),
+    ("FunctionalUtility", "Good", True),
+    ("HeatingCooling", "GFWA/CAC", True),
+    ("EnergyEfficient", "Thermopane", True),
+    ("CarStorage", "2ga2dw", True),
+    ("PorchDeck", "PrchDck", True),
+    ("GrossLivingArea", "1148", True),
+    ("CommonElements", "Parking", False),
+    ("FloorLocation", "1", False),
+    ("MaintenanceFees", "190", False),
+    ("MonthlyFacilityFee", "190", False),
+    ("Other", "Lndscp", True),
+]
+
+MONTH_RANGES = ("Prior7To12Months", "Prior4To6Months", "Last3Months")
+INVENTORY_TYPES = ("TotalSales", "AbsorptionRate", "TotalListings", "MedianSalesPrice",
+                   "MedianSalesDOM", "MedianListPrice")
+
+# Center of the generated neighborhood
+BASE_LATITUDE = 41.2403
+BASE_LONGITUDE = -111.9348
+
+
+def _attrs(**values):
+    return " ".join(f"{key}={quoteattr(str(value))}" for key, value in values.items() if value is not None)
+
+
+def _adjustment_lines(rng, count, is_subject):
+    """SALE_PRICE_ADJUSTMENT elements plus the sum of their amounts."""
+    lines = []
+    total = gross = 0
+    for i in range(count):
+        adj_type, description, adjustable = ADJUSTMENT_TYPES[i % len(ADJUSTMENT_TYPES)]
+        attrs = {"_Type": adj_type}
+        if i >= len(ADJUSTMENT_TYPES) or adj_type == "Other":
+            attrs["_Type"] = "Other"
+            attrs["_TypeOtherDescription"] = f"Feature{i}"
+        if adj_type == "DateOfSale":
+            month = rng.randint(1, 12)
+            description = f"s{month:02d}/14;c{month:02d}/14"
+        attrs["_Description"] = description
+        if adjustable and not is_subject and rng.random() < 0.5:
+            amount = rng.choice([-1, 1]) * rng.randrange(500, 10000, 100)
+            attrs["_Amount"] = amount
+            total += amount
+            gross += abs(amount)
+        if is_subject and adj_type in ("SalesConcessions", "FinancingConcessions", "DateOfSale"):
+            continue  # The subject column has no sale terms
+        lines.append(f"<SALE_PRICE_ADJUSTMENT {_attrs(**attrs)} />")
+    return lines, total, gross
+
+
+def _comparable(rng, sequence, adjustments):
+    is_subject = sequence == 0
+    price = rng.randrange(90000, 400000, 500)
+    lines, total, gross = _adjustment_lines(rng, adjustments, is_subject)
+    lat = BASE_LATITUDE + (0 if is_subject else rng.uniform(-0.02, 0.02))
+    lon = BASE_LONGITUDE + (0 if is_subject else rng.uniform(-0.02, 0.02))
+    mls = rng.randrange(1000000, 1999999)
+
+    attrs = {"PropertySequenceIdentifier": sequence}
+    if not is_subject:
+        attrs.update(
+            SalePriceTotalAdjustmentNetPercent=round(100.0 * total / price, 1),
+            SalesPriceTotalAdjustmentGrossPercent=round(100.0 * gross / price, 1),
+            AdjustedSalesPriceAmount=price + total,
+            SalePriceTotalAdjustmentAmount=abs(total),
+            SalesPriceTotalAdjustmentPositiveIndicator="Y" if total >= 0 else "N",
+            DataSourceDescription=f"WFRMLS#{mls};DOM {rng.randint(1, 200)}",
+        )
+    attrs["PropertySalesAmount"] = price
+    attrs["ProjectName"] = "SYNTHETIC ESTATES"
+
+    location = _attrs(
+        PropertyCity="Ogden", PropertyState="UT", PropertyPostalCode="84404",
+        LongitudeNumber=None if is_subject else f"{lon:.6f}",
+        LatitudeNumber=None if is_subject else f"{lat:.6f}",
+        PropertyStreetAddress=f"{1000 + sequence} E {1400 + sequence} S",
+        PropertyStreetAddress2="Ogden, UT 84404",
+        ProximityToSubjectDescription=None if is_subject else "0.50 miles N",
+    )
+    body = "\n\t\t\t\t".join([f"<LOCATION {location} />"] + lines)
+    return f"\t\t\t<COMPARABLE_SALE {_attrs(**attrs)}>\n\t\t\t\t{body}\n\t\t\t</COMPARABLE_SALE>\n"
+
+
+def generate_report(comps=6, adjustments=24, pdf_bytes=0, seed=0):
+    """Return a synthetic appraisal document as bytes.
+
+    comps        number of comparable sales (excluding the subject)
+    adjustments  SALE_PRICE_ADJUSTMENT lines per comparable
+    pdf_bytes    size of the decoded EMBEDDED_FILE payload
+    """
+    rng = random.Random(seed)
+    parts = [
+        '<?xml version="1.0" encoding="utf-8" standalone="yes"?>\n',
+        '<VALUATION_RESPONSE MISMOVersionID="2.6GSE">\n',
+        '\t<REPORT AppraisalFormType="FNM1004" AppraiserFileIdentifier="SYN-{}" '
+        'AppraiserReportSignedDate="2014-12-26">\n'.format(seed),
+        '\t\t<FORM AppraisalReportContentType="AppraisalForm" AppraisalReportContentName="FNMA 1004" '
+        'AppraisalReportContentIsPrimaryFormIndicator="Y">\n\t\t\t<MARKET>\n',
+    ]
+    for inventory_type in INVENTORY_TYPES:
+        for month_range in MONTH_RANGES:
+            parts.append('\t\t\t\t<MARKET_INVENTORY {} />\n'.format(_attrs(
+                _Type=inventory_type, _MonthRangeType=month_range, _Count=rng.randint(1, 50),
+            )))
+    parts.append('\t\t\t</MARKET>\n\t\t</FORM>\n')
+
+    parts.append('\t\t<EMBEDDED_FILE _Type="PDF" MIMEType="application/pdf"><DOCUMENT>')
+    if pdf_bytes:
+        payload = b"%PDF-1.3\n" + rng.randbytes(max(0, pdf_bytes - 9))
+        parts.append(base64.encodebytes(payload).decode("ascii").rstrip("\n"))
+    parts.append('</DOCUMENT></EMBEDDED_FILE>\n\t</REPORT>\n')
+
+    parts.append('\t<PROPERTY _StreetAddress="1000 E 1400 S" _City="Ogden" _State="UT" _PostalCode="84404" />\n')
+    parts.append('\t<VALUATION_METHODS>\n\t\t<SALES_COMPARISON>\n')
+    for sequence in range(comps + 1):
+        parts.append(_comparable(rng, sequence, adjustments))
+    parts.append('\t\t</SALES_COMPARISON>\n\t</VALUATION_METHODS>\n</VALUATION_RESPONSE>\n')
+    return "".join(parts).encode("utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic MISMO appraisal XML file.")
+    parser.add_argument("output")
+    parser.add_argument("--comps", type=int, default=6)
+    parser.add_argument("--adjustments", type=int, default=24)
+    parser.add_argument("--pdf-bytes", type=int, default=2000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with open(args.output, "wb") as f:
+        f.write(generate_report(args.comps, args.adjustments, args.pdf_bytes, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Benchmarks for the XML parse path.
+
+Run from backend/benchmarks (pip install -r requirements.txt first):
+
+    pytest                                        # measure only
+    pytest --benchmark-save=baseline              # record a new baseline
+    pytest --benchmark-compare --benchmark-compare-fail=mean:25%
+
+Wall time comes from pytest-benchmark. Peak RSS growth and peak traced
+allocations are measured once per case in a forked child and stored in
+each benchmark's extra_info, so they are saved with the baselines too.
+"""
+import functools
+import io
+import multiprocessing
+import resource
+import sys
+import tracemalloc
+
+import pytest
+
+from synthetic import generate_report
+
+MB = 1024 * 1024
+
+# (comparables, embedded PDF bytes)
+PARSE_CASES = [
+    (6, 0),
+    (6, 2 * MB),
+    (50, 2 * MB),
+    (500, 2 * MB),
+    (6, 50 * MB),
+]
+
+ROUTE_CASES = [
+    (6, 2 * MB),
+    (50, 2 * MB),
+]
+
+
+@functools.lru_cache(maxsize=None)
+def report(comps, pdf_bytes):
+    return generate_report(comps=comps, adjustments=24, pdf_bytes=pdf_bytes)
+
+
+def _maxrss_kib():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def _memory_child(fn, conn):
+    before = _maxrss_kib()
+    fn()
+    rss_growth = _maxrss_kib() - before
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    conn.send({"peak_rss_growth_kib": rss_growth, "peak_traced_kib": peak // 1024})
+    conn.close()
+
+
+def measure_memory(fn):
+    """Peak RSS growth and peak traced allocations of one fn() call."""
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        return {}  # No fork on this platform; wall time only
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_memory_child, args=(fn, child))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def _case_id(case):
+    comps, pdf_bytes = case
+    return f"{comps}comps-{pdf_bytes // MB}MBpdf"
+
+
+@pytest.fixture(scope="module")
+def client():
+    from app import app
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize("case", PARSE_CASES, ids=_case_id)
+def test_calculate_sensitivity(benchmark, case):
+    from app import calculate_sensitivity
+
+    document = report(*case)
+
+    def run():
+        return calculate_sensitivity(io.BytesIO(document))
+
+    benchmark.extra_info.update(measure_memory(run))
+    benchmark.extra_info["document_bytes"] = len(document)
+    result = benchmark(run)
+    assert "error" not in result
+    assert len(result["comparables"]) == case[0]
+
+
+@pytest.mark.parametrize("case", ROUTE_CASES, ids=_case_id)
+def test_calculate_route(benchmark, client, case):
+    document = report(*case)
+
+    def run():
+        return client.post(
+            "/api/calculate",
+            data={"file": (io.BytesIO(document), "report.xml")},
+            content_type="multipart/form-data",
+        )
+
+    benchmark.extra_info.update(measure_memory(run))
+    benchmark.extra_info["document_bytes"] = len(document)
+    response = benchmark(run)
+    assert response.status_code == 200
+    assert len(response.get_json()["comparables"]) == case[0]
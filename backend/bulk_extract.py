@@ -0,0 +1,285 @@
+"""Offline bulk extraction of MISMO appraisal XML into a columnar dataset.
+
+Walks a directory tree, runs the same extraction as /api/calculate on every
+.xml file across all cores and writes three tables to the output directory:
+
+    subjects      one row per report
+    comparables   one row per comparable sale
+    adjustments   one row per (property, adjustment line) in the grid
+
+Rows are buffered up to --row-group-size per table, then written out as
+one part file per table (TABLE-RUN-NNNNN.FORMAT), so memory stays flat
+regardless of the number of files. A manifest records every processed file
+(with its size and mtime) once the part files holding its rows have been
+closed, and every file that failed with its error; re-running with the
+same output directory skips files already extracted, retries the ones that
+failed (unless --skip-failed is given and they have not changed) and writes
+new part files for the rest. A run that is interrupted leaves at most a
+TABLE-RUN-NNNNN.FORMAT.tmp file behind, whose source files are not in the
+manifest and are processed again.
+
+Usage:
+    python bulk_extract.py ARCHIVE_DIR OUTPUT_DIR [--format parquet|csv] [--skip-failed]
+"""
+import argparse
+import csv
+import json
+import os
+import secrets
+import sys
+import time
+from multiprocessing import Pool
+
+from app import calculate_sensitivity
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# Column layout of each output table
+TABLES = {
+    "subjects": [
+        ("source_file", "string"),
+        ("address", "string"),
+        ("sale_price", "float"),
+    ],
+    "comparables": [
+        ("source_file", "string"),
+        ("property_type", "string"),
+        ("address", "string"),
+        ("pre_adj", "float"),
+        ("post_adj", "float"),
+        ("comp_type", "string"),
+        ("total_adj_percent", "float"),
+        ("sale_date", "string"),
+    ],
+    "adjustments": [
+        ("source_file", "string"),
+        ("property_type", "string"),
+        ("adjustment_type", "string"),
+        ("description", "string"),
+        ("amount", "float"),
+    ],
+}
+
+
+def find_xml_files(root):
+    """Yield paths of .xml files under root (case-insensitive), in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(".xml"):
+                yield os.path.join(dirpath, name)
+
+
+def _number(value):
+    # The API uses "N/A" and "" for missing values; columns use None
+    if value in (None, "", "N/A"):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_file(task):
+    """Pool worker: analyze one file and return its rows for every table."""
+    path, relpath = task
+    try:
+        result = calculate_sensitivity(path)
+    except Exception as e:
+        result = {"error": f"An unexpected error occurred: {str(e)}"}
+    if "error" in result:
+        return relpath, result["error"], None
+
+    subject = result["subject_property"]
+    rows = {
+        "subjects": [(relpath, subject["address"], _number(subject["pre_adj"]))],
+        "comparables": [
+            (
+                relpath,
+                comp["property_type"],
+                comp["address"],
+                _number(comp["pre_adj"]),
+                _number(comp["post_adj"]),
+                comp["comp_type"],
+                _number(comp["total_adj_percent"]),
+                comp["sale_date"] if comp["sale_date"] != "N/A" else None,
+            )
+            for comp in result["comparables"]
+        ],
+        "adjustments": [],
+    }
+
+    grid = result["adjustment_grid"]
+    for prop, descriptions, amounts in zip(grid["properties"], grid["descriptions"], grid["amounts"]):
+        for adj_type, description, amount in zip(grid["types"], descriptions, amounts):
+            if description is not None or amount is not None:
+                rows["adjustments"].append((relpath, prop, adj_type, description, amount))
+
+    return relpath, None, rows
+
+
+class CsvTableWriter:
+    def __init__(self, path, columns):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in columns])
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetTableWriter:
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {"string": pa.string(), "float": pa.float64()}
+        self._pa = pa
+        self._schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self._writer.write_table(self._pa.Table.from_arrays(
+            [self._pa.array(col, type=field.type) for col, field in zip(columns, self._schema)],
+            schema=self._schema,
+        ))
+
+    def close(self):
+        self._writer.close()
+
+
+def write_part(writer_class, path, columns, rows):
+    """Write rows to a complete file at path, going through path + ".tmp"."""
+    temp = path + ".tmp"
+    writer = writer_class(temp, columns)
+    try:
+        writer.write(rows)
+    except BaseException:
+        writer.close()
+        os.remove(temp)
+        raise
+    writer.close()
+    os.replace(temp, path)
+
+
+def load_manifest(path):
+    """Return (done, failed), each {relpath: (size, mtime)}.
+
+    The latest entry for a file wins, so a file that failed and was then
+    extracted on a retry counts as done.
+    """
+    done, failed = {}, {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Torn final line from an interrupted run
+                stat = (entry["size"], entry["mtime"])
+                if entry.get("status", "ok") == "ok":
+                    done[entry["path"]] = stat
+                    failed.pop(entry["path"], None)
+                else:
+                    failed[entry["path"]] = stat
+                    done.pop(entry["path"], None)
+    return done, failed
+
+
+def run(input_dir, output_dir, fmt="parquet", workers=None, row_group_size=50000, skip_failed=False):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    done, failed_before = load_manifest(manifest_path)
+
+    # Work out which files still need processing. Files that failed before
+    # are retried unless skip_failed is set and they are unchanged.
+    tasks = []
+    stats = {}
+    skipped = retried = 0
+    for path in find_xml_files(input_dir):
+        relpath = os.path.relpath(path, input_dir)
+        st = os.stat(path)
+        stats[relpath] = (st.st_size, st.st_mtime)
+        if done.get(relpath) == stats[relpath]:
+            skipped += 1
+            continue
+        if relpath in failed_before:
+            if skip_failed and failed_before[relpath] == stats[relpath]:
+                skipped += 1
+                continue
+            retried += 1
+        tasks.append((path, relpath))
+
+    print(f"{len(tasks)} files to process ({retried} failed before), {skipped} skipped", file=sys.stderr)
+    if not tasks:
+        return
+
+    # Each run writes its own part files so earlier output is never rewritten;
+    # the pid and random suffix keep concurrent or same-second runs apart
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{secrets.token_hex(2)}"
+    writer_class = ParquetTableWriter if fmt == "parquet" else CsvTableWriter
+    buffers = {table: [] for table in TABLES}
+    pending_manifest = []  # Manifest lines waiting for their rows to be written
+    parts = 0
+    processed = failed = 0
+
+    def flush(manifest):
+        nonlocal parts
+        if pending_manifest:
+            parts += 1
+            for table, rows in buffers.items():
+                if rows:
+                    path = os.path.join(output_dir, f"{table}-{run_id}-{parts:05d}.{fmt}")
+                    write_part(writer_class, path, TABLES[table], rows)
+                    rows.clear()
+        # Record files only once the part files holding their rows are closed
+        manifest.writelines(pending_manifest)
+        manifest.flush()
+        pending_manifest.clear()
+
+    start = time.perf_counter()
+    with open(manifest_path, "a", encoding="utf-8") as manifest, Pool(workers) as pool:
+        for relpath, error, rows in pool.imap_unordered(extract_file, tasks, chunksize=8):
+            size, mtime = stats[relpath]
+            entry = {"path": relpath, "size": size, "mtime": mtime, "status": "ok"}
+            if error is not None:
+                entry.update(status="error", error=error)
+                failed += 1
+            else:
+                for table, table_rows in rows.items():
+                    buffers[table].extend(table_rows)
+            pending_manifest.append(json.dumps(entry) + "\n")
+            processed += 1
+
+            if any(len(rows) >= row_group_size for rows in buffers.values()):
+                flush(manifest)
+            if processed % 1000 == 0:
+                print(f"{processed}/{len(tasks)} files", file=sys.stderr)
+
+        flush(manifest)
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {processed} files ({failed} failed) in {elapsed:.1f}s", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract MISMO appraisal XML archives to Parquet or CSV.")
+    parser.add_argument("input_dir", help="Directory tree containing .xml reports")
+    parser.add_argument("output_dir", help="Directory for the tables and manifest")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--row-group-size", type=int, default=50000, help="Rows buffered per table before writing a part file")
+    parser.add_argument("--skip-failed", action="store_true",
+                        help="Do not retry files that failed in an earlier run and have not changed since")
+    args = parser.parse_args(argv)
+
+    run(args.input_dir, args.output_dir, args.format, args.workers, args.row_group_size, args.skip_failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Declarative extraction specs for MISMO appraisal XML.
+
+Each Field names an output field, the element and attribute it comes from
+(for SALE_PRICE_ADJUSTMENT also the adjustment type) and an optional
+converter. Profiles are keyed by the primary form's
+AppraisalReportContentName and compiled once into dispatch tables, so the
+extractor looks up what to keep per element in a single pass.
+"""
+import re
+from collections import namedtuple
+
+Field = namedtuple("Field", "name element attribute adj_type convert default")
+Field.__new__.__defaults__ = (None, None, None)
+
+
+def to_float(value):
+    """Convert an attribute value to float, or None if missing/invalid."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# MLS listing number in a DataSourceDescription, e.g. "WFRMLS#1254136;DOM 11"
+_MLS_NUMBER = re.compile(r"#\s*(\d+)")
+
+
+def parse_mls_number(description):
+    """Return the MLS number from a DataSourceDescription, or None."""
+    if not description:
+        return None
+    match = _MLS_NUMBER.search(description)
+    return match.group(1) if match else None
+
+
+def comp_type(description):
+    """Comparable type from the SalesConcessions line; "ArmLth" means a sale."""
+    return "Sale" if description == "ArmLth" else description
+
+
+def sale_date(description):
+    """Sale date from a DateOfSale line such as "s12/14;c11/14"."""
+    if "s" in description:
+        return description.split(";")[0].replace("s", "").strip()
+    return "N/A"
+
+
+def to_number(value):
+    """Convert an amount such as "$95,000" to float, or None if invalid."""
+    return to_float(value.replace("$", "").replace(",", "").strip())
+
+
+# Report level fields, the same for every form; the first occurrence of
+# each element outside the comparables wins
+REPORT_FIELDS = (
+    Field("file_identifier", "REPORT", "AppraiserFileIdentifier"),
+    Field("form_type", "REPORT", "AppraisalFormType"),
+    Field("signed_date", "REPORT", "AppraiserReportSignedDate"),
+    Field("postal_code", "PROPERTY", "_PostalCode"),
+    Field("effective_date", "VALUATION", "AppraisalEffectiveDate"),
+)
+
+# MARKET_INVENTORY carries its figure in one of these, by _Type
+MARKET_VALUE_ATTRIBUTES = ("_Count", "_Rate", "_Amount")
+
+
+def market_value(attrib):
+    """Figure of a MARKET_INVENTORY element, or None."""
+    for attribute in MARKET_VALUE_ATTRIBUTES:
+        value = attrib.get(attribute)
+        if value is not None:
+            return to_number(value)
+    return None
+
+# Comparable fields every form needs for the analysis
+COMMON_FIELDS = (
+    Field("sequence", "COMPARABLE_SALE", "PropertySequenceIdentifier"),
+    Field("pre_adj", "COMPARABLE_SALE", "PropertySalesAmount", convert=to_float),
+    Field("post_adj", "COMPARABLE_SALE", "AdjustedSalesPriceAmount", convert=to_float),
+    Field("total_adj_percent", "COMPARABLE_SALE", "SalePriceTotalAdjustmentNetPercent"),
+    Field("gross_adj_percent", "COMPARABLE_SALE", "SalesPriceTotalAdjustmentGrossPercent"),
+    Field("total_adj_amount", "COMPARABLE_SALE", "SalePriceTotalAdjustmentAmount", convert=to_float),
+    Field("total_adj_positive", "COMPARABLE_SALE", "SalesPriceTotalAdjustmentPositiveIndicator"),
+    Field("project_name", "COMPARABLE_SALE", "ProjectName"),
+    Field("mls_number", "COMPARABLE_SALE", "DataSourceDescription", convert=parse_mls_number),
+    Field("street", "LOCATION", "PropertyStreetAddress", default="Unknown"),
+    Field("street2", "LOCATION", "PropertyStreetAddress2", default=""),
+    Field("postal_code", "LOCATION", "PropertyPostalCode"),
+    Field("latitude", "LOCATION", "LatitudeNumber", convert=to_float),
+    Field("longitude", "LOCATION", "LongitudeNumber", convert=to_float),
+    Field("proximity", "LOCATION", "ProximityToSubjectDescription"),
+    Field("comp_type", "SALE_PRICE_ADJUSTMENT", "_Description", "SalesConcessions",
+          convert=comp_type, default="Unknown"),
+    Field("sale_date", "SALE_PRICE_ADJUSTMENT", "_Description", "DateOfSale",
+          convert=sale_date, default="N/A"),
+)
+
+# Form specific comparable fields
+CONDO_FIELDS = (
+    Field("floor_location", "SALE_PRICE_ADJUSTMENT", "_Description", "FloorLocation"),
+    Field("hoa_fee", "SALE_PRICE_ADJUSTMENT", "_Description", "MaintenanceFees", convert=to_float),
+)
+SITE_FIELDS = (
+    Field("site_area", "SALE_PRICE_ADJUSTMENT", "_Description", "SiteArea"),
+)
+
+PROFILE_FIELDS = {
+    "FNMA 1004": COMMON_FIELDS + SITE_FIELDS,
+    "FNMA 1073": COMMON_FIELDS + CONDO_FIELDS,
+}
+# Forms without a profile get the common fields only
+DEFAULT_FIELDS = COMMON_FIELDS
+
+
+class CompiledSpec:
+    """Dispatch tables for one field list.
+
+    `elements` maps a tag to (attribute, field, converter) tuples,
+    `adjustments` does the same per adjustment type, `defaults` holds
+    the value of every field an element did not supply, and
+    `numeric_fields` names the fields converted with to_float.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.elements = {}
+        self.adjustments = {}
+        self.defaults = {}
+        for field in fields:
+            handler = (field.attribute, field.name, field.convert)
+            if field.adj_type is not None:
+                self.adjustments.setdefault(field.adj_type, []).append(handler)
+            else:
+                self.elements.setdefault(field.element, []).append(handler)
+            self.defaults[field.name] = field.default
+        self.elements = {tag: tuple(handlers) for tag, handlers in self.elements.items()}
+        self.adjustments = {key: tuple(handlers) for key, handlers in self.adjustments.items()}
+        self.extra_fields = tuple(
+            field.name for field in fields if field.name not in {f.name for f in COMMON_FIELDS}
+        )
+        self.numeric_fields = frozenset(field.name for field in fields if field.convert is to_float)
+
+
+def extract(handlers, attrib, out):
+    """Apply (attribute, field, converter) handlers to one element's attributes."""
+    for attribute, name, convert in handlers:
+        value = attrib.get(attribute)
+        if value is not None:
+            out[name] = convert(value) if convert is not None else value
+
+
+REPORT_SPEC = CompiledSpec("report", REPORT_FIELDS)
+PROFILES = {name: CompiledSpec(name, fields) for name, fields in PROFILE_FIELDS.items()}
+DEFAULT_PROFILE = CompiledSpec("default", DEFAULT_FIELDS)
+
+
+def profile_for(form_name):
+    """Compiled profile for an AppraisalReportContentName."""
+    return PROFILES.get(form_name, DEFAULT_PROFILE)
@@ -0,0 +1,76 @@
+"""Production serving configuration.
+
+Run from backend/:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Every setting can be overridden from the environment:
+
+    PORT                 port to bind (8080)
+    WEB_CONCURRENCY      worker processes (one per CPU core)
+    GUNICORN_THREADS     threads per worker (4)
+    MAX_REQUESTS         requests a worker serves before it is recycled (1000)
+    MAX_REQUESTS_JITTER  random extra requests so workers do not recycle together (100)
+    GUNICORN_TIMEOUT     seconds a silent worker is given before it is killed (120)
+
+The app is imported once in the master and the workers are forked from
+it, sharing the imported code and module state copy-on-write. Process
+pools, SQLite connections and background threads are all created lazily,
+so every worker opens its own after the fork. Recycling workers after
+MAX_REQUESTS returns memory fragmented by large XML parses to the OS.
+
+Reloading:
+    kill -HUP <master pid>    start new workers with the current config and
+                              gracefully stop the old ones. Because the app
+                              is preloaded this does not pick up code changes.
+    kill -USR2 <master pid>   start a new master with the new code, then
+                              send the old master WINCH followed by QUIT.
+
+Prometheus metrics from all workers are aggregated through
+PROMETHEUS_MULTIPROC_DIR, which is set here when not already set.
+
+Load test against a running server with benchmarks/loadtest.py.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+preload_app = True
+
+max_requests = int(os.environ.get("MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 100))
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+
+# prometheus_client reads this when it is first imported, which happens in
+# the master while the app is preloaded
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="sensitivity-metrics-")
+_metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+os.makedirs(_metrics_dir, exist_ok=True)
+
+
+def on_starting(server):
+    # Metric files from a previous run would be counted again
+    for name in os.listdir(_metrics_dir):
+        path = os.path.join(_metrics_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
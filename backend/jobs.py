@@ -0,0 +1,345 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# How often get() re-reads the shared store while waiting on another worker's job
+STORE_POLL_INTERVAL = 0.25
+
+# Result of a job that was lost with its worker or ran past its deadline
+EXPIRED_RESULT = {"error": "The job was lost or timed out before it finished, please resubmit"}
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity."""
+
+
+class Job:
+    def __init__(self, filename):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"  # queued -> running -> done | failed
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.future = None
+        self.done = threading.Event()
+
+    def to_dict(self, include_result=True):
+        status = self.status
+        if status == "queued" and self.future is not None and self.future.running():
+            status = "running"
+        data = {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": status,
+            "created": self.created,
+            "finished": self.finished,
+        }
+        if include_result and self.done.is_set():
+            data["result"] = self.result
+        return data
+
+
+class StoredJob:
+    """A job read back from the shared store, as seen by another worker."""
+
+    def __init__(self, record):
+        self.id = record["job_id"]
+        self.status = record["status"]
+        self.created = record["created"]
+        self.heartbeat = record["heartbeat"] if record["heartbeat"] is not None else record["created"]
+        self._record = record
+
+    def to_dict(self, include_result=True):
+        data = {key: self._record[key] for key in ("job_id", "filename", "status", "created", "finished")}
+        if include_result and self._record["result"] is not None:
+            data["result"] = json.loads(self._record["result"])
+        return data
+
+
+class JobStore:
+    """SQLite record of job states shared by every worker process on the host.
+
+    A job runs in the worker that accepted it, but with several workers
+    behind one socket its status polls can land anywhere; those workers
+    find the job here. The owning worker refreshes `heartbeat` while the
+    job is unfinished, so a job whose worker died can be told apart from
+    one that is still running. Each thread uses its own connection.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        filename TEXT,
+        status TEXT NOT NULL,
+        created REAL NOT NULL,
+        finished REAL,
+        result TEXT,
+        heartbeat REAL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._migrate(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate(conn):
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "heartbeat" not in existing:
+            try:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+            except sqlite3.OperationalError:
+                pass  # Added by another connection in the meantime
+
+    def save(self, job):
+        result = json.dumps(job.result) if job.done.is_set() else None
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, filename, status, created, finished, result, heartbeat)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.filename, job.status, job.created, job.finished, result, time.time()),
+            )
+
+    def touch(self, job_ids):
+        """Refresh the heartbeat of the given unfinished jobs."""
+        placeholders = ", ".join("?" * len(job_ids))
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat = ? WHERE finished IS NULL AND job_id IN ({placeholders})",
+                (time.time(), *job_ids),
+            )
+
+    def expire(self, stale_before, created_before):
+        """Fail unfinished jobs whose heartbeat or creation is older than the cutoffs.
+
+        Returns the number of jobs expired. They are finished as of now, so
+        prune() drops them once the retention period has passed.
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'failed', finished = ?, result = ? WHERE finished IS NULL"
+                " AND (COALESCE(heartbeat, created) < ? OR created < ?)",
+                (time.time(), json.dumps(EXPIRED_RESULT), stale_before, created_before),
+            ).rowcount
+
+    def load(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return StoredJob(dict(row)) if row is not None else None
+
+    def prune(self, cutoff):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE finished < ?", (cutoff,))
+
+
+class JobManager:
+    """Runs analysis jobs on an executor and keeps their results for polling.
+
+    At most `max_pending` jobs may be queued or running at once; further
+    submissions raise QueueFull. A job unfinished `timeout` seconds after
+    it was submitted is failed. Finished jobs are retained for `retention`
+    seconds (and at most `max_retained` of them) before being dropped.
+    With a `store`, job states are also written there so that other worker
+    processes can answer polls for them; a background thread refreshes
+    the heartbeat of this process's unfinished jobs, and stored jobs
+    without a heartbeat for `stale_after` seconds, whose worker has gone,
+    are failed when found.
+    """
+
+    def __init__(self, executor_factory, max_pending=32, retention=600, max_retained=1000,
+                 store=None, timeout=600, stale_after=60):
+        self._executor_factory = executor_factory
+        self._store = store
+        self.max_pending = max_pending
+        self.retention = retention
+        self.max_retained = max_retained
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    def submit(self, filename, fn, *args, on_result=None):
+        """Queue fn(*args) and return the Job.
+
+        `on_result` is called with the result in the parent process once the
+        job succeeds.
+        """
+        with self._lock:
+            expired = self._prune()
+            full = self._pending >= self.max_pending
+            if not full:
+                job = Job(filename)
+                self._jobs[job.id] = job
+                self._pending += 1
+        self._write_expired(expired)
+        if full:
+            raise QueueFull()
+        if self._store is not None:
+            self._store.save(job)
+            self._ensure_heartbeat()
+
+        try:
+            job.future = self._executor_factory().submit(fn, *args)
+        except Exception as e:
+            self._finish(job, "failed", {"error": f"Could not start job: {str(e)}"})
+            return job
+
+        def done(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                self._finish(job, "failed", {"error": f"An unexpected error occurred: {str(e)}"})
+                return
+            self._finish(job, "failed" if "error" in result else "done", result)
+            if on_result is not None and "error" not in result:
+                on_result(result)
+
+        job.future.add_done_callback(done)
+        return job
+
+    def complete(self, filename, result):
+        """Register a job whose result is already known (e.g. a cache hit)."""
+        job = Job(filename)
+        with self._lock:
+            expired = self._prune()
+            self._jobs[job.id] = job
+            self._pending += 1
+        self._write_expired(expired)
+        self._finish(job, "failed" if "error" in result else "done", result)
+        return job
+
+    def _finish(self, job, status, result):
+        with self._lock:
+            if job.finished is not None:
+                return  # Already expired
+            job.status = status
+            job.result = result
+            job.finished = time.time()
+            self._pending -= 1
+        job.done.set()
+        if self._store is not None:
+            self._store.save(job)
+
+    def get(self, job_id, wait=0):
+        """Return the job, optionally blocking up to `wait` seconds for it to finish.
+
+        Jobs accepted by other workers come from the store, which is
+        re-read until the job finishes or `wait` runs out.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            if wait > 0:
+                job.done.wait(min(wait, max(0.0, job.created + self.timeout - time.time())))
+            if not job.done.is_set() and time.time() - job.created > self.timeout:
+                with self._lock:
+                    expired = self._expire(job)
+                if expired and self._store is not None:
+                    self._store.save(job)
+            return job
+        if self._store is None:
+            return None
+
+        deadline = time.monotonic() + wait
+        while True:
+            job = self._store.load(job_id)
+            if job is not None and job.status not in ("done", "failed"):
+                now = time.time()
+                if job.heartbeat < now - self.stale_after or job.created < now - self.timeout:
+                    self._store.expire(now - self.stale_after, now - self.timeout)
+                    job = self._store.load(job_id)
+            if job is None or job.status in ("done", "failed") or time.monotonic() >= deadline:
+                return job
+            time.sleep(min(STORE_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+
+    def _expire(self, job):
+        # Caller holds the lock and writes the job to the store after
+        # releasing it; returns whether the job was expired. The executor
+        # may still run the job; its result is then ignored by _finish().
+        if job.finished is not None:
+            return False
+        if job.future is not None:
+            job.future.cancel()
+        job.status = "failed"
+        job.result = EXPIRED_RESULT
+        job.finished = time.time()
+        self._pending -= 1
+        job.done.set()
+        return True
+
+    def _ensure_heartbeat(self):
+        # Started lazily so forked workers each get their own thread
+        with self._lock:
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(
+                    target=self._heartbeat_loop, name="job-heartbeat", daemon=True
+                )
+                self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.stale_after / 4)
+            with self._lock:
+                job_ids = [job.id for job in self._jobs.values() if job.finished is None]
+            if job_ids:
+                try:
+                    self._store.touch(job_ids)
+                except sqlite3.Error:
+                    pass  # Busy store; the next beat comes well within stale_after
+
+    def _prune(self):
+        # Caller holds the lock and passes the returned expired jobs to
+        # _write_expired() after releasing it
+        now = time.time()
+        cutoff = now - self.retention
+        expired = [
+            job for job in list(self._jobs.values())
+            if job.finished is None and job.created < now - self.timeout and self._expire(job)
+        ]
+        finished = [job for job in self._jobs.values() if job.finished is not None]
+        for job in finished:
+            if job.finished < cutoff:
+                del self._jobs[job.id]
+        finished = [job for job in finished if job.id in self._jobs]
+        if len(finished) > self.max_retained:
+            finished.sort(key=lambda job: job.finished)
+            for job in finished[:len(finished) - self.max_retained]:
+                del self._jobs[job.id]
+        return expired
+
+    def _write_expired(self, expired):
+        # SQLite writes are kept out of the lock so that a busy store never
+        # stalls the threads tracking jobs in memory
+        if self._store is None:
+            return
+        for job in expired:
+            self._store.save(job)
+        # Jobs lost with another worker, also on the first use after a restart
+        now = time.time()
+        self._store.expire(now - self.stale_after, now - self.timeout)
+        self._store.prune(now - self.retention)
+
+    def snapshot(self):
+        with self._lock:
+            return {"pending": self._pending, "retained": len(self._jobs)}
@@ -0,0 +1,95 @@
+import re
+
+# Month ranges of the market conditions grid, oldest first
+MONTH_RANGES = ("Prior7To12Months", "Prior4To6Months", "Last3Months")
+# Pseudo month range under which the row's overall trend is rolled up
+TREND = "Trend"
+TRENDS = ("Increasing", "Stable", "Declining")
+SCOPES = ("neighborhood", "project")
+
+_ZIP = re.compile(r"\d{5}")
+
+
+def normalize_postal_code(code):
+    """Five digit ZIP code of a postal code ("84404-1234" -> "84404"), or None."""
+    match = _ZIP.match(code.strip()) if code else None
+    return match.group(0) if match else None
+
+
+def period_of(date):
+    """Calendar quarter ("2014-Q4") of a "yyyy-mm-dd" date, or None."""
+    if not date:
+        return None
+    parts = date.split("-")
+    if len(parts) < 2 or not parts[0].isdigit() or not parts[1].isdigit():
+        return None
+    month = int(parts[1])
+    if not 1 <= month <= 12:
+        return None
+    return f"{int(parts[0]):04d}-Q{(month - 1) // 3 + 1}"
+
+
+def summarize_market(lines, postal_code, effective_date):
+    """Market conditions of a report from ReportTarget's MARKET_INVENTORY lines.
+
+    Returns {"postal_code", "effective_date", "period", "neighborhood",
+    "project"}, where each scope maps an inventory type (TotalSales,
+    MedianSalesPrice, ...) to its value per month range plus "trend".
+    Forms repeat the grid on addenda; the first occurrence of a line wins.
+    The period is the calendar quarter of the effective date, so the
+    "Last3Months" column describes (roughly) that quarter.
+    """
+    scopes = {scope: {} for scope in SCOPES}
+    for scope, inventory_type, month_range, value, trend in lines:
+        if not inventory_type:
+            continue
+        row = scopes[scope].setdefault(inventory_type, {})
+        if month_range in MONTH_RANGES:
+            row.setdefault(month_range, value)
+        elif trend:
+            row.setdefault("trend", trend)
+    return {
+        "postal_code": normalize_postal_code(postal_code),
+        "effective_date": effective_date,
+        "period": period_of(effective_date),
+        **scopes,
+    }
+
+
+def market_rows(conditions):
+    """(scope, type, month range, value, trend) rows of summarize_market() output."""
+    for scope in SCOPES:
+        for inventory_type, row in conditions.get(scope, {}).items():
+            for month_range in MONTH_RANGES:
+                if row.get(month_range) is not None:
+                    yield scope, inventory_type, month_range, row[month_range], None
+            if row.get("trend") in TRENDS:
+                yield scope, inventory_type, TREND, None, row["trend"]
+
+
+def trend_series(rollups):
+    """Nest rollup rows (ordered by type, month range, period) into series.
+
+    Returns {type: {month range: [point, ...]}} where a point carries the
+    period, the number of reports and the mean/min/max of their values,
+    and the "Trend" series counts the reports calling the market
+    increasing, stable or declining.
+    """
+    series = {}
+    for row in rollups:
+        points = series.setdefault(row["inventory_type"], {}).setdefault(row["month_range"], [])
+        point = {"period": row["period"], "reports": row["reports"]}
+        if row["month_range"] == TREND:
+            point.update(increasing=row["increasing"], stable=row["stable"], declining=row["declining"])
+        else:
+            count = row["value_count"]
+            mean = row["value_sum"] / count if count else None
+            variance = row["value_sumsq"] / count - mean ** 2 if count else None
+            point.update(
+                mean=round(mean, 4) if mean is not None else None,
+                std=round(max(variance, 0.0) ** 0.5, 4) if variance is not None else None,
+                min=row["value_min"],
+                max=row["value_max"],
+            )
+        points.append(point)
+    return series
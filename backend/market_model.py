@@ -0,0 +1,394 @@
+import re
+import threading
+from collections import namedtuple
+from statistics import NormalDist
+
+import numpy as np
+
+from field_spec import sale_date
+from xml_parsing import sale_month
+
+# A characteristic read from the SALE_PRICE_ADJUSTMENT description of one
+# adjustment type, and the unit its per-unit adjustment is quoted in
+Feature = namedtuple("Feature", "name unit parse")
+
+_NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+_RATING = re.compile(r"^[QC]([1-6])\b")
+_AREA = re.compile(r"^([\d,]+(?:\.\d+)?)\s*(sf|ac)\b", re.IGNORECASE)
+_CAR_SPACES = re.compile(r"(\d+)\s*(gbi|ga|gd|g|cp|cv|dw|op)", re.IGNORECASE)
+
+# Car storage codes that count as covered spaces; driveway and open do not
+_COVERED = {"g", "ga", "gd", "gbi", "cp", "cv"}
+
+
+def _leading_number(description):
+    match = _NUMBER.match(description.strip())
+    return float(match.group().replace(",", "")) if match else None
+
+
+def _rating(description):
+    # "Q4" / "C3"; higher numbers are worse
+    match = _RATING.match(description.strip())
+    return float(match.group(1)) if match else None
+
+
+def _car_spaces(description):
+    # UAD codes such as "2ga2dw" or "1cv1op;Carport"
+    if description.strip().lower().startswith("none"):
+        return 0.0
+    spaces = [(int(count), kind.lower()) for count, kind in _CAR_SPACES.findall(description)]
+    if not spaces:
+        return None
+    return float(sum(count for count, kind in spaces if kind in _COVERED))
+
+
+def _square_feet(description):
+    # "14810 sf", "0.25 ac" or "558sf335sfin" (total basement area first)
+    match = _AREA.match(description.strip())
+    if not match:
+        return None
+    value = float(match.group(1).replace(",", ""))
+    return value * 43560 if match.group(2).lower() == "ac" else value
+
+
+def _sale_month_index(description):
+    # "s06/14;c05/14" -> months since year 0
+    month = sale_month(sale_date(description))
+    return _month_index(month)
+
+
+def _month_index(month):
+    if not month:
+        return None
+    year, month = month.split("-")[:2]
+    return float(int(year) * 12 + int(month) - 1)
+
+
+FEATURES = {feature.name: feature for feature in (
+    Feature("GrossLivingArea", "sq ft", _leading_number),
+    Feature("Quality", "rating step", _rating),
+    Feature("Condition", "rating step", _rating),
+    Feature("Age", "year", _leading_number),
+    Feature("CarStorage", "covered space", _car_spaces),
+    Feature("BasementArea", "sq ft", _square_feet),
+    Feature("SiteArea", "sq ft", _square_feet),
+    Feature("DateOfSale", "month", _sale_month_index),
+)}
+DEFAULT_FEATURES = ("GrossLivingArea", "Quality", "Condition", "Age", "CarStorage", "DateOfSale")
+
+# Residual degrees of freedom an area needs before it is fitted
+MIN_RESIDUAL_DF = 5
+
+# Smallest eigenvalue, relative to the largest, of the scaled normal
+# matrix of a fitted area; below it a feature does not vary enough
+MIN_CONDITION = 1e-10
+
+
+def feature_value(feature, description, signed_date=None):
+    """Numeric value of a feature for one property, or None.
+
+    The subject has no sale date; pass the report's signed date and its
+    DateOfSale is the month the report was signed.
+    """
+    value = feature.parse(description) if description else None
+    if value is None and signed_date and feature.name == "DateOfSale":
+        value = _month_index(signed_date[:7])
+    return value
+
+
+def student_t_quantile(q, df):
+    """Quantile of Student's t for an array of degrees of freedom.
+
+    Cornish-Fisher expansion around the normal quantile; within 0.2% of the
+    exact value from 5 degrees of freedom up.
+    """
+    z = NormalDist().inv_cdf(q)
+    df = np.asarray(df, dtype=float)
+    return (z
+            + (z ** 3 + z) / (4 * df)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+def _group_starts(codes):
+    # `codes` sorted; index where each group begins
+    return np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+
+def fit_areas(X, y, codes, n_areas, confidence=0.95):
+    """Least squares fit of price on features for every area at once.
+
+    X is (sales, features), y the sale prices and `codes` each sale's area
+    index in [0, n_areas). Each area gets its own intercept and slopes. The
+    normal equations of all areas are accumulated with one segmented sum
+    and solved as one stacked (areas, k, k) system. Returns arrays over
+    areas; areas with too few sales or a feature that does not vary are
+    marked invalid.
+    """
+    n, p = X.shape
+    k = p + 1
+    counts = np.bincount(codes, minlength=n_areas)
+
+    # Center globally so the sums of squares stay well conditioned
+    Z = np.empty((n, k))
+    Z[:, 0] = 1.0
+    Z[:, 1:] = X - X.mean(axis=0) if n else X
+    yc = y - y.mean() if n else y
+
+    order = np.argsort(codes, kind="stable")
+    Z, yc, sorted_codes = Z[order], yc[order], codes[order]
+    ZtZ = np.zeros((n_areas, k, k))
+    Zty = np.zeros((n_areas, k))
+    yty = np.zeros(n_areas)
+    if n:
+        starts = _group_starts(sorted_codes)
+        present = sorted_codes[starts]
+        ZtZ[present] = np.add.reduceat(Z[:, :, None] * Z[:, None, :], starts, axis=0)
+        Zty[present] = np.add.reduceat(Z * yc[:, None], starts, axis=0)
+        yty[present] = np.add.reduceat(yc * yc, starts)
+
+    # Scale to unit diagonal and check the conditioning of every area
+    scale = np.sqrt(np.einsum("aii->ai", ZtZ))
+    safe = np.where(scale > 0, scale, 1.0)
+    scaled = ZtZ / (safe[:, :, None] * safe[:, None, :])
+    eigenvalues = np.linalg.eigvalsh(scaled)
+    valid = ((counts - k >= MIN_RESIDUAL_DF) & np.all(scale > 0, axis=1)
+             & (eigenvalues[:, 0] > MIN_CONDITION * eigenvalues[:, -1]))
+
+    inverse = np.full((n_areas, k, k), np.nan)
+    if valid.any():
+        inverse[valid] = (np.linalg.inv(scaled[valid])
+                          / (safe[valid][:, :, None] * safe[valid][:, None, :]))
+    beta = np.einsum("aij,aj->ai", inverse, Zty)
+
+    df = np.maximum(counts - k, 1)
+    rss = np.maximum(yty - np.einsum("ai,ai->a", beta, Zty), 0.0)
+    sigma2 = rss / df
+    std_error = np.sqrt(sigma2[:, None] * np.einsum("aii->ai", inverse))
+    t = student_t_quantile(0.5 + confidence / 2, df)
+    total = yty - np.where(counts > 0, Zty[:, 0] ** 2 / np.maximum(counts, 1), 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_squared = np.where(total > 0, 1 - rss / total, np.nan)
+
+    return {
+        "valid": valid,
+        "sales": counts,
+        "estimate": beta[:, 1:],
+        "std_error": std_error[:, 1:],
+        "margin": t[:, None] * std_error[:, 1:],
+        "r_squared": r_squared,
+        "residual_std": np.sqrt(sigma2),
+    }
+
+
+class MarketDesign:
+    """Feature matrix of the portfolio's closed sales, grouped by area.
+
+    Built from PortfolioStore.market_data(). Sales used as comparables in
+    several reports are counted once, from the newest report. The
+    appraisers' own adjustments are kept alongside as implied per-unit
+    rates, amount / (subject value - comparable value), for every line
+    whose subject and comparable values differ.
+    """
+
+    def __init__(self, sales, lines, subject_lines, features, area_digits):
+        self.features = features
+        self.area_digits = area_digits
+        column = {feature.name: j for j, feature in enumerate(features)}
+        parsed = {feature.name: {} for feature in features}
+
+        def value(feature, description):
+            # Descriptions repeat heavily ("Q4", "C3"); parse each once
+            cache = parsed[feature.name]
+            if description not in cache:
+                cache[description] = feature_value(feature, description)
+            return cache[description]
+
+        row_of = {sale["comp_id"]: i for i, sale in enumerate(sales)}
+        values = np.full((len(sales), len(features)), np.nan)
+        amounts = np.zeros((len(sales), len(features)))
+        for comp_id, adj_type, description, amount in lines:
+            j = column[adj_type]
+            comp_value = value(features[j], description)
+            if comp_value is not None:
+                values[row_of[comp_id], j] = comp_value
+                amounts[row_of[comp_id], j] = amount or 0.0
+
+        subjects = {}
+        for report_id, adj_type, description in subject_lines:
+            j = column[adj_type]
+            subjects.setdefault(report_id, [None] * len(features))[j] = value(features[j], description)
+        subject_values = np.full((len(sales), len(features)), np.nan)
+        for i, sale in enumerate(sales):
+            row = subjects.get(sale["report_id"], [None] * len(features))
+            subject_values[i] = [np.nan if v is None else v for v in row]
+        if "DateOfSale" in column:
+            # The subject's date is the month the report was signed
+            j = column["DateOfSale"]
+            signed = np.array([feature_value(features[j], None, sale["signed_date"]) or np.nan
+                               for sale in sales], dtype=float)
+            subject_values[:, j] = np.where(np.isnan(subject_values[:, j]), signed, subject_values[:, j])
+
+        area_names = [self.area_of(sale["postal_code"]) for sale in sales]
+        self.areas = sorted(set(area_names))
+        index = {area: code for code, area in enumerate(self.areas)}
+        codes = np.array([index[area] for area in area_names], dtype=int)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            difference = subject_values - values
+            self.rates = np.where(difference != 0, amounts / difference, np.nan)
+        self.rate_codes = codes
+
+        # One row per sale for the fit; sales come newest report first
+        seen = set()
+        keep = np.zeros(len(sales), dtype=bool)
+        complete = ~np.isnan(values).any(axis=1)
+        for i, sale in enumerate(sales):
+            identity = sale["mls_number"] or sale["address_key"]
+            key = (identity, sale["sale_month"]) if identity else sale["comp_id"]
+            if complete[i] and key not in seen:
+                seen.add(key)
+                keep[i] = True
+        self.X = values[keep]
+        self.y = np.array([sale["pre_adj"] for sale in sales], dtype=float).reshape(-1)[keep]
+        self.codes = codes[keep]
+
+    def area_of(self, postal_code):
+        return (postal_code or "")[:self.area_digits] if self.area_digits else ""
+
+    def code(self, area):
+        """Index of an area, or None if it has no sales."""
+        try:
+            return self.areas.index(area)
+        except ValueError:
+            return None
+
+
+class MarketModel:
+    """Market-implied adjustments from the portfolio's closed sales.
+
+    Design matrices are built from the portfolio store per area size and
+    feature set and cached until reports are added, so refits only redo
+    the solves.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        self._designs = {}  # (area_digits, feature names) -> (data version, MarketDesign)
+
+    def design(self, area_digits=5, features=DEFAULT_FEATURES):
+        key = (area_digits, tuple(features))
+        version = self._store.data_version()
+        with self._lock:
+            cached = self._designs.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        sales, lines, subject_lines = self._store.market_data(list(features))
+        design = MarketDesign(sales, lines, subject_lines,
+                              [FEATURES[name] for name in features], area_digits)
+        with self._lock:
+            self._designs[key] = (version, design)
+        return design
+
+    def fit(self, area_digits=5, features=DEFAULT_FEATURES, confidence=0.95, areas=None):
+        """Fit every area and return one summary per area (or only `areas`)."""
+        design = self.design(area_digits, features)
+        fits = fit_areas(design.X, design.y, design.codes, len(design.areas), confidence)
+        wanted = range(len(design.areas)) if areas is None else [
+            code for code in map(design.code, areas) if code is not None
+        ]
+        return [self._summary(design, fits, code) for code in wanted]
+
+    def _summary(self, design, fits, code):
+        summary = {"area": design.areas[code], "sales": int(fits["sales"][code])}
+        if not fits["valid"][code]:
+            summary["error"] = "Not enough varied sales in this area to fit every feature."
+            return summary
+        rates = design.rates[design.rate_codes == code]
+        adjustments = []
+        for j, feature in enumerate(design.features):
+            estimate = fits["estimate"][code, j]
+            margin = fits["margin"][code, j]
+            implied = rates[:, j][~np.isnan(rates[:, j])]
+            within = np.abs(implied - estimate) <= margin
+            adjustments.append({
+                "type": feature.name,
+                "unit": feature.unit,
+                "estimate": round(float(estimate), 2),
+                "std_error": round(float(fits["std_error"][code, j]), 2),
+                "ci_low": round(float(estimate - margin), 2),
+                "ci_high": round(float(estimate + margin), 2),
+                "appraiser": {
+                    "lines": int(implied.size),
+                    "median_rate": round(float(np.median(implied)), 2) if implied.size else None,
+                    "within_ci_percent": round(float(within.mean() * 100), 1) if implied.size else None,
+                },
+            })
+        summary.update({
+            "r_squared": round(float(fits["r_squared"][code]), 4),
+            "residual_std": round(float(fits["residual_std"][code]), 2),
+            "adjustments": adjustments,
+        })
+        return summary
+
+
+def compare_report(result, fit, features=DEFAULT_FEATURES):
+    """Set a report's adjustments against a fitted area's market rates.
+
+    For every closed comparable sale and fitted feature the market-implied
+    adjustment is rate * (subject value - comparable value), with the
+    confidence interval scaled the same way; lines the appraiser priced
+    outside that interval are flagged.
+    """
+    grid = result["adjustment_grid"]
+    column = {adj_type: j for j, adj_type in enumerate(grid["types"])}
+    signed_date = result["report"].get("signed_date")
+    rates = {entry["type"]: entry for entry in fit["adjustments"]}
+
+    def line(row, adj_type):
+        j = column.get(adj_type)
+        if j is None:
+            return None, None
+        return grid["descriptions"][row][j], grid["amounts"][row][j]
+
+    comparables = []
+    for row, comp in enumerate(result["comparables"], start=1):
+        if comp["comp_type"] != "Sale" or not isinstance(comp["pre_adj"], (int, float)):
+            continue
+        lines = []
+        market_total = 0.0
+        for name in features:
+            feature = FEATURES[name]
+            subject_description, _ = line(0, name)
+            description, amount = line(row, name)
+            subject_value = feature_value(feature, subject_description, signed_date)
+            comp_value = feature_value(feature, description)
+            if subject_value is None or comp_value is None:
+                continue
+            difference = subject_value - comp_value
+            rate = rates[name]
+            market = rate["estimate"] * difference
+            low, high = sorted((rate["ci_low"] * difference, rate["ci_high"] * difference))
+            appraiser = amount or 0.0
+            market_total += market
+            lines.append({
+                "type": name,
+                "subject": subject_value,
+                "comparable": comp_value,
+                "appraiser_amount": appraiser,
+                # + 0.0 turns the -0.0 of unchanged features into 0.0
+                "market_amount": round(market, 2) + 0.0,
+                "ci_low": round(low, 2) + 0.0,
+                "ci_high": round(high, 2) + 0.0,
+                "outside_ci": not low <= appraiser <= high,
+            })
+        comparables.append({
+            "property_type": comp["property_type"],
+            "sale_price": comp["pre_adj"],
+            "appraiser_adjusted": comp["post_adj"],
+            # Sale price adjusted for the modeled features only
+            "market_adjusted": round(comp["pre_adj"] + market_total, 2),
+            "lines": lines,
+        })
+    return comparables
@@ -0,0 +1,111 @@
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+BYTE_BUCKETS = (
+    1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 2 * 1024 * 1024,
+    4 * 1024 * 1024, 8 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024,
+)
+SECONDS_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+REQUEST_SECONDS = Histogram(
+    "sensitivity_request_seconds", "Request latency by endpoint and status",
+    ["endpoint", "status"], buckets=SECONDS_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "sensitivity_stage_seconds", "Time spent in each processing stage",
+    ["stage"], buckets=SECONDS_BUCKETS,
+)
+UPLOAD_BYTES = Histogram(
+    "sensitivity_upload_bytes", "Size of uploaded documents", buckets=BYTE_BUCKETS,
+)
+RESPONSE_BYTES = Histogram(
+    "sensitivity_response_bytes", "Size of response bodies by endpoint",
+    ["endpoint"], buckets=BYTE_BUCKETS,
+)
+COMPARABLES_EXTRACTED = Histogram(
+    "sensitivity_comparables_extracted", "Comparables extracted per analyzed report",
+    buckets=(1, 3, 6, 10, 20, 50, 100, 250, 500),
+)
+ERRORS = Counter(
+    "sensitivity_errors_total", "Analysis and request errors by type", ["type"],
+)
+
+# Error messages returned by calculate_sensitivity, by metric label
+_ERROR_TYPES = (
+    ("Failed to parse XML", "parse_error"),
+    ("Invalid data", "invalid_data"),
+    ("No subject property", "no_subject"),
+    ("No valid comparable", "no_comparables"),
+)
+
+
+def error_type(message):
+    """Metric label for an analysis error message."""
+    for prefix, label in _ERROR_TYPES:
+        if message.startswith(prefix):
+            return label
+    return "unexpected"
+
+
+@contextmanager
+def stage(name):
+    """Time a block into the stage histogram and the Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        if has_request_context():
+            g.setdefault("server_timing", []).append((name, elapsed))
+
+
+def init_app(app):
+    """Time every request, add Server-Timing headers and serve /metrics."""
+
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.get("request_start")
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or "unknown"
+        REQUEST_SECONDS.labels(endpoint, str(response.status_code)).observe(elapsed)
+        if not response.is_streamed and response.content_length is not None:
+            RESPONSE_BYTES.labels(endpoint).observe(response.content_length)
+        if response.status_code >= 400:
+            ERRORS.labels(f"http_{response.status_code}").inc()
+
+        timings = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in g.get("server_timing", [])]
+        timings.append(f"total;dur={elapsed * 1000:.2f}")
+        response.headers["Server-Timing"] = ", ".join(timings)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        # Under a multi-process server each worker writes to
+        # PROMETHEUS_MULTIPROC_DIR and the scrape aggregates them.
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            data = generate_latest(registry)
+        else:
+            data = generate_latest()
+        return app.response_class(data, content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,83 @@
+import os
+import re
+import tempfile
+import threading
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+class FileCache:
+    """Directory of files keyed by SHA-256 digest, bounded by total size.
+
+    Files are written under a temporary name and renamed into place, so a
+    reader never sees a partial file and concurrent writers of the same key
+    are harmless. Every hit refreshes a file's mtime; once the directory
+    grows past `max_bytes` the least recently used files are removed.
+    """
+
+    def __init__(self, directory, suffix=".pdf", max_bytes=2 * 1024 * 1024 * 1024):
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def path(self, digest):
+        if not _DIGEST.fullmatch(digest or ""):
+            raise ValueError("Invalid digest")
+        return os.path.join(self.directory, digest + self.suffix)
+
+    def get(self, digest):
+        """Path of the cached file for `digest`, or None."""
+        path = self.path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return path
+
+    def create(self):
+        """Open a temporary file to write a new entry into."""
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix=".part", delete=False)
+
+    def commit(self, temp, digest):
+        """Move a finished temporary file into place and return its path."""
+        temp.close()
+        path = self.path(digest)
+        os.replace(temp.name, path)
+        self.stats["writes"] += 1
+        self._evict()
+        return path
+
+    def discard(self, temp):
+        temp.close()
+        try:
+            os.remove(temp.name)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                self.stats["evictions"] += 1
+
+    def snapshot(self):
+        return dict(self.stats)
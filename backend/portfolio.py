@@ -0,0 +1,572 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from market_conditions import TREND, TRENDS, market_rows
+from xml_parsing import sale_month
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_id TEXT PRIMARY KEY,
+    filename TEXT,
+    file_identifier TEXT,
+    form_type TEXT,
+    signed_date TEXT,
+    analyzed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subjects (
+    report_id TEXT PRIMARY KEY REFERENCES reports (report_id),
+    address TEXT,
+    address_key TEXT,
+    project_name TEXT,
+    sale_price REAL,
+    latitude REAL,
+    longitude REAL,
+    location_source TEXT
+);
+CREATE TABLE IF NOT EXISTS comparables (
+    report_id TEXT NOT NULL REFERENCES reports (report_id),
+    property_type TEXT NOT NULL,
+    address TEXT,
+    address_key TEXT,
+    mls_number TEXT,
+    project_name TEXT,
+    comp_type TEXT,
+    sale_date TEXT,
+    sale_month TEXT,
+    pre_adj REAL,
+    post_adj REAL,
+    total_adj_percent REAL,
+    postal_code TEXT,
+    latitude REAL,
+    longitude REAL,
+    proximity TEXT,
+    gross_adj_percent REAL,
+    total_adj_amount REAL,
+    PRIMARY KEY (report_id, property_type)
+);
+CREATE TABLE IF NOT EXISTS adjustments (
+    report_id TEXT NOT NULL REFERENCES reports (report_id),
+    property_type TEXT NOT NULL,
+    adjustment_type TEXT NOT NULL,
+    description TEXT,
+    amount REAL
+);
+CREATE TABLE IF NOT EXISTS market_inventory (
+    report_id TEXT NOT NULL REFERENCES reports (report_id),
+    postal_code TEXT,
+    period TEXT,
+    scope TEXT NOT NULL,
+    inventory_type TEXT NOT NULL,
+    month_range TEXT NOT NULL,
+    value REAL,
+    trend TEXT
+);
+CREATE TABLE IF NOT EXISTS market_rollups (
+    postal_code TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    inventory_type TEXT NOT NULL,
+    month_range TEXT NOT NULL,
+    period TEXT NOT NULL,
+    reports INTEGER NOT NULL,
+    value_count INTEGER NOT NULL,
+    value_sum REAL NOT NULL,
+    value_sumsq REAL NOT NULL,
+    value_min REAL,
+    value_max REAL,
+    increasing INTEGER NOT NULL,
+    stable INTEGER NOT NULL,
+    declining INTEGER NOT NULL,
+    PRIMARY KEY (postal_code, scope, inventory_type, month_range, period)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS subjects_address ON subjects (address_key);
+CREATE INDEX IF NOT EXISTS comparables_address ON comparables (address_key);
+CREATE INDEX IF NOT EXISTS comparables_mls ON comparables (mls_number);
+CREATE INDEX IF NOT EXISTS comparables_project ON comparables (project_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS comparables_sale_month ON comparables (sale_month);
+CREATE INDEX IF NOT EXISTS adjustments_report ON adjustments (report_id, property_type);
+CREATE INDEX IF NOT EXISTS market_inventory_report ON market_inventory (report_id);
+CREATE INDEX IF NOT EXISTS market_inventory_bucket ON market_inventory (postal_code, period);
+"""
+
+# Folds a batch's contribution into the market rollups. Sums and counts
+# add up; the extremes keep whichever side is set and smaller/larger.
+UPSERT_ROLLUP = """
+INSERT INTO market_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (postal_code, scope, inventory_type, month_range, period) DO UPDATE SET
+    reports = reports + excluded.reports,
+    value_count = value_count + excluded.value_count,
+    value_sum = value_sum + excluded.value_sum,
+    value_sumsq = value_sumsq + excluded.value_sumsq,
+    value_min = MIN(COALESCE(value_min, excluded.value_min), COALESCE(excluded.value_min, value_min)),
+    value_max = MAX(COALESCE(value_max, excluded.value_max), COALESCE(excluded.value_max, value_max)),
+    increasing = increasing + excluded.increasing,
+    stable = stable + excluded.stable,
+    declining = declining + excluded.declining
+"""
+
+# Recomputes the rollups of one ZIP code and period from market_inventory,
+# the same way _rollups() folds them ("Trend" rows count market_conditions
+# TRENDS). Used when a report is re-analyzed, since its old extremes cannot
+# be taken back out of a rollup; the bucket's rows are deleted first.
+REBUILD_ROLLUPS = """
+INSERT INTO market_rollups
+SELECT postal_code, scope, inventory_type, month_range, period, COUNT(*),
+    COUNT(CASE WHEN month_range != 'Trend' THEN value END),
+    TOTAL(CASE WHEN month_range != 'Trend' THEN value END),
+    TOTAL(CASE WHEN month_range != 'Trend' THEN value * value END),
+    MIN(CASE WHEN month_range != 'Trend' THEN value END),
+    MAX(CASE WHEN month_range != 'Trend' THEN value END),
+    COUNT(CASE WHEN month_range = 'Trend' AND trend = 'Increasing' THEN 1 END),
+    COUNT(CASE WHEN month_range = 'Trend' AND trend = 'Stable' THEN 1 END),
+    COUNT(CASE WHEN month_range = 'Trend' AND trend = 'Declining' THEN 1 END)
+FROM market_inventory WHERE postal_code = ? AND period = ?
+GROUP BY scope, inventory_type, month_range
+"""
+
+# Columns added since the first schema, as (table, column, declaration).
+# Stores created earlier get them on first connect; new columns go last so
+# positional inserts match both old and new stores.
+ADDED_COLUMNS = (
+    ("comparables", "postal_code", "TEXT"),
+    ("subjects", "latitude", "REAL"),
+    ("subjects", "longitude", "REAL"),
+    ("comparables", "latitude", "REAL"),
+    ("comparables", "longitude", "REAL"),
+    ("comparables", "proximity", "TEXT"),
+    ("comparables", "gross_adj_percent", "REAL"),
+    ("comparables", "total_adj_amount", "REAL"),
+    ("subjects", "location_source", "TEXT"),
+)
+
+# Tables holding a report's rows, the reports table last
+REPORT_TABLES = ("market_inventory", "adjustments", "comparables", "subjects", "reports")
+
+# Indexes on added columns, created once the columns exist
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS comparables_postal_code ON comparables (postal_code);
+"""
+
+_NON_ALNUM = re.compile(r"[^A-Z0-9]+")
+
+
+def address_key(address):
+    """Normalized address used for matching: upper case, punctuation collapsed."""
+    if not address or address == "Unknown":
+        return None
+    return _NON_ALNUM.sub(" ", address.upper()).strip()
+
+
+def _number(value):
+    # Results use "N/A" and "" for missing values
+    if value in (None, "", "N/A"):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PortfolioStore:
+    """Embedded SQLite store of every analyzed report.
+
+    record() only enqueues; a single background thread drains the queue and
+    writes reports in batches, one transaction per batch. When the queue is
+    full the report is dropped (and counted) rather than blocking the
+    caller. Reads use their own per-thread connections.
+    """
+
+    def __init__(self, path, batch_size=50, flush_interval=1.0, max_queue=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._local = threading.local()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "errors": 0}
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate(conn):
+        for table, column, declaration in ADDED_COLUMNS:
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                try:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+                except sqlite3.OperationalError:
+                    pass  # Added by another connection in the meantime
+        conn.executescript(ADDED_INDEXES)
+
+    def record(self, report_id, filename, result):
+        """Queue an analysis result for persistence. Never blocks."""
+        if "error" in result:
+            return
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((report_id, filename, result, time.time()))
+            self.stats["queued"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _ensure_writer(self):
+        # Started lazily so forked workers each get their own thread
+        if self._writer is None or not self._writer.is_alive():
+            with self._writer_lock:
+                if self._writer is None or not self._writer.is_alive():
+                    self._writer = threading.Thread(
+                        target=self._write_loop, name="portfolio-writer", daemon=True
+                    )
+                    self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                written, failed = self.write_batch(batch)
+                self.stats["written"] += written
+                self.stats["errors"] += failed
+            except sqlite3.Error:
+                self.stats["errors"] += 1
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until everything queued so far has been written."""
+        self._queue.join()
+
+    def write_batch(self, batch):
+        """Write (report_id, filename, result, analyzed_at) tuples in one transaction.
+
+        A report queued twice in the batch is written once, from its last
+        copy. Each report is written under its own savepoint, so a report
+        that fails is rolled back and skipped without losing the others.
+        Returns (reports written, reports failed).
+
+        Market conditions are also folded into the per ZIP and quarter
+        rollups, touching only the rollup rows the batch contributes to.
+        A report already in the store has been counted; re-analyzing it
+        rebuilds every ZIP and quarter it contributed to before or after
+        from market_inventory, so the rollups follow the new analysis.
+        """
+        latest = {entry[0]: entry for entry in batch}
+        conn = self._connect()
+        written, failed = [], 0
+        with conn:
+            conn.execute("BEGIN")
+            counted = {
+                row[0] for row in conn.execute(
+                    f"SELECT DISTINCT report_id FROM market_inventory"
+                    f" WHERE report_id IN ({', '.join('?' * len(latest))})",
+                    list(latest),
+                )
+            }
+            rebuilt = set(conn.execute(
+                f"SELECT DISTINCT postal_code, period FROM market_inventory"
+                f" WHERE report_id IN ({', '.join('?' * len(counted))})"
+                f" AND postal_code IS NOT NULL AND period IS NOT NULL",
+                list(counted),
+            )) if counted else set()
+            inventory = []
+            for entry in latest.values():
+                conn.execute("SAVEPOINT report")
+                try:
+                    rows = self._report_rows(*entry)
+                    self._replace_report(conn, entry[0], rows)
+                except (sqlite3.Error, LookupError, TypeError, ValueError):
+                    conn.execute("ROLLBACK TO report")
+                    failed += 1
+                else:
+                    written.append(entry[0])
+                    inventory.extend(rows["market_inventory"])
+                    if entry[0] in counted:
+                        rebuilt.update(
+                            (row[1], row[2]) for row in rows["market_inventory"]
+                            if row[1] is not None and row[2] is not None
+                        )
+                conn.execute("RELEASE report")
+            conn.executemany(UPSERT_ROLLUP, self._rollups(inventory, counted, rebuilt))
+            for bucket in rebuilt:
+                conn.execute("DELETE FROM market_rollups WHERE postal_code = ? AND period = ?", bucket)
+                conn.execute(REBUILD_ROLLUPS, bucket)
+        return len(written), failed
+
+    @staticmethod
+    def _report_rows(report_id, filename, result, analyzed_at):
+        """Rows of one analysis result, by table."""
+        report = result.get("report", {})
+        subject = result["subject_property"]
+        rows = {
+            "reports": [(
+                report_id, filename, report.get("file_identifier"),
+                report.get("form_type"), report.get("signed_date"), analyzed_at,
+            )],
+            "subjects": [(
+                report_id, subject["address"], address_key(subject["address"]),
+                subject.get("project_name"), _number(subject["pre_adj"]),
+                subject.get("latitude"), subject.get("longitude"),
+                subject.get("location_source"),
+            )],
+            "comparables": [],
+            "adjustments": [],
+            "market_inventory": [],
+        }
+        for comp in result["comparables"]:
+            sale_date = comp["sale_date"] if comp["sale_date"] != "N/A" else None
+            rows["comparables"].append((
+                report_id, comp["property_type"], comp["address"],
+                address_key(comp["address"]), comp.get("mls_number"),
+                comp.get("project_name"), comp["comp_type"], sale_date,
+                sale_month(sale_date), _number(comp["pre_adj"]),
+                _number(comp["post_adj"]), _number(comp["total_adj_percent"]),
+                comp.get("postal_code"), comp.get("latitude"), comp.get("longitude"),
+                comp.get("proximity"), _number(comp.get("gross_adj_percent")),
+                _number(comp.get("total_adj_amount")),
+            ))
+        grid = result["adjustment_grid"]
+        for prop, descriptions, amounts in zip(grid["properties"], grid["descriptions"], grid["amounts"]):
+            for adj_type, description, amount in zip(grid["types"], descriptions, amounts):
+                if description is not None or amount is not None:
+                    rows["adjustments"].append((report_id, prop, adj_type, description, amount))
+        conditions = result.get("market_conditions")
+        if conditions:
+            rows["market_inventory"].extend(
+                (report_id, conditions["postal_code"], conditions["period"]) + row
+                for row in market_rows(conditions)
+            )
+        return rows
+
+    @staticmethod
+    def _replace_report(conn, report_id, rows):
+        # Re-analyzing a report replaces its rows
+        for table in REPORT_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE report_id = ?", (report_id,))
+        for table in reversed(REPORT_TABLES):
+            if rows[table]:
+                placeholders = ", ".join("?" * len(rows[table][0]))
+                conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows[table])
+
+    @staticmethod
+    def _rollups(inventory, counted, rebuilt=()):
+        """Rollup rows for the market_inventory rows of reports not yet counted.
+
+        Rows in a (postal code, period) of `rebuilt` are left out; those
+        buckets are recomputed from the table instead.
+        """
+        rollups = {}
+        for report_id, postal_code, period, scope, inventory_type, month_range, value, trend in inventory:
+            if report_id in counted or postal_code is None or period is None:
+                continue
+            if (postal_code, period) in rebuilt:
+                continue
+            key = (postal_code, scope, inventory_type, month_range, period)
+            # reports, count, sum, sum of squares, min, max, increasing, stable, declining
+            rollup = rollups.setdefault(key, [0, 0, 0.0, 0.0, None, None, 0, 0, 0])
+            rollup[0] += 1
+            if month_range == TREND:
+                rollup[6 + TRENDS.index(trend)] += 1
+            elif value is not None:
+                rollup[1] += 1
+                rollup[2] += value
+                rollup[3] += value * value
+                rollup[4] = value if rollup[4] is None else min(rollup[4], value)
+                rollup[5] = value if rollup[5] is None else max(rollup[5], value)
+        return [key + tuple(rollup) for key, rollup in rollups.items()]
+
+    def comparable_uses(self, mls_number=None, address=None, project_name=None,
+                        sale_month_from=None, sale_month_to=None, limit=100):
+        """Earlier uses of a comparable, newest reports first.
+
+        Filters combine with AND; each one is served by an index.
+        """
+        clauses, params = [], []
+        if mls_number:
+            clauses.append("c.mls_number = ?")
+            params.append(mls_number)
+        if address:
+            clauses.append("c.address_key = ?")
+            params.append(address_key(address))
+        if project_name:
+            clauses.append("c.project_name = ? COLLATE NOCASE")
+            params.append(project_name)
+        if sale_month_from:
+            clauses.append("c.sale_month >= ?")
+            params.append(sale_month_from)
+        if sale_month_to:
+            clauses.append("c.sale_month <= ?")
+            params.append(sale_month_to)
+        if not clauses:
+            raise ValueError("At least one filter is required")
+
+        rows = self._connect().execute(
+            "SELECT c.*, r.filename, r.file_identifier, r.signed_date, r.analyzed_at,"
+            " s.address AS subject_address"
+            " FROM comparables c"
+            " JOIN reports r ON r.report_id = c.report_id"
+            " LEFT JOIN subjects s ON s.report_id = c.report_id"
+            f" WHERE {' AND '.join(clauses)}"
+            " ORDER BY r.analyzed_at DESC LIMIT ?",
+            params + [limit],
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def market_data(self, adjustment_types):
+        """Closed comparable sales and their adjustment lines, for market models.
+
+        Returns (sales, lines, subject_lines): the sales as dicts, newest
+        report first, with their comparables rowid as "comp_id"; their lines
+        of the given types as (comp_id, adjustment_type, description, amount)
+        tuples; and the subjects' lines of those types as (report_id,
+        adjustment_type, description) tuples.
+        """
+        conn = self._connect()
+        placeholders = ", ".join("?" for _ in adjustment_types)
+        sales = conn.execute(
+            "SELECT c.rowid AS comp_id, c.report_id, c.postal_code, c.mls_number, c.address_key,"
+            " c.sale_month, c.pre_adj, r.signed_date"
+            " FROM comparables c JOIN reports r ON r.report_id = c.report_id"
+            " WHERE c.comp_type = 'Sale' AND c.pre_adj > 0"
+            " ORDER BY r.analyzed_at DESC"
+        ).fetchall()
+        # Plain tuples; these run to several lines per sale
+        lines = conn.execute(
+            "SELECT c.rowid, a.adjustment_type, a.description, a.amount"
+            " FROM comparables c JOIN adjustments a"
+            "  ON a.report_id = c.report_id AND a.property_type = c.property_type"
+            f" WHERE c.comp_type = 'Sale' AND c.pre_adj > 0 AND a.adjustment_type IN ({placeholders})",
+            adjustment_types,
+        ).fetchall()
+        subject_lines = conn.execute(
+            "SELECT report_id, adjustment_type, description FROM adjustments"
+            f" WHERE property_type = 'Subject' AND adjustment_type IN ({placeholders})",
+            adjustment_types,
+        ).fetchall()
+        return ([dict(row) for row in sales], [tuple(row) for row in lines],
+                [tuple(row) for row in subject_lines])
+
+    def comparables_state(self):
+        """(row count, highest rowid) of the comparables table."""
+        return tuple(self._connect().execute("SELECT COUNT(*), MAX(rowid) FROM comparables").fetchone())
+
+    def comparables_since(self, rowid):
+        """Comparables stored after `rowid`, in rowid order, with the rowid as "comp_id"."""
+        rows = self._connect().execute(
+            "SELECT rowid AS comp_id, report_id, property_type, address, address_key, mls_number,"
+            " comp_type, sale_date, sale_month, pre_adj, postal_code, latitude, longitude"
+            " FROM comparables WHERE rowid > ? ORDER BY rowid",
+            (rowid,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def subject_location(self, report_id):
+        """(latitude, longitude) reported for a stored report's subject, or None.
+
+        A location estimated from the report's own comparables (and one
+        stored before the source was recorded) does not count: distances
+        from it would only echo the comparables it was derived from.
+        """
+        row = self._connect().execute(
+            "SELECT latitude, longitude, location_source FROM subjects WHERE report_id = ?",
+            (report_id,),
+        ).fetchone()
+        if row is None or row["latitude"] is None or row["location_source"] != "reported":
+            return None
+        return row["latitude"], row["longitude"]
+
+    def market_rollups(self, postal_code, scope="neighborhood", inventory_types=None):
+        """Rollup rows of one ZIP code, ordered by type, month range and period.
+
+        Served from the rollup table's primary key, so the cost depends on
+        the number of periods, not on the number of reports behind them.
+        """
+        query = "SELECT * FROM market_rollups WHERE postal_code = ? AND scope = ?"
+        params = [postal_code, scope]
+        if inventory_types:
+            query += f" AND inventory_type IN ({', '.join('?' * len(inventory_types))})"
+            params.extend(inventory_types)
+        query += " ORDER BY inventory_type, month_range, period"
+        return [dict(row) for row in self._connect().execute(query, params)]
+
+    def market_postal_code(self, report_id):
+        """ZIP code the market conditions of a stored report were filed under."""
+        row = self._connect().execute(
+            "SELECT postal_code FROM market_inventory WHERE report_id = ? LIMIT 1", (report_id,)
+        ).fetchone()
+        return row["postal_code"] if row else None
+
+    def validation_data(self):
+        """Every stored comparable as arrays for uad_checks.validate_portfolio().
+
+        Adjustment line amounts are summed per comparable with bincount
+        rather than in SQL, keyed by the comparable's rowid.
+        """
+        conn = self._connect()
+        comps = conn.execute(
+            "SELECT rowid, report_id, property_type, pre_adj, post_adj, total_adj_amount,"
+            " total_adj_percent, gross_adj_percent FROM comparables ORDER BY rowid"
+        ).fetchall()
+        lines = conn.execute(
+            "SELECT c.rowid, a.amount FROM adjustments a"
+            " JOIN comparables c ON c.report_id = a.report_id AND c.property_type = a.property_type"
+            " WHERE a.amount IS NOT NULL"
+        ).fetchall()
+
+        def column(index):
+            return np.array([row[index] for row in comps], dtype=float)
+
+        rowids = np.array([row[0] for row in comps], dtype=np.int64)
+        line_rowids, amounts = (np.array(values) for values in zip(*lines)) if lines else (
+            np.empty(0, dtype=np.int64), np.empty(0))
+        positions = np.searchsorted(rowids, line_rowids)
+        report_ids, report_index = np.unique([row[1] for row in comps], return_inverse=True)
+        return {
+            "report_ids": report_ids.tolist(),
+            "report_index": report_index.reshape(-1),
+            "property_types": [row[2] for row in comps],
+            "sale": column(3),
+            "adjusted": column(4),
+            "total": column(5),
+            "net_percent": column(6),
+            "gross_percent": column(7),
+            "line_net": np.bincount(positions, weights=amounts, minlength=len(comps)),
+            "line_gross": np.bincount(positions, weights=np.abs(amounts), minlength=len(comps)),
+        }
+
+    def data_version(self):
+        """Changes whenever reports are written; used to invalidate derived data."""
+        row = self._connect().execute("SELECT COUNT(*), MAX(analyzed_at) FROM reports").fetchone()
+        return tuple(row)
+
+    def snapshot(self):
+        snapshot = dict(self.stats)
+        snapshot["pending"] = self._queue.qsize()
+        return snapshot
@@ -0,0 +1,398 @@
+"""Opt-in profiling of individual requests.
+
+Two modes, both off unless configured:
+
+* Traced: a request carrying the X-Profile-Token header (or ?profile=)
+  with the PROFILE_TOKEN value runs under cProfile and tracemalloc. The
+  response gets an X-Profile-Id header naming the stored profile.
+* Sampled: PROFILE_SAMPLE_RATE of requests (e.g. 0.01) have their stack
+  sampled every PROFILE_SAMPLE_INTERVAL seconds from a helper thread. The
+  request itself is not instrumented, so this is cheap enough for
+  production.
+
+A streamed response (e.g. NDJSON) does its work while the body is sent,
+so its profile covers the body too and is stored once the body is done.
+
+Profiles are written as JSON files to PROFILE_DIR, shared by all workers,
+and served from /api/admin/profiles with the same token. With neither
+mode configured, profiled() returns the view unchanged.
+"""
+import cProfile
+import functools
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+from flask import current_app, g, has_request_context, jsonify, request
+
+TOKEN = os.environ.get("PROFILE_TOKEN", "")
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
+# Seconds a traced request waits for the one running before it gives up
+TRACE_WAIT = float(os.environ.get("PROFILE_TRACE_WAIT", 5))
+# Entries kept per list in a profile (functions, allocation sites)
+TOP = int(os.environ.get("PROFILE_TOP", 30))
+ENABLED = bool(TOKEN) or SAMPLE_RATE > 0
+
+# Frames traced per allocation; the innermost is what is reported
+TRACE_FRAMES = 1
+
+_ID = re.compile(r"[0-9a-f]{32}")
+# Longest first, so a file is shown relative to the most specific root
+_ROOTS = sorted({os.path.dirname(os.path.abspath(__file__))}
+                | {os.path.abspath(path) for path in sys.path if path}, key=len, reverse=True)
+
+
+def _location(filename, line):
+    for root in _ROOTS:
+        if filename.startswith(root + os.sep):
+            filename = filename[len(root) + 1:]
+            break
+    return f"{filename}:{line}"
+
+
+class ProfileStore:
+    """Directory of profile JSON files, keeping the newest `keep`."""
+
+    def __init__(self, directory, keep=200):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def save(self, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=self.directory, suffix=".part", delete=False) as f:
+            json.dump(profile, f)
+        os.replace(f.name, os.path.join(self.directory, profile["id"] + ".json"))
+        self._prune()
+
+    def get(self, profile_id):
+        if not _ID.fullmatch(profile_id or ""):
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + ".json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _entries(self):
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        return sorted(entries, key=lambda entry: entry.stat().st_mtime, reverse=True)
+
+    def list(self, limit=50):
+        """Summaries of the newest profiles, newest first."""
+        summaries = []
+        for entry in self._entries()[:limit]:
+            profile = self.get(entry.name[:-len(".json")])
+            if profile is not None:
+                summaries.append({key: value for key, value in profile.items()
+                                  if key not in ("functions", "allocations")})
+        return summaries
+
+    def _prune(self):
+        with self._lock:
+            for entry in self._entries()[self.keep:]:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+store = ProfileStore(
+    os.environ.get("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")),
+    keep=int(os.environ.get("PROFILE_KEEP", 200)),
+)
+
+
+def top_functions(profiler, limit=TOP):
+    """Functions of a cProfile run by cumulative time."""
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": name,
+            "location": _location(filename, line),
+            "calls": calls,
+            "own_seconds": round(own, 6),
+            "cumulative_seconds": round(cumulative, 6),
+        }
+        for (filename, line, name), (_, calls, own, cumulative, _) in rows
+    ]
+
+
+def top_allocations(snapshot, limit=TOP):
+    """Source lines holding the most traced memory in a tracemalloc snapshot."""
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    return [
+        {
+            "location": _location(stat.traceback[0].filename, stat.traceback[0].lineno),
+            "size_bytes": stat.size,
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics("lineno")[:limit]
+    ]
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval.
+
+    Each sample counts the innermost function as running ("own") and every
+    function on the stack, once, as active ("cumulative"). Times are the
+    share of samples applied to the elapsed time, so they are estimates;
+    the sampler wakes up less often than asked while the request holds
+    the GIL, which the share does not depend on.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self._own = Counter()
+        self._cumulative = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            code = frame.f_code
+            self._own[(code.co_filename, code.co_firstlineno, code.co_name)] += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if key not in seen:
+                    seen.add(key)
+                    self._cumulative[key] += 1
+                frame = frame.f_back
+
+    def top_functions(self, elapsed, limit=TOP):
+        scale = elapsed / self.samples if self.samples else 0.0
+        return [
+            {
+                "function": name,
+                "location": _location(filename, line),
+                "samples": samples,
+                "own_seconds": round(self._own[(filename, line, name)] * scale, 6),
+                "cumulative_seconds": round(samples * scale, 6),
+            }
+            for (filename, line, name), samples in self._cumulative.most_common(limit)
+        ]
+
+
+def authorized():
+    """Whether the request carries the profiling token."""
+    supplied = request.headers.get("X-Profile-Token") or request.args.get("profile")
+    return bool(TOKEN and supplied) and hmac.compare_digest(supplied.encode(), TOKEN.encode())
+
+
+def active():
+    """Whether the current request is being traced; traced requests skip caches."""
+    return has_request_context() and g.get("profiling") == "traced"
+
+
+# cProfile and tracemalloc are process wide, so one traced request at a time
+_trace_lock = threading.Lock()
+
+
+def _describe(mode, started, response):
+    """The request part of a profile, taken while the request context is active."""
+    return {
+        "id": uuid.uuid4().hex,
+        "mode": mode,
+        "endpoint": request.endpoint,
+        "path": request.path,
+        "args": {name: value for name, value in request.args.items() if name != "profile"},
+        "started": started,
+        "status": response.status_code,
+        "cache": response.headers.get("X-Cache"),
+        "streamed": response.is_streamed,
+        "pid": os.getpid(),
+    }
+
+
+def _record(profile, elapsed, **details):
+    store.save(dict(profile, elapsed_seconds=round(elapsed, 6), **details))
+
+
+def _after_body(response, finish, resume=None, pause=None):
+    """Run finish() once a streamed body has been sent, or at once otherwise.
+
+    A streamed body is produced by the server after the view returns;
+    resume() and pause() are called around the production of each chunk.
+    finish() also runs if the response is closed before the body is done.
+    """
+    if not response.is_streamed:
+        finish()
+        return
+    finished = []
+    body = response.response
+
+    def finish_once():
+        if not finished:
+            finished.append(True)
+            finish()
+
+    def measured():
+        chunks = iter(body)
+        try:
+            while True:
+                if resume is not None:
+                    resume()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    if pause is not None:
+                        pause()
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            finish_once()
+
+    response.response = measured()
+    response.call_on_close(finish_once)
+
+
+def _traced(view, args, kwargs):
+    # Held until the profile is stored, which for a streamed response is
+    # after its body has been sent; a slow or stuck one must not pile up
+    # every traced request behind it
+    if not _trace_lock.acquire(timeout=TRACE_WAIT):
+        return jsonify({"error": "Another request is being traced; try again later"}), 409
+    try:
+        g.profiling = "traced"
+        profiler = cProfile.Profile()
+        tracemalloc.start(TRACE_FRAMES)
+        started, start = time.time(), time.perf_counter()
+        profiler.enable()
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        finally:
+            profiler.disable()
+    except BaseException:
+        tracemalloc.stop()
+        _trace_lock.release()
+        raise
+    profile = _describe("traced", started, response)
+
+    def finish():
+        try:
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _record(
+                profile, elapsed,
+                functions=top_functions(profiler),
+                # Memory still held when the response was done, by allocation site
+                allocations=top_allocations(snapshot),
+                memory={"traced_bytes": current, "peak_bytes": peak},
+            )
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            _trace_lock.release()
+
+    response.headers["X-Profile-Id"] = profile["id"]
+    _after_body(response, finish, resume=profiler.enable, pause=profiler.disable)
+    return response
+
+
+def _sampled(view, args, kwargs):
+    g.profiling = "sampled"
+    sampler = StackSampler(threading.get_ident())
+    started, start = time.time(), time.perf_counter()
+    sampler.start()
+    try:
+        response = current_app.make_response(view(*args, **kwargs))
+    except BaseException:
+        sampler.stop()
+        raise
+    profile = _describe("sampled", started, response)
+
+    def finish():
+        sampler.stop()
+        elapsed = time.perf_counter() - start
+        _record(profile, elapsed, functions=sampler.top_functions(elapsed),
+                samples=sampler.samples, sample_interval=sampler.interval)
+
+    _after_body(response, finish)
+    return response
+
+
+def profiled(view):
+    """Profile the view when the request opts in or is sampled."""
+    if not ENABLED:
+        return view
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if TOKEN and ("X-Profile-Token" in request.headers or "profile" in request.args):
+            if not authorized():
+                return jsonify({"error": "Invalid profiling token"}), 403
+            return _traced(view, args, kwargs)
+        if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+            return _sampled(view, args, kwargs)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_app(app):
+    """Serve stored profiles under /api/admin/profiles when a token is set."""
+    if not TOKEN:
+        return
+
+    def admin(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not authorized():
+                return jsonify({"error": "Invalid profiling token"}), 403
+            return view(*args, **kwargs)
+        return wrapper
+
+    @app.route("/api/admin/profiles", methods=["GET"])
+    @admin
+    def list_profiles():
+        try:
+            limit = int(request.args.get("limit", 50))
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        profiles = store.list(limit=min(limit, 1000))
+        return jsonify({"profiles": profiles, "count": len(profiles)})
+
+    @app.route("/api/admin/profiles/<profile_id>", methods=["GET"])
+    @admin
+    def get_profile(profile_id):
+        profile = store.get(profile_id)
+        if profile is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return jsonify(profile)
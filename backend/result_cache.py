@@ -0,0 +1,200 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Size of the blocks read while hashing an upload
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def hash_stream(stream, chunk_size=HASH_CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a seekable stream and rewind it."""
+    digest = hashlib.sha256()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache of serialized analysis results keyed by content hash.
+
+    The memory tier is an LRU bounded by entry count and by total payload
+    size; the disk tier is a SQLite database shared by every worker on the
+    host and bounded by total payload size, which triggers keep up to date
+    in a one-row table so that a put never has to add up the whole cache.
+    Both tiers drop entries older than `max_age` seconds.
+    Every key is prefixed with `version`, so bumping the version makes all
+    older entries unreachable to this process. They stay on disk for workers
+    still running the old version during a rolling deploy, and are aged out
+    or evicted as least recently used like any other entry. Constructing
+    the cache touches no files.
+    """
+
+    SCHEMA = """
+    BEGIN IMMEDIATE;
+    CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        created REAL NOT NULL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+    CREATE INDEX IF NOT EXISTS results_created ON results (created);
+    CREATE TABLE IF NOT EXISTS result_bytes (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL);
+    INSERT OR IGNORE INTO result_bytes VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM results));
+    CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results
+        BEGIN UPDATE result_bytes SET total = total + NEW.size; END;
+    CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results
+        BEGIN UPDATE result_bytes SET total = total - OLD.size; END;
+    CREATE TRIGGER IF NOT EXISTS results_update AFTER UPDATE OF size ON results
+        BEGIN UPDATE result_bytes SET total = total - OLD.size + NEW.size; END;
+    COMMIT;
+    """
+
+    def __init__(self, path, version, max_entries=256, max_memory_bytes=64 * 1024 * 1024,
+                 max_disk_bytes=256 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+
+        self._memory = OrderedDict()  # key -> (created, payload)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()  # One SQLite connection per thread
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _key(self, digest):
+        return f"{self.version}:{digest}"
+
+    def get(self, digest):
+        """Return the cached payload (bytes) for a content hash, or None."""
+        key = self._key(digest)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.max_age:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+                self._memory_bytes -= len(entry[1])
+                self.stats["evictions"] += 1
+
+        if self.path:
+            try:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT payload, created FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.max_age:
+                    conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                    payload = bytes(row[0])
+                    self._remember(key, row[1], payload)
+                    with self._lock:
+                        self.stats["disk_hits"] += 1
+                    return payload
+            except sqlite3.Error:
+                pass  # A broken disk tier must never fail the request
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, digest, payload):
+        """Store a serialized result (bytes) under a content hash."""
+        key = self._key(digest)
+        now = time.time()
+        self._remember(key, now, payload)
+
+        if self.path:
+            try:
+                conn = self._connect()
+                # An upsert rather than INSERT OR REPLACE, whose implicit
+                # delete would not fire the size trigger
+                conn.execute(
+                    "INSERT INTO results (key, version, payload, size, created, accessed)"
+                    " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET"
+                    " payload = excluded.payload, size = excluded.size,"
+                    " created = excluded.created, accessed = excluded.accessed",
+                    (key, self.version, payload, len(payload), now, now),
+                )
+                self._evict_disk(conn, now)
+                conn.commit()
+            except sqlite3.Error:
+                pass
+
+    def _remember(self, key, created, payload):
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous[1])
+            if len(payload) > self.max_memory_bytes:
+                return  # Would push out everything else; the disk tier keeps it
+            self._memory[key] = (created, payload)
+            self._memory_bytes += len(payload)
+            while len(self._memory) > self.max_entries or self._memory_bytes > self.max_memory_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def _evict_disk(self, conn, now):
+        # Age first, then least recently used until under the size budget
+        expired = conn.execute("DELETE FROM results WHERE created < ?", (now - self.max_age,))
+        evicted = expired.rowcount
+        total = conn.execute("SELECT total FROM result_bytes").fetchone()[0]
+        while total > self.max_disk_bytes:
+            oldest = conn.execute(
+                "SELECT key, size FROM results ORDER BY accessed LIMIT 32"
+            ).fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if total <= self.max_disk_bytes:
+                    break
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        if evicted:
+            with self._lock:
+                self.stats["evictions"] += evicted
+
+    def snapshot(self):
+        """Counters plus current tier sizes, for the stats endpoint."""
+        with self._lock:
+            snapshot = dict(self.stats)
+            snapshot["memory_entries"] = len(self._memory)
+            snapshot["memory_bytes"] = self._memory_bytes
+        snapshot["version"] = self.version
+        return snapshot
@@ -0,0 +1,146 @@
+import hashlib
+import json
+
+from portfolio import address_key
+
+# Comparable fields compared between revisions. property_type is left out
+# because comps are renumbered when one is added or removed.
+COMPARED_FIELDS = (
+    "address", "pre_adj", "post_adj", "comp_type", "total_adj_percent",
+    "gross_adj_percent", "sale_date", "project_name", "mls_number",
+)
+
+
+def _records(result):
+    """Comparables of a result with their adjustment lines attached.
+
+    Returns (subject, comparables); each record holds the result row, its
+    adjustment lines as {type: {"description", "amount"}} and a match key.
+    """
+    grid = result["adjustment_grid"]
+    rows = [result["subject_property"]] + result["comparables"]
+    records = []
+    for row, descriptions, amounts in zip(rows, grid["descriptions"], grid["amounts"]):
+        lines = {
+            adj_type: {"description": description, "amount": amount}
+            for adj_type, description, amount in zip(grid["types"], descriptions, amounts)
+            if description is not None or amount is not None
+        }
+        records.append({"row": row, "lines": lines})
+    return records[0], records[1:]
+
+
+def match_comparables(old, new):
+    """Pair comparable records of two revisions.
+
+    Comps are matched by MLS number first and then by normalized address.
+    Returns (pairs, removed, added) with pairs as (old, new) tuples.
+    """
+    pairs = []
+    unmatched_old = list(old)
+    unmatched_new = list(new)
+    for key_of in (lambda r: r["row"].get("mls_number"), lambda r: address_key(r["row"].get("address"))):
+        by_key = {}
+        for record in unmatched_old:
+            key = key_of(record)
+            if key:
+                by_key.setdefault(key, []).append(record)
+        still_new = []
+        for record in unmatched_new:
+            candidates = by_key.get(key_of(record))
+            if candidates:
+                match = candidates.pop(0)
+                unmatched_old.remove(match)
+                pairs.append((match, record))
+            else:
+                still_new.append(record)
+        unmatched_new = still_new
+    return pairs, unmatched_old, unmatched_new
+
+
+def diff_lines(old_lines, new_lines):
+    """Added, removed and changed adjustment lines between two records."""
+    added = [dict(type=t, **line) for t, line in new_lines.items() if t not in old_lines]
+    removed = [dict(type=t, **line) for t, line in old_lines.items() if t not in new_lines]
+    changed = [
+        {"type": t, "old": old_lines[t], "new": line}
+        for t, line in new_lines.items()
+        if t in old_lines and old_lines[t] != line
+    ]
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def diff_fields(old_row, new_row, fields=COMPARED_FIELDS):
+    return {
+        name: {"old": old_row.get(name), "new": new_row.get(name)}
+        for name in fields
+        if old_row.get(name) != new_row.get(name)
+    }
+
+
+def _summary(record):
+    row = record["row"]
+    return {
+        "property_type": row["property_type"],
+        "address": row.get("address"),
+        "mls_number": row.get("mls_number"),
+    }
+
+
+def diff_results(old_result, new_result):
+    """Structured diff of two analyzed revisions of a report.
+
+    Returns the diff plus the new revision's comparable records, each
+    tagged "added", "changed" or "unchanged", for incremental analysis.
+    """
+    old_subject, old_comps = _records(old_result)
+    new_subject, new_comps = _records(new_result)
+    pairs, removed, added = match_comparables(old_comps, new_comps)
+
+    changed, unchanged = [], []
+    status = {id(record): "added" for record in added}
+    for old, new in pairs:
+        fields = diff_fields(old["row"], new["row"])
+        lines = diff_lines(old["lines"], new["lines"])
+        entry = {
+            "old_property_type": old["row"]["property_type"],
+            "new_property_type": new["row"]["property_type"],
+            "address": new["row"].get("address"),
+            "mls_number": new["row"].get("mls_number"),
+        }
+        if fields or any(lines.values()):
+            entry.update(fields=fields, adjustments=lines)
+            changed.append(entry)
+            status[id(new)] = "changed"
+        else:
+            unchanged.append(entry)
+            status[id(new)] = "unchanged"
+
+    subject_fields = diff_fields(
+        old_subject["row"], new_subject["row"], ("address", "pre_adj", "project_name")
+    )
+    diff = {
+        "subject": {
+            "fields": subject_fields,
+            "adjustments": diff_lines(old_subject["lines"], new_subject["lines"]),
+        },
+        "comparables": {
+            "added": [_summary(record) for record in added],
+            "removed": [_summary(record) for record in removed],
+            "changed": changed,
+            "unchanged": unchanged,
+        },
+    }
+    return diff, [(record, status[id(record)]) for record in new_comps]
+
+
+def record_digest(record, factors):
+    """Content hash of everything a comparable's sensitivity depends on."""
+    row = record["row"]
+    content = {
+        "adjusted": row.get("post_adj"),
+        "amounts": {t: line["amount"] for t, line in record["lines"].items()},
+        "factors": list(factors),
+    }
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
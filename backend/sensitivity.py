@@ -0,0 +1,308 @@
+import numpy as np
+
+# Default scaling grid: 0% to 200% of each adjustment in 5% steps
+DEFAULT_FACTORS = np.round(np.arange(0.0, 2.0 + 1e-9, 0.05), 2)
+
+
+def _float_or_nan(value):
+    return value if isinstance(value, (int, float)) else np.nan
+
+
+def comparable_arrays(result):
+    """Pull the arrays the engines need out of a calculate_sensitivity result.
+
+    Returns a dict with the subject price, the adjustment type names and,
+    for the closed sales only (comp_type "Sale" with an adjusted price),
+    their labels, sale prices, adjusted prices and the comps x types matrix
+    of adjustment amounts (missing lines are 0).
+    """
+    grid = result["adjustment_grid"]
+    comps = result["comparables"]
+
+    # Grid rows are the subject followed by the comparables in order
+    amounts = np.array(grid["amounts"][1:], dtype=float).reshape(len(comps), len(grid["types"]))
+    sale = np.array([_float_or_nan(c["pre_adj"]) for c in comps])
+    adjusted = np.array([_float_or_nan(c["post_adj"]) for c in comps])
+    included = np.array([c["comp_type"] == "Sale" for c in comps], dtype=bool) & ~np.isnan(adjusted)
+
+    return {
+        "subject_price": _float_or_nan(result["subject_property"]["pre_adj"]),
+        "types": grid["types"],
+        "labels": [c["property_type"] for c, keep in zip(comps, included) if keep],
+        "sale": sale[included],
+        "adjusted": adjusted[included],
+        "amounts": np.nan_to_num(amounts[included]),
+    }
+
+
+def _value_stats(values, subject_price):
+    """Range, mean and spread statistics over the last (comparables) axis."""
+    high = values.max(axis=-1)
+    low = values.min(axis=-1)
+    stats = {
+        "min": low,
+        "max": high,
+        "range": high - low,
+        "mean": values.mean(axis=-1),
+        "std": values.std(axis=-1),
+    }
+    if not np.isnan(subject_price):
+        # Root-mean-square distance of the adjusted prices from the subject
+        stats["subject_rms_deviation"] = np.sqrt(((values - subject_price) ** 2).mean(axis=-1))
+    return stats
+
+
+def _to_list(stats):
+    return {key: np.round(value, 2).tolist() for key, value in stats.items()}
+
+
+def adjustment_sensitivity(result, factors=DEFAULT_FACTORS):
+    """Scale each adjustment type over `factors` and measure the value response.
+
+    For type j and factor f every included comparable's adjusted price
+    becomes adjusted + (f - 1) * amount_j; all types x factors scenarios are
+    evaluated in one broadcast over a (types, factors, comps) array.
+    Returns curves per statistic plus tornado rows (types sorted by how much
+    the mean indicated value swings between the lowest and highest factor).
+    """
+    arrays = comparable_arrays(result)
+    if not len(arrays["adjusted"]):
+        return {"error": "No closed comparable sales with adjusted prices to analyze."}
+
+    factors = np.asarray(factors, dtype=float)
+    amounts = arrays["amounts"]
+
+    # Only adjustment types that actually move a price can matter
+    active = np.flatnonzero(np.any(amounts != 0, axis=0))
+    types = [arrays["types"][j] for j in active]
+    amounts = amounts[:, active]
+
+    # (types, factors, comps)
+    scenarios = (
+        arrays["adjusted"][None, None, :]
+        + (factors[None, :, None] - 1.0) * amounts.T[:, None, :]
+    )
+    curves = _value_stats(scenarios, arrays["subject_price"])
+    baseline = _value_stats(arrays["adjusted"], arrays["subject_price"])
+
+    low_i = int(np.argmin(factors))
+    high_i = int(np.argmax(factors))
+    mean_swing = np.abs(curves["mean"][:, high_i] - curves["mean"][:, low_i])
+    range_swing = np.abs(curves["range"][:, high_i] - curves["range"][:, low_i])
+    order = np.lexsort((-range_swing, -mean_swing))
+
+    tornado = [
+        {
+            "type": types[j],
+            "total_amount": round(float(amounts[:, j].sum()), 2),
+            "low": {
+                "factor": float(factors[low_i]),
+                "mean": round(float(curves["mean"][j, low_i]), 2),
+                "range": round(float(curves["range"][j, low_i]), 2),
+            },
+            "high": {
+                "factor": float(factors[high_i]),
+                "mean": round(float(curves["mean"][j, high_i]), 2),
+                "range": round(float(curves["range"][j, high_i]), 2),
+            },
+            "mean_swing": round(float(mean_swing[j]), 2),
+            "range_swing": round(float(range_swing[j]), 2),
+        }
+        for j in order
+    ]
+
+    return {
+        "comparables": arrays["labels"],
+        "subject_price": None if np.isnan(arrays["subject_price"]) else arrays["subject_price"],
+        "factors": factors.tolist(),
+        "types": types,
+        "baseline": {key: round(float(value), 2) for key, value in baseline.items()},
+        "curves": _to_list(curves),
+        "tornado": tornado,
+    }
+
+
+# Percentiles reported by the Monte Carlo simulation
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Bins per histogram when the sample count is too large to keep in memory
+HISTOGRAM_BINS = 4096
+
+# Most float64 cells drawn or kept per chunk (16 MB per array); chunks are
+# shrunk to fit, whatever chunk_size asks for
+MAX_CHUNK_CELLS = 2_000_000
+
+
+def _draw_errors(rng, distribution, size, scale):
+    """Relative errors for adjustment lines; `scale` broadcasts over the types axis."""
+    if distribution == "normal":
+        return rng.standard_normal(size) * scale
+    if distribution == "uniform":
+        return rng.uniform(-1.0, 1.0, size) * scale
+    if distribution == "triangular":
+        return rng.triangular(-1.0, 0.0, 1.0, size) * scale
+    raise ValueError(f"Unknown distribution: {distribution}")
+
+
+class _StreamingPercentiles:
+    """Approximate percentiles from fixed-bin histograms, one per column.
+
+    Bin edges come from the first chunk widened by its own spread; later
+    values outside the edges are clipped into the end bins.
+    """
+
+    def __init__(self, first_chunk, bins=HISTOGRAM_BINS):
+        low = first_chunk.min(axis=0)
+        high = first_chunk.max(axis=0)
+        pad = np.maximum(high - low, 1.0)
+        self.low = low - pad
+        self.width = (high + pad - self.low) / bins
+        self.bins = bins
+        self.counts = np.zeros((first_chunk.shape[1], bins), dtype=np.int64)
+        self.add(first_chunk)
+
+    def add(self, chunk):
+        index = ((chunk - self.low) / self.width).astype(np.int64)
+        np.clip(index, 0, self.bins - 1, out=index)
+        # Offset each column into its own block of bins and count in one call
+        offsets = np.arange(chunk.shape[1]) * self.bins
+        self.counts += np.bincount(
+            (index + offsets).ravel(), minlength=self.counts.size
+        ).reshape(self.counts.shape)
+
+    def percentiles(self, qs):
+        cdf = np.cumsum(self.counts, axis=1)
+        cdf = cdf / cdf[:, -1:]
+        result = np.empty((len(qs), self.counts.shape[0]))
+        for k, q in enumerate(qs):
+            bin_index = np.argmax(cdf >= q / 100.0, axis=1)
+            result[k] = self.low + (bin_index + 0.5) * self.width
+        return result
+
+
+def monte_carlo(result, samples=100000, uncertainty=0.10, uncertainty_by_type=None,
+                distribution="normal", correlation="line", seed=None, chunk_size=250000,
+                percentiles=DEFAULT_PERCENTILES):
+    """Simulate the adjusted prices with every adjustment line uncertain.
+
+    Each line amount is multiplied by (1 + e), where e follows `distribution`
+    scaled by the type's uncertainty (`uncertainty_by_type` overrides the
+    default `uncertainty`; for "normal" it is the standard deviation, for
+    "uniform"/"triangular" the half-width). With correlation="line" every
+    comp/type cell gets its own draw; with "type" one draw per type is
+    shared by all comps (a mis-estimated market rate).
+
+    Samples are drawn in chunks of `chunk_size` from one seeded generator,
+    smaller when a chunk would hold more than MAX_CHUNK_CELLS draws (a
+    line-correlated sample draws one per comp and type). When every
+    sample fits in one chunk's worth of results, percentiles are exact;
+    beyond that they come from streaming histograms so memory stays
+    bounded.
+    """
+    arrays = comparable_arrays(result)
+    if not len(arrays["adjusted"]):
+        return {"error": "No closed comparable sales with adjusted prices to simulate."}
+
+    # Lines without an amount cannot move a price; leave them out of the draws
+    active = np.flatnonzero(np.any(arrays["amounts"] != 0, axis=0))
+    amounts = arrays["amounts"][:, active]
+    n_comps, n_types = amounts.shape
+    overrides = uncertainty_by_type or {}
+    scale = np.array([float(overrides.get(arrays["types"][j], uncertainty)) for j in active])
+
+    rng = np.random.default_rng(seed)
+    # Draws and result columns per sample
+    draws = n_comps * n_types if correlation == "line" else n_types
+    columns = n_comps + 4
+    exact = samples <= chunk_size and samples * columns <= MAX_CHUNK_CELLS
+    chunk_size = max(1, min(chunk_size, samples, MAX_CHUNK_CELLS // max(draws, columns)))
+    collected = []
+    streaming = None
+
+    remaining = samples
+    while remaining:
+        size = min(chunk_size, remaining)
+        remaining -= size
+        # (samples, comps): reported adjusted price plus the perturbation
+        if correlation == "type":
+            errors = _draw_errors(rng, distribution, (size, n_types), scale)
+            values = arrays["adjusted"] + errors @ amounts.T
+        else:
+            errors = _draw_errors(rng, distribution, (size, n_comps, n_types), scale)
+            values = arrays["adjusted"] + np.einsum("snt,nt->sn", errors, amounts)
+        # Columns: each comp, then the indicated range low/high/mean/width
+        low = values.min(axis=1)
+        high = values.max(axis=1)
+        block = np.column_stack([values, low, high, values.mean(axis=1), high - low])
+        if exact:
+            collected.append(block)
+        elif streaming is None:
+            streaming = _StreamingPercentiles(block)
+        else:
+            streaming.add(block)
+
+    qs = list(percentiles)
+    if exact:
+        bands = np.percentile(np.concatenate(collected), qs, axis=0)
+    else:
+        bands = streaming.percentiles(qs)
+
+    def band(column):
+        return {f"p{q:g}": round(float(bands[k, column]), 2) for k, q in enumerate(qs)}
+
+    return {
+        "samples": samples,
+        "seed": seed,
+        "distribution": distribution,
+        "correlation": correlation,
+        "percentile_method": "exact" if exact else "histogram",
+        "chunk_size": chunk_size,
+        "comparables": [
+            {"property_type": label, "reported": float(arrays["adjusted"][i]), "bands": band(i)}
+            for i, label in enumerate(arrays["labels"])
+        ],
+        "indicated_value": {
+            "low": band(n_comps),
+            "high": band(n_comps + 1),
+            "mean": band(n_comps + 2),
+            "range": band(n_comps + 3),
+        },
+    }
+
+
+def comparable_sensitivity(adjusted, amounts, factors=DEFAULT_FACTORS):
+    """Response of a single comparable's adjusted price to its adjustments.
+
+    `amounts` maps adjustment type to line amount. Returns the adjusted
+    price with every line scaled together by each factor, plus, per type,
+    the price at the lowest and highest factor with only that line scaled
+    (largest lines first). Used to analyze comparables one at a time so
+    unchanged ones can be reused between report revisions.
+    """
+    factors = np.asarray(factors, dtype=float)
+    lines = [(adj_type, amount) for adj_type, amount in amounts.items() if amount]
+    vector = np.array([amount for _, amount in lines], dtype=float)
+    net = float(vector.sum())
+    low_i = int(np.argmin(factors))
+    high_i = int(np.argmax(factors))
+
+    # (types, factors)
+    per_type = adjusted + (factors[None, :] - 1.0) * vector[:, None]
+    order = np.argsort(-np.abs(vector), kind="stable")
+
+    return {
+        "adjusted": adjusted,
+        "net_adjustment": round(net, 2),
+        "gross_adjustment": round(float(np.abs(vector).sum()), 2),
+        "factors": factors.tolist(),
+        "all_lines": np.round(adjusted + (factors - 1.0) * net, 2).tolist(),
+        "lines": [
+            {
+                "type": lines[j][0],
+                "amount": lines[j][1],
+                "low": round(float(per_type[j, low_i]), 2),
+                "high": round(float(per_type[j, high_i]), 2),
+            }
+            for j in order
+        ],
+    }
@@ -0,0 +1,281 @@
+import re
+import threading
+import time
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.7613
+MILES_PER_DEGREE_LAT = 69.05
+
+COMPASS = ("N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
+           "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW")
+_COMPASS_DEGREES = {label: i * 22.5 for i, label in enumerate(COMPASS)}
+
+# ProximityToSubjectDescription, e.g. "0.07 miles SE"
+_PROXIMITY = re.compile(r"([\d.]+)\s*mi(?:les?)?\s+([NSEW]{1,3})\b", re.IGNORECASE)
+
+# Grid cell size of the nearby-sales index; 0.01 degrees is about 0.7 miles
+# north-south and 0.5 miles east-west at US latitudes
+CELL_DEGREES = 0.01
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Great-circle distance in miles; arguments broadcast as arrays."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def initial_bearing(lat1, lon1, lat2, lon2):
+    """Compass bearing in degrees from point 1 towards point 2."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return np.degrees(np.arctan2(x, y)) % 360
+
+
+def compass_label(bearing):
+    """Nearest 8-point compass direction ("N", "NE", ...) of a bearing."""
+    return COMPASS[int((bearing + 22.5) // 45) * 2 % 16]
+
+
+def parse_proximity(description):
+    """(miles, bearing in degrees) from a ProximityToSubjectDescription, or None."""
+    if not description:
+        return None
+    match = _PROXIMITY.search(description)
+    if not match or match.group(2).upper() not in _COMPASS_DEGREES:
+        return None
+    try:
+        return float(match.group(1)), _COMPASS_DEGREES[match.group(2).upper()]
+    except ValueError:
+        return None
+
+
+def estimate_subject_location(comparables):
+    """Estimate the subject's coordinates from its comparables.
+
+    Reports rarely carry the subject's own coordinates, but every located
+    comparable says how far and in which direction it lies from the
+    subject. Stepping back from each comparable gives an estimate of the
+    subject; nearer comparables are both more precise (the direction is
+    rounded to the compass) and weighted more. Returns (lat, lon) or None.
+    """
+    points = []
+    for comp in comparables:
+        proximity = parse_proximity(comp.get("proximity"))
+        if proximity is None or comp.get("latitude") is None or comp.get("longitude") is None:
+            continue
+        points.append((comp["latitude"], comp["longitude"], proximity[0], proximity[1]))
+    if not points:
+        return None
+    lat, lon, miles, bearing = np.array(points, dtype=float).T
+    theta = np.radians(bearing)
+    subject_lat = lat - miles * np.cos(theta) / MILES_PER_DEGREE_LAT
+    subject_lon = lon - miles * np.sin(theta) / (MILES_PER_DEGREE_LAT * np.cos(np.radians(lat)))
+    weights = 1.0 / (miles + 0.05) ** 2
+    return (float(np.average(subject_lat, weights=weights)),
+            float(np.average(subject_lon, weights=weights)))
+
+
+def locate_comparables(subject, comparables):
+    """Add coordinates, distance and bearing from the subject to a result.
+
+    Uses the subject's own coordinates when the report has them and the
+    estimate from its comparables otherwise; subject["location_source"]
+    says which ("reported", "estimated" or None). Distances and bearings of
+    all comparables are computed in one vectorized pass.
+    """
+    if subject.get("latitude") is not None and subject.get("longitude") is not None:
+        subject["location_source"] = "reported"
+    else:
+        estimate = estimate_subject_location(comparables)
+        subject["latitude"], subject["longitude"] = estimate if estimate else (None, None)
+        subject["location_source"] = "estimated" if estimate else None
+
+    located = [i for i, comp in enumerate(comparables)
+               if comp.get("latitude") is not None and comp.get("longitude") is not None]
+    for comp in comparables:
+        comp["distance_miles"] = None
+        comp["bearing"] = None
+    if subject["latitude"] is None or not located:
+        return
+    lat = np.array([comparables[i]["latitude"] for i in located])
+    lon = np.array([comparables[i]["longitude"] for i in located])
+    distance = haversine_miles(subject["latitude"], subject["longitude"], lat, lon)
+    bearing = initial_bearing(subject["latitude"], subject["longitude"], lat, lon)
+    for i, miles, degrees in zip(located, distance.tolist(), bearing.tolist()):
+        comparables[i]["distance_miles"] = round(miles, 3)
+        comparables[i]["bearing"] = round(degrees, 1)
+
+
+def month_index(month):
+    """"yyyy-mm" as a month count, -1 if unknown."""
+    if not month:
+        return -1
+    year, month = month.split("-")[:2]
+    return int(year) * 12 + int(month) - 1
+
+
+class GridIndex:
+    """Fixed grid over (lat, lon) points for radius queries.
+
+    Points are sorted by cell key (latitude row, then longitude column), so
+    each latitude row of a query's bounding box is one contiguous slice
+    found by binary search. Only points in those slices have their exact
+    distance computed.
+    """
+
+    def __init__(self, lat, lon, cell_degrees=CELL_DEGREES):
+        self.cell = cell_degrees
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        keys = self._keys(lat, lon)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.lat = lat[self.order]
+        self.lon = lon[self.order]
+
+    def _row(self, lat):
+        return np.floor((np.asarray(lat) + 90.0) / self.cell).astype(np.int64)
+
+    def _column(self, lon):
+        return np.floor((np.asarray(lon) + 180.0) / self.cell).astype(np.int64)
+
+    def _keys(self, lat, lon):
+        return (self._row(lat) << 32) + self._column(lon)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def query(self, lat, lon, radius_miles):
+        """(positions in the input order, distances) of points within the radius."""
+        dlat = radius_miles / MILES_PER_DEGREE_LAT
+        dlon = radius_miles / (MILES_PER_DEGREE_LAT * max(np.cos(np.radians(abs(lat) + dlat)), 1e-6))
+        first_row, last_row = int(self._row(lat - dlat)), int(self._row(lat + dlat))
+        first_column, last_column = int(self._column(lon - dlon)), int(self._column(lon + dlon))
+        rows = np.arange(first_row, last_row + 1, dtype=np.int64) << 32
+        starts = np.searchsorted(self.keys, rows + first_column, side="left")
+        ends = np.searchsorted(self.keys, rows + last_column, side="right")
+        candidates = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends) if e > s] or
+                                    [np.empty(0, dtype=np.int64)])
+        distance = haversine_miles(lat, lon, self.lat[candidates], self.lon[candidates])
+        within = distance <= radius_miles
+        return self.order[candidates[within]], distance[within]
+
+
+class NearbySales:
+    """Spatial index over every located comparable in the portfolio store.
+
+    The store is checked for changes at most every REFRESH_INTERVAL
+    seconds, so queries in between touch only memory. New comparables go
+    into a small unsorted tail that is scanned directly; once the tail
+    grows past a fraction of the grid, the grid is rebuilt over everything.
+    When rows have disappeared (a re-analyzed report replaces its rows)
+    the index is reloaded from scratch.
+    """
+
+    REFRESH_INTERVAL = 1.0
+    # Rebuild the grid once the tail holds this share of all points
+    REBUILD_FRACTION = 0.1
+    MIN_REBUILD = 1000
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._rows = []
+        self._lat = np.empty(0)
+        self._lon = np.empty(0)
+        self._month = np.empty(0, dtype=np.int64)
+        self._grid = GridIndex([], [])
+        self._state = (0, None)  # (row count, highest rowid) of the store when last loaded
+        self._checked = None
+
+    def refresh(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._checked is not None and now - self._checked < self.REFRESH_INTERVAL:
+                return
+            self._checked = now
+            state = self._store.comparables_state()
+            if state == self._state:
+                return
+            count, last_rowid = self._state
+            rows = self._store.comparables_since(last_rowid or 0)
+            if count + len(rows) != state[0]:
+                self._reset()
+                self._checked = now
+                rows = self._store.comparables_since(0)
+            self._state = state
+            located = [row for row in rows if row["latitude"] is not None and row["longitude"] is not None]
+            if not located:
+                return
+            self._rows.extend(located)
+            self._lat = np.concatenate([self._lat, [row["latitude"] for row in located]])
+            self._lon = np.concatenate([self._lon, [row["longitude"] for row in located]])
+            self._month = np.concatenate([
+                self._month, np.array([month_index(row["sale_month"]) for row in located], dtype=np.int64)
+            ])
+            tail = len(self._rows) - len(self._grid)
+            if tail >= max(self.MIN_REBUILD, self.REBUILD_FRACTION * len(self._rows)):
+                self._grid = GridIndex(self._lat, self._lon)
+
+    def query(self, lat, lon, radius_miles=0.5, months=None, as_of=None, sales_only=True,
+              exclude_report=None, limit=100):
+        """Comparables within `radius_miles` of a point, nearest first.
+
+        `months` keeps sales from the `months` months up to `as_of` ("yyyy-mm",
+        by default the newest sale month indexed). A sale used in several
+        reports is returned once, from the newest report.
+        """
+        self.refresh()
+        with self._lock:
+            rows, grid = self._rows, self._grid
+            lat_all, lon_all, month_all = self._lat, self._lon, self._month
+
+        positions, distance = grid.query(lat, lon, radius_miles)
+        # Points added since the grid was built
+        tail = np.arange(len(grid), len(rows))
+        if len(tail):
+            tail_distance = haversine_miles(lat, lon, lat_all[tail], lon_all[tail])
+            keep = tail_distance <= radius_miles
+            positions = np.concatenate([positions, tail[keep]])
+            distance = np.concatenate([distance, tail_distance[keep]])
+
+        if months is not None and len(positions):
+            newest = month_index(as_of) if as_of else int(month_all.max())
+            sale_months = month_all[positions]
+            keep = (sale_months > newest - months) & (sale_months <= newest)
+            positions, distance = positions[keep], distance[keep]
+
+        bearing = initial_bearing(lat, lon, lat_all[positions], lon_all[positions])
+        # Newest reports (highest rowid) first, so they win duplicates
+        results = []
+        seen = set()
+        for position, miles, degrees in sorted(zip(positions.tolist(), distance.tolist(), bearing.tolist()),
+                                              key=lambda item: -item[0]):
+            row = rows[position]
+            if sales_only and row["comp_type"] != "Sale":
+                continue
+            if exclude_report is not None and row["report_id"] == exclude_report:
+                continue
+            identity = row["mls_number"] or row["address_key"]
+            key = (identity, row["sale_month"]) if identity else row["comp_id"]
+            if key in seen:
+                continue
+            seen.add(key)
+            result = dict(row, distance_miles=round(miles, 3), bearing=round(degrees, 1),
+                          direction=compass_label(degrees))
+            results.append(result)
+        results.sort(key=lambda result: result["distance_miles"])
+        return results[:limit]
+
+    def snapshot(self):
+        with self._lock:
+            return {"points": len(self._rows), "grid": len(self._grid),
+                    "tail": len(self._rows) - len(self._grid)}
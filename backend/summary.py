@@ -0,0 +1,187 @@
+import json
+
+from field_spec import profile_for
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+
+def _number(value):
+    # Results use "N/A" and "" for missing values; percentages are strings
+    if value in (None, "", "N/A"):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Accumulator:
+    """Count, sum, min and max of a series, updated one value at a time."""
+
+    def __init__(self):
+        self.values = []  # Kept only for the median
+        self.total = 0.0
+        self.low = None
+        self.high = None
+
+    def add(self, value):
+        if value is None:
+            return
+        self.values.append(value)
+        self.total += value
+        self.low = value if self.low is None else min(self.low, value)
+        self.high = value if self.high is None else max(self.high, value)
+
+    def stats(self, relative=False):
+        """Summary of the series; `relative` adds the range as a percent of the minimum."""
+        if not self.values:
+            empty = {"count": 0, "min": None, "max": None, "range": None, "mean": None, "median": None}
+            if relative:
+                empty["range_percent"] = None
+            return empty
+        ordered = sorted(self.values)
+        middle = len(ordered) // 2
+        if len(ordered) % 2:
+            median = ordered[middle]
+        else:
+            median = (ordered[middle - 1] + ordered[middle]) / 2
+        spread = self.high - self.low
+        stats = {
+            "count": len(ordered),
+            "min": self.low,
+            "max": self.high,
+            "range": round(spread, 2),
+            "mean": round(self.total / len(ordered), 2),
+            "median": round(median, 2),
+        }
+        if relative:
+            stats["range_percent"] = round(100.0 * spread / self.low, 2) if self.low > 0 else None
+        return stats
+
+
+def summary_statistics(subject_property, comparables):
+    """Summary of the comparable grid, computed in one pass over the comps.
+
+    Price statistics cover the closed sales (comp_type "Sale") only, as the
+    pre/post ranges do. Listings are counted in listing_count; any other
+    excluded type (REO, Short, ...) is counted by type in other_types. Adjustment percentages are the report's own net and
+    gross totals. The subject spread compares each adjusted sale price with
+    the subject's sale price.
+    """
+    pre_adj = _Accumulator()
+    post_adj = _Accumulator()
+    net_percent = _Accumulator()
+    gross_percent = _Accumulator()
+    differences = _Accumulator()
+    sale_count = 0
+    listing_count = 0
+    other_types = {}
+    subject_price = _number(subject_property.get("pre_adj"))
+
+    for comp in comparables:
+        if comp["comp_type"] == "Listing":
+            listing_count += 1
+            continue
+        if comp["comp_type"] != "Sale":
+            other_types[comp["comp_type"]] = other_types.get(comp["comp_type"], 0) + 1
+            continue
+        sale_count += 1
+        adjusted = _number(comp["post_adj"])
+        pre_adj.add(_number(comp["pre_adj"]))
+        post_adj.add(adjusted)
+        net_percent.add(_number(comp.get("total_adj_percent")))
+        gross_percent.add(_number(comp.get("gross_adj_percent")))
+        if subject_price is not None and adjusted is not None:
+            differences.add(adjusted - subject_price)
+
+    spread = None
+    if differences.values:
+        post = post_adj.stats()
+        spread = {
+            "subject_price": subject_price,
+            "mean_difference": round(differences.total / len(differences.values), 2),
+            "max_abs_difference": max(abs(differences.low), abs(differences.high)),
+            "within_adjusted_range": post["min"] <= subject_price <= post["max"],
+        }
+
+    return {
+        "sale_count": sale_count,
+        "listing_count": listing_count,
+        "other_count": sum(other_types.values()),
+        "other_types": other_types,
+        "pre_adj": pre_adj.stats(relative=True),
+        "post_adj": post_adj.stats(relative=True),
+        "net_adj_percent": net_percent.stats(),
+        "gross_adj_percent": gross_percent.stats(),
+        "subject_spread": spread,
+    }
+
+
+# Comparable fields in the columnar layout and whether they are numeric
+COLUMNS = (
+    ("property_type", False),
+    ("address", False),
+    ("pre_adj", True),
+    ("post_adj", True),
+    ("comp_type", False),
+    ("total_adj_percent", True),
+    ("gross_adj_percent", True),
+    ("total_adj_amount", True),
+    ("sale_date", False),
+    ("project_name", False),
+    ("mls_number", False),
+    ("postal_code", False),
+    ("latitude", True),
+    ("longitude", True),
+    ("proximity", False),
+    ("distance_miles", True),
+    ("bearing", True),
+)
+
+
+def _clean(value, numeric):
+    # "N/A" and "" placeholders become null
+    if numeric:
+        return _number(value)
+    return None if value in ("N/A", "") else value
+
+
+def columns_for(form_name):
+    """COLUMNS followed by the form specific fields of the form's profile."""
+    profile = profile_for(form_name)
+    return COLUMNS + tuple(
+        (name, name in profile.numeric_fields) for name in profile.extra_fields
+    )
+
+
+def to_columnar(result):
+    """Columnar layout of a calculate_sensitivity result.
+
+    Comparables become one array per field, every entry in an array has the
+    same type (numbers for numeric fields) and missing values are null.
+    Everything else in the result is passed through unchanged.
+    """
+    comparables = result["comparables"]
+    subject = result["subject_property"]
+    columns = columns_for(result["report"].get("form_name"))
+    numeric = dict(columns)
+    columnar = {"format": "columnar"}
+    columnar.update(result)
+    columnar["subject_property"] = {
+        key: _clean(value, numeric.get(key, False)) for key, value in subject.items()
+    }
+    columnar["comparables"] = {
+        name: [_clean(comp.get(name), is_numeric) for comp in comparables]
+        for name, is_numeric in columns
+    }
+    return columnar
+
+
+def encode_json(data):
+    """Compact UTF-8 JSON with a trailing newline, using orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(data, separators=(",", ":")) + "\n").encode("utf-8")
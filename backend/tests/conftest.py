@@ -0,0 +1,30 @@
+import glob
+import os
+import sys
+
+import pytest
+
+# Tests run without the on-disk stores; tests that need one make their own
+os.environ.setdefault("RESULT_CACHE_PATH", "")
+os.environ.setdefault("PORTFOLIO_PATH", "")
+os.environ.setdefault("JOB_STORE_PATH", "")
+
+# Make the backend modules importable when run from any directory
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# The sample reports in the repository root
+SAMPLE_DIR = os.path.dirname(BACKEND_DIR)
+SAMPLES = sorted(glob.glob(os.path.join(SAMPLE_DIR, "*.[xX][mM][lL]")))
+
+
+@pytest.fixture(params=SAMPLES, ids=os.path.basename)
+def sample(request):
+    """Path of each sample report in turn."""
+    return request.param
+
+
+@pytest.fixture
+def sample_bytes(sample):
+    with open(sample, "rb") as f:
+        return f.read()
@@ -0,0 +1,122 @@
+import io
+import threading
+
+import pytest
+
+import app as app_module
+import upload_stream
+from admission import AdmissionController, Overloaded
+
+
+class StalledBody(io.BytesIO):
+    """Request body that stalls at byte `cut` until released."""
+
+    def __init__(self, data, cut=0):
+        super().__init__(data)
+        self.cut = cut
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def readinto(self, buffer):
+        if self.tell() < self.cut:
+            return super().readinto(memoryview(buffer)[:self.cut - self.tell()])
+        self.reading.set()
+        self.release.wait(10)
+        return super().readinto(buffer)
+
+
+def test_slow_upload_does_not_hold_a_parse_slot(monkeypatch, sample_bytes):
+    admission = AdmissionController(limit=1, queue_size=0, max_wait=0)
+    monkeypatch.setattr(app_module, "admission", admission)
+    client = app_module.app.test_client()
+    body = StalledBody(sample_bytes)
+    responses = []
+    slow = threading.Thread(target=lambda: responses.append(client.post(
+        "/api/calculate?filename=report.xml", input_stream=body,
+        content_type="application/xml", content_length=len(sample_bytes))))
+    slow.start()
+    try:
+        assert body.reading.wait(10)
+        assert admission.snapshot()["active"] == 0
+        fast = app_module.app.test_client().post(
+            "/api/calculate?filename=report.xml", data=sample_bytes, content_type="application/xml")
+        assert fast.status_code == 200
+    finally:
+        body.release.set()
+        slow.join(10)
+    assert responses[0].status_code == 200
+    assert admission.snapshot()["active"] == 0
+
+
+def test_full_queue_is_shed_with_retry_after():
+    admission = AdmissionController(limit=1, queue_size=0, max_wait=0)
+    token = admission.acquire()
+    with pytest.raises(Overloaded) as error:
+        admission.acquire()
+    assert error.value.status == 429
+    assert error.value.retry_after >= 1
+    admission.release(token)
+    admission.release(admission.acquire())
+
+
+def test_slot_is_held_from_the_first_bytes(monkeypatch, sample_bytes):
+    admission = AdmissionController(limit=1, queue_size=0, max_wait=0)
+    monkeypatch.setattr(app_module, "admission", admission)
+    body = StalledBody(sample_bytes, cut=len(sample_bytes) // 2)
+    responses = []
+    upload = threading.Thread(target=lambda: responses.append(app_module.app.test_client().post(
+        "/api/calculate?filename=report.xml", input_stream=body,
+        content_type="application/xml", content_length=len(sample_bytes))))
+    upload.start()
+    try:
+        assert body.reading.wait(10)
+        assert admission.snapshot()["active"] == 1
+        busy = app_module.app.test_client().post(
+            "/api/calculate?filename=report.xml", data=sample_bytes, content_type="application/xml")
+        assert busy.status_code == 429
+        assert busy.headers["Retry-After"]
+    finally:
+        body.release.set()
+        upload.join(10)
+    assert responses[0].status_code == 200
+    assert admission.snapshot()["active"] == 0
+
+
+def test_ndjson_rows_are_sent_before_the_body_is_in(sample_bytes):
+    body = StalledBody(sample_bytes, cut=len(sample_bytes) * 9 // 10)
+    response = app_module.app.test_client().post(
+        "/api/calculate?filename=report.xml&format=ndjson", input_stream=body,
+        content_type="application/xml", content_length=len(sample_bytes), buffered=False)
+    lines = response.iter_encoded()
+    try:
+        first = next(lines)
+        assert b'"type":"subject"' in first
+        assert not body.release.is_set()
+    finally:
+        body.release.set()
+    rest = b"".join(lines)
+    response.close()
+    assert b'"type":"summary"' in rest
+
+
+def test_slow_sender_is_cut_off(monkeypatch, sample_bytes):
+    monkeypatch.setattr(upload_stream, "MIN_UPLOAD_GRACE", 0)
+    monkeypatch.setattr(upload_stream, "MIN_UPLOAD_RATE", 10 ** 12)
+    response = app_module.app.test_client().post(
+        "/api/calculate?filename=report.xml", data=sample_bytes, content_type="application/xml")
+    assert response.status_code == 408
+    assert "too slowly" in response.get_json()["error"]
+
+
+def test_form_upload_is_shed_when_busy(monkeypatch, sample_bytes):
+    admission = AdmissionController(limit=1, queue_size=0, max_wait=0)
+    monkeypatch.setattr(app_module, "admission", admission)
+    token = admission.acquire()
+    try:
+        response = app_module.app.test_client().post(
+            "/api/sensitivity", content_type="multipart/form-data",
+            data={"file": (io.BytesIO(sample_bytes), "report.xml")})
+    finally:
+        admission.release(token)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
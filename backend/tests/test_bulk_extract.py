@@ -0,0 +1,108 @@
+import csv
+import glob
+import os
+import shutil
+
+import pytest
+
+import bulk_extract
+from conftest import SAMPLES
+
+
+@pytest.fixture
+def archive(tmp_path):
+    directory = tmp_path / "archive"
+    directory.mkdir()
+    for path in SAMPLES:
+        shutil.copy(path, directory)
+    return str(directory)
+
+
+def load_manifest(output):
+    return bulk_extract.load_manifest(os.path.join(output, bulk_extract.MANIFEST_NAME))
+
+
+def manifest_paths(output):
+    return sorted(load_manifest(output)[0])
+
+
+def read_parquet(output, table):
+    pq = pytest.importorskip("pyarrow.parquet")
+    paths = sorted(glob.glob(os.path.join(output, f"{table}-*.parquet")))
+    return [row for path in paths for row in pq.read_table(path).to_pylist()]
+
+
+def test_parquet_parts_are_complete(archive, tmp_path):
+    output = str(tmp_path / "out")
+    bulk_extract.run(archive, output, "parquet", workers=1, row_group_size=10)
+    assert manifest_paths(output) == sorted(os.path.basename(path) for path in SAMPLES)
+    subjects = read_parquet(output, "subjects")
+    assert sorted(row["source_file"] for row in subjects) == manifest_paths(output)
+    assert not glob.glob(os.path.join(output, "*.tmp"))
+
+
+def test_resume_skips_recorded_files(archive, tmp_path):
+    output = str(tmp_path / "out")
+    bulk_extract.run(archive, output, "csv", workers=1)
+    parts = sorted(os.listdir(output))
+    bulk_extract.run(archive, output, "csv", workers=1)
+    assert sorted(os.listdir(output)) == parts
+    with open(glob.glob(os.path.join(output, "comparables-*.csv"))[0], newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert {row["source_file"] for row in rows} == set(manifest_paths(output))
+
+
+def test_interrupted_run_records_nothing_unwritten(archive, tmp_path, monkeypatch):
+    output = str(tmp_path / "out")
+
+    def crash(self, rows):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(bulk_extract.ParquetTableWriter, "write", crash)
+        with pytest.raises(KeyboardInterrupt):
+            bulk_extract.run(archive, output, "parquet", workers=1)
+    # Nothing is marked done and no unreadable part file is left behind
+    assert manifest_paths(output) == []
+    assert os.listdir(output) == [bulk_extract.MANIFEST_NAME]
+
+    bulk_extract.run(archive, output, "parquet", workers=1)
+    assert len(read_parquet(output, "subjects")) == len(SAMPLES)
+
+
+def test_failed_files_can_be_skipped_until_changed(archive, tmp_path):
+    output = str(tmp_path / "out")
+    broken = os.path.join(archive, "broken.xml")
+    with open(broken, "w") as f:
+        f.write("<REPORT>")
+    bulk_extract.run(archive, output, "csv", workers=1)
+    done, failed = load_manifest(output)
+    assert list(failed) == ["broken.xml"]
+    assert "broken.xml" not in done
+
+    # Unchanged, so skipped on request
+    parts = sorted(os.listdir(output))
+    bulk_extract.run(archive, output, "csv", workers=1, skip_failed=True)
+    assert sorted(os.listdir(output)) == parts
+    assert list(load_manifest(output)[1]) == ["broken.xml"]
+
+    # A changed file is retried regardless; once fixed it counts as extracted
+    shutil.copy(SAMPLES[0], broken)
+    bulk_extract.main([archive, output, "--format", "csv", "--workers", "1", "--skip-failed"])
+    done, failed = load_manifest(output)
+    assert not failed and "broken.xml" in done
+    assert len(os.listdir(output)) > len(parts)
+
+
+def test_failed_files_are_retried_by_default(archive, tmp_path):
+    output = str(tmp_path / "out")
+    with open(os.path.join(archive, "broken.xml"), "w") as f:
+        f.write("<REPORT>")
+    bulk_extract.run(archive, output, "csv", workers=1)
+    with open(os.path.join(output, bulk_extract.MANIFEST_NAME)) as f:
+        before = len(f.readlines())
+    bulk_extract.run(archive, output, "csv", workers=1)
+    with open(os.path.join(output, bulk_extract.MANIFEST_NAME)) as f:
+        lines = f.readlines()
+    # Only the failed file was processed again
+    assert len(lines) == before + 1 and '"broken.xml"' in lines[-1]
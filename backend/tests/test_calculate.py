@@ -0,0 +1,188 @@
+import gzip
+import hashlib
+import io
+import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app as app_module
+from result_cache import ResultCache
+from summary import summary_statistics
+from upload_stream import DigestOnly, stream_upload
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # A fresh memory-only cache per test
+    monkeypatch.setattr(app_module, "result_cache", ResultCache("", app_module.RESULT_VERSION))
+    return app_module.app.test_client()
+
+
+def post(client, data, query="", headers=None, content_type="application/xml"):
+    return client.post(f"/api/calculate?filename=report.xml{query}", data=data,
+                       content_type=content_type, headers=headers or {})
+
+
+def test_repeat_upload_is_a_cache_hit(client, sample_bytes):
+    first = post(client, sample_bytes)
+    assert first.headers["X-Cache"] == "MISS"
+    assert first.headers["X-Report-Digest"] == hashlib.sha256(sample_bytes).hexdigest()
+    second = post(client, sample_bytes)
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.get_json() == first.get_json()
+
+
+def test_digest_header_skips_the_parse(client, sample_bytes, monkeypatch):
+    digest = hashlib.sha256(sample_bytes).hexdigest()
+    expected = post(client, sample_bytes).get_json()
+
+    def no_parse(*args, **kwargs):
+        raise AssertionError("upload parsed despite a cached digest")
+
+    def hash_only(*args, parser=None, **kwargs):
+        # The body is only hashed to check the claimed digest
+        if not isinstance(parser, DigestOnly):
+            no_parse()
+        return stream_upload(*args, parser=parser, **kwargs)
+
+    monkeypatch.setattr(app_module, "stream_upload", hash_only)
+    monkeypatch.setattr(app_module, "iter_upload", no_parse)
+    response = post(client, sample_bytes, headers={"X-Report-Digest": digest})
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.get_json() == expected
+
+    records = [json.loads(line) for line in
+               post(client, sample_bytes, "&format=ndjson", {"X-Report-Digest": digest}).get_data().splitlines()]
+    assert [record["type"] for record in records] == (
+        ["subject"] + ["comparable"] * len(expected["comparables"]) + ["summary"])
+    assert records[-1]["validation"] == expected["validation"]
+
+
+def test_claimed_digest_must_match_the_body(client, sample_bytes):
+    digest = hashlib.sha256(sample_bytes).hexdigest()
+    post(client, sample_bytes)
+    post(client, sample_bytes, "&format=columnar")
+    for query in ("", "&format=ndjson", "&format=columnar"):
+        response = post(client, b"<REPORT/>", query, {"X-Report-Digest": digest})
+        assert response.status_code == 409
+        assert response.get_json() == {"error": "X-Report-Digest does not match the uploaded document"}
+    compressed = post(client, gzip.compress(sample_bytes), headers={"X-Report-Digest": digest})
+    assert compressed.headers["X-Cache"] == "HIT"
+
+
+def test_unknown_digest_falls_back_to_the_upload(client, sample_bytes):
+    response = post(client, sample_bytes, headers={"X-Report-Digest": "0" * 64})
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.headers["X-Report-Digest"] == hashlib.sha256(sample_bytes).hexdigest()
+
+
+def test_streamed_records_match_the_result(client, sample_bytes):
+    result = post(client, sample_bytes).get_json()
+    records = [json.loads(line) for line in post(client, sample_bytes, "&format=ndjson").get_data().splitlines()]
+    assert records[0]["property"]["address"] == result["subject_property"]["address"]
+    assert [record["property"]["property_type"] for record in records[1:-1]] == [
+        comp["property_type"] for comp in result["comparables"]]
+    assert records[-1]["summary"] == result["summary"]
+
+
+def test_compressed_and_multipart_uploads_match(client, sample_bytes):
+    expected = post(client, sample_bytes).get_json()
+    assert post(client, gzip.compress(sample_bytes)).get_json() == expected
+    assert post(client, gzip.compress(sample_bytes), headers={"Content-Encoding": "gzip"}).get_json() == expected
+    response = client.post("/api/calculate", data={"file": (io.BytesIO(gzip.compress(sample_bytes)), "report.xml.gz")},
+                           content_type="multipart/form-data")
+    assert response.headers["X-Report-Digest"] == hashlib.sha256(sample_bytes).hexdigest()
+    assert response.get_json() == expected
+
+
+def test_malformed_upload(client):
+    response = post(client, b"<VALUATION_RESPONSE><REPORT>")
+    assert "error" in response.get_json()
+    assert post(client, b"", content_type="text/plain").status_code == 400
+
+
+def test_excluded_comparables_are_counted_by_type():
+    comps = [
+        {"comp_type": comp_type, "pre_adj": 100000.0, "post_adj": 101000.0}
+        for comp_type in ("Sale", "Sale", "Listing", "REO", "Short", "REO")
+    ]
+    summary = summary_statistics({"pre_adj": 100000.0}, comps)
+    assert summary["sale_count"] == 2
+    assert summary["listing_count"] == 1
+    assert summary["other_count"] == 3
+    assert summary["other_types"] == {"REO": 2, "Short": 1}
+
+
+@pytest.fixture
+def batch_client(client, monkeypatch):
+    # Threads instead of worker processes; the fan-out is the same
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(app_module, "get_process_pool", lambda: pool)
+    yield client
+    pool.shutdown()
+
+
+def zipped(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def post_batch(client, parts):
+    return client.post("/api/calculate/batch", content_type="multipart/form-data",
+                       data={"files": [(io.BytesIO(data), name) for name, data in parts]})
+
+
+def test_batch_expands_archives_and_renames_duplicates(batch_client, sample_bytes):
+    archive = zipped([
+        ("reports/report.xml", sample_bytes),
+        ("other/report.xml", sample_bytes),
+        ("notes.txt", b"not a report"),
+        ("__MACOSX/reports/._report.xml", b"resource fork"),
+    ])
+    response = post_batch(batch_client, [("report.xml", sample_bytes), ("bundle.zip", archive)])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert list(body["results"]) == ["report.xml", "report.xml (2)", "report.xml (3)"]
+    assert body["totals"]["files"] == 3 and body["totals"]["failed"] == 0
+    expected = app_module.calculate_sensitivity(io.BytesIO(sample_bytes))
+    assert all(result["comparables"] == expected["comparables"] for result in body["results"].values())
+
+
+def test_batch_error_in_one_file_does_not_fail_the_batch(batch_client, sample_bytes):
+    response = post_batch(batch_client, [("good.xml", sample_bytes), ("bad.xml", b"<REPORT><unclosed>")])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert "error" in body["results"]["bad.xml"]
+    assert "error" not in body["results"]["good.xml"]
+    assert (body["totals"]["succeeded"], body["totals"]["failed"]) == (1, 1)
+
+
+def test_batch_pool_does_not_fork_the_threaded_worker(client, sample_bytes, monkeypatch):
+    monkeypatch.setattr(app_module, "_process_pool", None)
+    monkeypatch.setattr(app_module, "BATCH_WORKERS", 1)
+    try:
+        response = post_batch(client, [("report.xml", sample_bytes)])
+        assert response.get_json()["totals"]["succeeded"] == 1
+        assert app_module._process_pool._mp_context.get_start_method() != "fork"
+    finally:
+        app_module._process_pool.shutdown()
+
+
+def test_batch_file_limit(batch_client, monkeypatch):
+    monkeypatch.setattr(app_module, "BATCH_MAX_FILES", 2)
+    archive = zipped([(f"{i}.xml", b"<REPORT/>") for i in range(3)])
+    response = post_batch(batch_client, [("bundle.zip", archive)])
+    assert response.status_code == 413
+    assert "limit 2" in response.get_json()["error"]
+
+
+def test_batch_rejects_bad_archives(batch_client):
+    assert post_batch(batch_client, [("bundle.zip", b"not a zip")]).status_code == 400
+    empty = post_batch(batch_client, [("bundle.zip", zipped([("readme.txt", b"")]))])
+    assert empty.status_code == 400
+    assert empty.get_json()["error"] == "No XML files found in the upload"
@@ -0,0 +1,30 @@
+from app import calculate_sensitivity
+from field_spec import profile_for
+from summary import COLUMNS, to_columnar
+
+
+def test_columnar_keeps_every_row_field(sample):
+    with open(sample, "rb") as f:
+        result = calculate_sensitivity(f)
+    columnar = to_columnar(result)
+    profile = profile_for(result["report"]["form_name"])
+
+    for name in profile.extra_fields:
+        assert name in columnar["comparables"]
+    names = set(columnar["comparables"])
+    for comp in result["comparables"]:
+        assert set(comp) <= names
+    for name, values in columnar["comparables"].items():
+        assert len(values) == len(result["comparables"])
+        if name in profile.numeric_fields or dict(COLUMNS).get(name):
+            assert all(value is None or isinstance(value, float) for value in values)
+
+
+def test_columnar_passes_other_keys_through(sample):
+    with open(sample, "rb") as f:
+        result = calculate_sensitivity(f)
+    columnar = to_columnar(result)
+    for key in ("report", "pre_adj_range", "post_adj_range", "summary",
+                "adjustment_grid", "validation", "market_conditions"):
+        assert columnar[key] == result[key]
+    assert columnar["format"] == "columnar"
@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import io
+import os
+import random
+import re
+
+import pytest
+
+import app as app_module
+from pdf_cache import FileCache
+from xml_parsing import Base64Decoder, EmbeddedFileParser
+
+EMBEDDED = re.compile(rb"<EMBEDDED_FILE[^>]*>.*?</EMBEDDED_FILE>", re.DOTALL)
+
+
+def embedded_pdf(xml):
+    """The embedded PDF of a report, decoded in one go."""
+    element = EMBEDDED.search(xml).group()
+    text = re.search(rb"<DOCUMENT>(.*)</DOCUMENT>", element, re.DOTALL).group(1)
+    return base64.b64decode(b"".join(text.split()))
+
+
+def split(data, rng, largest=40):
+    pieces = []
+    while data:
+        size = rng.randint(1, largest)
+        pieces.append(data[:size])
+        data = data[size:]
+    return pieces
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_decoder_handles_arbitrary_pieces(seed):
+    rng = random.Random(seed)
+    payload = rng.randbytes(rng.randint(0, 300))
+    text = base64.encodebytes(payload).decode()  # 76-column lines, padded
+    text = "".join(c + " \t"[rng.randrange(2)] if rng.random() < 0.1 else c for c in text)
+    decoder = Base64Decoder()
+    decoded = b"".join(decoder.decode(piece) for piece in split(text, rng))
+    decoder.finish()
+    assert decoded == payload
+
+
+def test_decoder_padding_split_across_pieces():
+    decoder = Base64Decoder()
+    assert decoder.decode("QUJD\nRA=") == b"ABC"
+    assert decoder.decode("=\n") == b"D"
+    decoder.finish()
+
+
+def test_decoder_rejects_truncated_text():
+    decoder = Base64Decoder()
+    decoder.decode("QUJDRA")
+    with pytest.raises(ValueError, match="incomplete"):
+        decoder.finish()
+
+
+def test_parser_extracts_pdf_across_chunks(sample_bytes):
+    sink = io.BytesIO()
+    parser = EmbeddedFileParser(sink)
+    for chunk in split(sample_bytes, random.Random(0), largest=5000):
+        parser.feed(chunk)
+    embedded = parser.close()
+    expected = embedded_pdf(sample_bytes)
+    assert sink.getvalue() == expected
+    assert embedded["size"] == len(expected)
+    assert embedded["attributes"]["MIMEType"] == "application/pdf"
+
+
+def test_parser_without_embedded_file(sample_bytes):
+    sink = io.BytesIO()
+    parser = EmbeddedFileParser(sink)
+    parser.feed(EMBEDDED.sub(b"", sample_bytes))
+    assert parser.close() is None
+    assert sink.getvalue() == b""
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "pdf_cache", FileCache(str(tmp_path)))
+    return app_module.app.test_client()
+
+
+def test_pdf_endpoint_caches_by_report_digest(client, sample_bytes):
+    response = client.post("/api/pdf?filename=report.xml", data=sample_bytes,
+                           content_type="application/xml")
+    assert response.status_code == 200
+    assert response.mimetype == "application/pdf"
+    assert response.data == embedded_pdf(sample_bytes)
+    digest = response.headers["X-Report-Digest"]
+    assert digest == hashlib.sha256(sample_bytes).hexdigest()
+
+    hit = client.get(f"/api/pdf/{digest}")
+    assert hit.status_code == 200
+    assert hit.data == response.data
+    assert app_module.pdf_cache.snapshot()["hits"] == 1
+
+
+def test_pdf_endpoint_miss_and_invalid_digest(client):
+    assert client.get(f"/api/pdf/{'0' * 64}").status_code == 404
+    for digest in ("abc", "G" * 64, "0" * 63):
+        response = client.get(f"/api/pdf/{digest}")
+        assert response.status_code == 400
+        assert response.get_json()["error"] == "Invalid report digest"
+
+
+def test_pdf_endpoint_without_embedded_file(client, sample_bytes):
+    response = client.post("/api/pdf?filename=report.xml", data=EMBEDDED.sub(b"", sample_bytes),
+                           content_type="application/xml")
+    assert response.status_code == 404
+    assert not os.listdir(app_module.pdf_cache.directory)
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=250)
+    digests = [hashlib.sha256(bytes([i])).hexdigest() for i in range(4)]
+
+    def put(digest):
+        temp = cache.create()
+        temp.write(b"x" * 100)
+        cache.commit(temp, digest)
+        total = sum(os.path.getsize(os.path.join(tmp_path, name)) for name in os.listdir(tmp_path))
+        assert total <= cache.max_bytes
+
+    for age, digest in enumerate(digests[:2]):
+        put(digest)
+        os.utime(cache.path(digest), (1000 + age, 1000 + age))
+    cache.get(digests[0])  # Refreshed, so digests[1] is now the oldest
+    put(digests[2])
+    assert os.path.exists(cache.path(digests[0]))
+    assert not os.path.exists(cache.path(digests[1]))
+    put(digests[3])
+    assert os.path.exists(cache.path(digests[3]))
+    assert cache.snapshot()["evictions"] == 2
@@ -0,0 +1,129 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import analyze_bytes
+from jobs import EXPIRED_RESULT, Job, JobManager, JobStore, QueueFull
+
+
+def blocked(event):
+    event.wait(30)
+    return {}
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_job_runs_to_completion(executor, store, sample_bytes):
+    results = []
+    recorded = threading.Event()
+
+    def on_result(result):
+        results.append(result)
+        recorded.set()
+
+    manager = JobManager(lambda: executor, store=store)
+    job = manager.submit("report.xml", analyze_bytes, sample_bytes, on_result=on_result)
+    assert manager.get(job.id, wait=30).to_dict()["status"] == "done"
+    assert recorded.wait(5)
+    assert results == [job.result]
+    assert job.result["comparables"]
+
+    # Another worker sharing the store answers the poll from there
+    other = JobManager(lambda: executor, store=store)
+    assert other.get(job.id).to_dict() == job.to_dict()
+
+
+def test_failed_job_and_known_result(executor):
+    manager = JobManager(lambda: executor)
+    job = manager.submit("bad.xml", analyze_bytes, b"<not xml")
+    assert manager.get(job.id, wait=30).status == "failed"
+    assert "error" in job.result
+    known = manager.complete("report.xml", {"comparables": []})
+    assert manager.get(known.id).status == "done"
+    assert manager.snapshot()["pending"] == 0
+
+
+def test_queue_is_bounded(executor):
+    release = threading.Event()
+    manager = JobManager(lambda: executor, max_pending=1)
+    job = manager.submit("a.xml", blocked, release)
+    with pytest.raises(QueueFull):
+        manager.submit("b.xml", blocked, release)
+    release.set()
+    assert manager.get(job.id, wait=30).status == "done"
+
+
+def test_job_lost_with_its_worker_expires(executor, store):
+    lost = Job("lost.xml")
+    store.save(lost)
+    manager = JobManager(lambda: executor, store=store, stale_after=0.2)
+    assert manager.get(lost.id).status == "queued"
+
+    time.sleep(0.3)
+    expired = manager.get(lost.id, wait=1)
+    assert expired.status == "failed"
+    assert expired.to_dict()["result"] == EXPIRED_RESULT
+
+    # Once past retention the expired job is pruned like any other
+    manager.retention = 0
+    time.sleep(0.01)
+    manager.complete("other.xml", {})
+    assert manager.get(lost.id) is None
+
+
+def test_running_job_keeps_its_heartbeat(executor, store):
+    release = threading.Event()
+    manager = JobManager(lambda: executor, store=store, stale_after=0.2)
+    job = manager.submit("slow.xml", blocked, release)
+    time.sleep(0.5)
+    other = JobManager(lambda: executor, store=store, stale_after=0.2)
+    assert other.get(job.id).status == "queued"
+    release.set()
+    assert other.get(job.id, wait=30).status == "done"
+
+
+def test_job_past_its_deadline_fails(executor):
+    release = threading.Event()
+    manager = JobManager(lambda: executor, timeout=0.2)
+    job = manager.submit("hung.xml", blocked, release)
+    assert manager.get(job.id, wait=5).status == "failed"
+    assert job.result == EXPIRED_RESULT
+    assert manager.snapshot()["pending"] == 0
+    release.set()
+    time.sleep(0.05)
+    assert job.result == EXPIRED_RESULT
+
+
+def test_store_is_written_outside_the_lock(executor, store):
+    release = threading.Event()
+    manager = JobManager(lambda: executor, store=store, timeout=0.2)
+    writes = []
+
+    def unlocked(write):
+        def wrapper(*args):
+            assert not manager._lock.locked(), f"{write.__name__} called holding the lock"
+            writes.append(write.__name__)
+            return write(*args)
+        return wrapper
+
+    for name in ("save", "expire", "prune"):
+        setattr(store, name, unlocked(getattr(store, name)))
+    hung = manager.submit("hung.xml", blocked, release)
+    time.sleep(0.3)
+    # Expired by the next submission's prune, then saved after the lock is released
+    manager.submit("next.xml", blocked, release)
+    assert hung.result == EXPIRED_RESULT
+    assert store.load(hung.id).to_dict()["result"] == EXPIRED_RESULT
+    assert {"save", "expire", "prune"} <= set(writes)
+    release.set()
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+import app as app_module
+from app import calculate_sensitivity
+from conftest import SAMPLES
+from market_model import MarketModel, compare_report, fit_areas, student_t_quantile
+from portfolio import PortfolioStore
+
+
+@pytest.fixture(scope="module")
+def results():
+    return {os.path.basename(path): calculate_sensitivity(path) for path in SAMPLES}
+
+
+@pytest.fixture
+def store(tmp_path, results):
+    store = PortfolioStore(str(tmp_path / "portfolio.sqlite3"))
+    store.write_batch([(name, name, result, float(n)) for n, (name, result) in enumerate(results.items())])
+    return store
+
+
+def test_student_t_quantile():
+    assert student_t_quantile(0.975, [10, 30]) == pytest.approx([2.228, 2.042], abs=0.005)
+
+
+def test_fit_areas_matches_least_squares():
+    rng = np.random.default_rng(3)
+    X = rng.normal(size=(60, 2)) * [300, 1] + [1500, 3]
+    codes = np.repeat([0, 1, 2], [30, 25, 5])
+    slopes = np.array([[100.0, 5000.0], [150.0, -2000.0], [0.0, 0.0]])
+    y = 200_000 + np.einsum("ij,ij->i", X, slopes[codes]) + rng.normal(scale=1000, size=60)
+    fits = fit_areas(X, y, codes, 3)
+    assert fits["valid"].tolist() == [True, True, False]  # Too few sales in the last area
+    for area in (0, 1):
+        rows = codes == area
+        design = np.column_stack([np.ones(rows.sum()), X[rows]])
+        expected = np.linalg.lstsq(design, y[rows], rcond=None)[0][1:]
+        assert fits["estimate"][area] == pytest.approx(expected)
+        assert np.all(np.abs(fits["estimate"][area] - slopes[area]) < 3 * fits["std_error"][area])
+
+
+def test_portfolio_fit_from_samples(store):
+    model = MarketModel(store)
+    [pooled] = model.fit(area_digits=0)
+    assert pooled["sales"] > 0 and "error" not in pooled
+    assert 0 <= pooled["r_squared"] <= 1
+    for adjustment in pooled["adjustments"]:
+        assert adjustment["ci_low"] <= adjustment["estimate"] <= adjustment["ci_high"]
+    # Five digit areas hold too few sales to fit six features
+    assert all("error" in area for area in model.fit(area_digits=5))
+
+
+def test_design_is_rebuilt_when_reports_are_added(tmp_path, results):
+    store = PortfolioStore(str(tmp_path / "portfolio.sqlite3"))
+    names = sorted(results)
+    store.write_batch([(names[0], names[0], results[names[0]], 1.0)])
+    model = MarketModel(store)
+    before = model.design(area_digits=0)
+    assert model.design(area_digits=0) is before
+    store.write_batch([(name, name, results[name], 2.0) for name in names[1:]])
+    assert len(model.design(area_digits=0).y) > len(before.y)
+
+
+def test_compare_report_against_the_pooled_fit(store, results):
+    [pooled] = MarketModel(store).fit(area_digits=0)
+    result = results["13-185-1W.xml"]
+    comparables = compare_report(result, pooled)
+    sales = [comp for comp in result["comparables"] if comp["comp_type"] == "Sale"]
+    assert [comp["property_type"] for comp in comparables] == [comp["property_type"] for comp in sales]
+    for comp in comparables:
+        assert comp["market_adjusted"] == pytest.approx(
+            comp["sale_price"] + sum(line["market_amount"] for line in comp["lines"]), abs=0.1)
+        for line in comp["lines"]:
+            assert line["outside_ci"] == (not line["ci_low"] <= line["appraiser_amount"] <= line["ci_high"])
+
+
+def test_adjustments_endpoint(store, monkeypatch):
+    monkeypatch.setattr(app_module, "market_model", MarketModel(store))
+    client = app_module.app.test_client()
+    response = client.get("/api/market/adjustments", query_string={"digits": 0})
+    assert response.status_code == 200
+    assert response.get_json()["areas"][0]["sales"] > 0
+    assert client.get("/api/market/adjustments", query_string={"features": "Pool"}).status_code == 400
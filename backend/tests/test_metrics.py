@@ -0,0 +1,87 @@
+import io
+
+import pytest
+from flask import Flask
+from prometheus_client.parser import text_string_to_metric_families
+
+import app as app_module
+import metrics
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, "result_cache", ResultCache("", app_module.RESULT_VERSION))
+    return app_module.app.test_client()
+
+
+def server_timing(response):
+    """Stage names of a Server-Timing header, in order."""
+    return [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+
+
+def scrape(client):
+    """{(sample name, labels): value} of a /metrics scrape."""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(response.get_data(as_text=True))
+        for sample in family.samples
+    }
+
+
+def test_server_timing_lists_the_stages(client, sample_bytes, monkeypatch):
+    # Before the result is cached: hashed, then parsed and computed
+    sensitivity = client.post("/api/sensitivity", content_type="multipart/form-data",
+                              data={"file": (io.BytesIO(sample_bytes), "report.xml")})
+    assert ["hash", "cache", "parse", "serialize", "total"] == [
+        name for name in server_timing(sensitivity) if name != "admission"]
+
+    monkeypatch.setattr(app_module, "result_cache", ResultCache("", app_module.RESULT_VERSION))
+    response = client.post("/api/calculate?filename=report.xml", data=sample_bytes,
+                           content_type="application/xml")
+    assert response.status_code == 200
+    stages = server_timing(response)
+    # Parsed as received (ingest), then computed (analyze)
+    assert stages.index("ingest") < stages.index("analyze") < stages.index("total")
+    assert stages[-1] == "total"
+
+
+def test_metrics_expose_histograms_after_a_request(client, sample_bytes):
+    request_count = ("sensitivity_request_seconds_count", (("endpoint", "calculate"), ("status", "200")))
+    analyze_count = ("sensitivity_stage_seconds_count", (("stage", "analyze"),))
+    upload_count = ("sensitivity_upload_bytes_count", ())
+    before = scrape(client)
+    client.post("/api/calculate?filename=report.xml", data=sample_bytes, content_type="application/xml")
+    after = scrape(client)
+    for key in (request_count, analyze_count, upload_count):
+        assert after[key] == before.get(key, 0) + 1
+    assert after[("sensitivity_comparables_extracted_count", ())] >= 1
+
+
+def test_stage_outside_a_request_only_feeds_the_histogram():
+    key = ("sensitivity_stage_seconds_count", (("stage", "test-offline"),))
+    with metrics.stage("test-offline"):
+        pass
+    app = Flask(__name__)
+    metrics.init_app(app)
+    assert scrape(app.test_client())[key] == 1
+
+
+def test_errors_are_counted_by_status():
+    app = Flask(__name__)
+    metrics.init_app(app)
+
+    @app.route("/missing")
+    def missing():
+        with metrics.stage("lookup"):
+            return "", 404
+
+    client = app.test_client()
+    key = ("sensitivity_errors_total", (("type", "http_404"),))
+    before = scrape(client).get(key, 0)
+    response = client.get("/missing")
+    assert server_timing(response) == ["lookup", "total"]
+    assert scrape(client)[key] == before + 1
@@ -0,0 +1,179 @@
+import copy
+import os
+
+import pytest
+
+import app as app_module
+from app import calculate_sensitivity
+from conftest import SAMPLES
+from market_conditions import trend_series
+from portfolio import PortfolioStore
+from uad_checks import CONSISTENCY_CHECKS, validate_portfolio
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PortfolioStore(str(tmp_path / "portfolio.sqlite3"))
+
+
+@pytest.fixture(scope="module")
+def results():
+    return {os.path.basename(path): calculate_sensitivity(path) for path in SAMPLES}
+
+
+def report_ids(store):
+    return [row[0] for row in store._connect().execute("SELECT report_id FROM reports ORDER BY report_id")]
+
+
+def test_duplicates_in_a_batch_keep_the_last_copy(store, results):
+    result = results["13-185-1W.xml"]
+    written = store.write_batch([
+        ("a", "first.xml", result, 1.0),
+        ("a", "second.xml", result, 2.0),
+        ("b", "other.xml", results["7-366-1W.xml"], 3.0),
+    ])
+    assert written == (2, 0)
+    rows = store._connect().execute("SELECT report_id, filename FROM reports ORDER BY report_id").fetchall()
+    assert [tuple(row) for row in rows] == [("a", "second.xml"), ("b", "other.xml")]
+    comps = store._connect().execute("SELECT COUNT(*) FROM comparables WHERE report_id = 'a'").fetchone()[0]
+    assert comps == len(result["comparables"])
+
+
+def test_failing_report_does_not_drop_the_batch(store, results):
+    bad = copy.deepcopy(results["7-366-1W.xml"])
+    bad["comparables"].append(dict(bad["comparables"][0]))  # Same property_type twice
+    assert store.write_batch([
+        ("bad", "bad.xml", bad, 1.0),
+        ("good", "good.xml", results["7-366-1W.xml"], 2.0),
+        ("broken", "broken.xml", {"report": {}}, 3.0),
+    ]) == (1, 2)
+    assert report_ids(store) == ["good"]
+    conn = store._connect()
+    assert conn.execute("SELECT COUNT(*) FROM comparables WHERE report_id = 'bad'").fetchone()[0] == 0
+    # Only the written report is counted in the market rollups
+    inventory = conn.execute("SELECT COUNT(*) FROM market_inventory").fetchone()[0]
+    assert conn.execute("SELECT COALESCE(SUM(reports), 0) FROM market_rollups").fetchone()[0] == inventory
+
+
+def test_rewriting_a_report_leaves_rollups_alone(store, results):
+    result = results["13-185-1W.xml"]
+    store.write_batch([("a", "a.xml", result, 1.0)])
+    before = store.market_rollups(result["market_conditions"]["postal_code"])
+    store.write_batch([("a", "a.xml", result, 2.0)])
+    assert store.market_rollups(result["market_conditions"]["postal_code"]) == before
+    assert before and all(row["reports"] == 1 for row in before)
+
+
+def revise_market(result, **changes):
+    """A copy of a result with its market conditions changed."""
+    revised = copy.deepcopy(result)
+    conditions = revised["market_conditions"]
+    conditions.update(changes)
+    conditions["neighborhood"]["MedianSalesPrice"].update(Last3Months=1.0, trend="Increasing")
+    return revised
+
+
+def test_reanalyzed_report_replaces_its_rollup_contribution(store, tmp_path, results):
+    result = results["13-185-1W.xml"]
+    other = copy.deepcopy(result)
+    postal_code = result["market_conditions"]["postal_code"]
+    store.write_batch([("a", "a.xml", result, 1.0), ("b", "b.xml", other, 1.0)])
+    revised = revise_market(result)
+    store.write_batch([("a", "a.xml", revised, 2.0)])
+
+    fresh = PortfolioStore(str(tmp_path / "fresh.sqlite3"))
+    fresh.write_batch([("a", "a.xml", revised, 1.0), ("b", "b.xml", other, 1.0)])
+    assert store.market_rollups(postal_code) == fresh.market_rollups(postal_code)
+    [price] = [row for row in store.market_rollups(postal_code, inventory_types=["MedianSalesPrice"])
+               if row["month_range"] == "Last3Months"]
+    assert (price["reports"], price["value_min"]) == (2, 1.0)
+
+
+def test_reanalyzed_report_moving_period_leaves_the_old_one(store, results):
+    result = results["13-185-1W.xml"]
+    postal_code = result["market_conditions"]["postal_code"]
+    store.write_batch([("a", "a.xml", result, 1.0)])
+    store.write_batch([("a", "a.xml", revise_market(result, period="2015-Q1"), 2.0)])
+    periods = {row["period"] for row in store.market_rollups(postal_code)}
+    assert periods == {"2015-Q1"}
+    conn = store._connect()
+    inventory = conn.execute("SELECT COUNT(*) FROM market_inventory").fetchone()[0]
+    assert conn.execute("SELECT SUM(reports) FROM market_rollups").fetchone()[0] == inventory
+
+
+def test_market_conditions_endpoint(store, results, monkeypatch):
+    result = results["13-185-1W.xml"]
+    postal_code = result["market_conditions"]["postal_code"]
+    store.write_batch([("a", "a.xml", result, 1.0), ("b", "b.xml", revise_market(result), 2.0)])
+    monkeypatch.setattr(app_module, "portfolio", store)
+    client = app_module.app.test_client()
+
+    response = client.get(f"/api/market/conditions?postal_code={postal_code}-1234&types=MedianSalesPrice")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["postal_code"] == postal_code and body["scope"] == "neighborhood"
+    series = body["series"]["MedianSalesPrice"]
+    [recent] = series["Last3Months"]
+    reported = result["market_conditions"]["neighborhood"]["MedianSalesPrice"]["Last3Months"]
+    assert recent == {
+        "period": "2014-Q4", "reports": 2, "mean": round((reported + 1.0) / 2, 4),
+        "std": round(abs(reported - 1.0) / 2, 4), "min": 1.0, "max": reported,
+    }
+    [trend] = series["Trend"]
+    assert trend["reports"] == 2 and trend["increasing"] == 1
+
+    by_report = client.get("/api/market/conditions?report=a&types=MedianSalesPrice").get_json()
+    assert by_report["series"] == body["series"]
+    assert client.get("/api/market/conditions?postal_code=abc").status_code == 400
+    assert client.get(f"/api/market/conditions?postal_code={postal_code}&scope=city").status_code == 400
+    assert client.get("/api/market/conditions?report=missing").status_code == 404
+
+
+def test_trend_series():
+    rows = [
+        {"inventory_type": "TotalSales", "month_range": "Last3Months", "period": "2014-Q4", "reports": 2,
+         "value_count": 2, "value_sum": 10.0, "value_sumsq": 58.0, "value_min": 3.0, "value_max": 7.0},
+        {"inventory_type": "TotalSales", "month_range": "Last3Months", "period": "2015-Q1", "reports": 1,
+         "value_count": 0, "value_sum": 0.0, "value_sumsq": 0.0, "value_min": None, "value_max": None},
+        {"inventory_type": "TotalSales", "month_range": "Trend", "period": "2014-Q4", "reports": 2,
+         "increasing": 1, "stable": 0, "declining": 1},
+    ]
+    assert trend_series(rows) == {"TotalSales": {
+        "Last3Months": [
+            {"period": "2014-Q4", "reports": 2, "mean": 5.0, "std": 2.0, "min": 3.0, "max": 7.0},
+            {"period": "2015-Q1", "reports": 1, "mean": None, "std": None, "min": None, "max": None},
+        ],
+        "Trend": [{"period": "2014-Q4", "reports": 2, "increasing": 1, "stable": 0, "declining": 1}],
+    }}
+
+
+def test_background_writer(store, results):
+    store.record("a", "a.xml", results["13-185-1W.xml"])
+    store.record("a", "a.xml", results["13-185-1W.xml"])
+    store.record("err", "err.xml", {"error": "not recorded"})
+    store.flush()
+    assert report_ids(store) == ["a"]
+    assert store.snapshot()["errors"] == 0
+
+
+def test_comparable_uses(store, results):
+    result = results["13-185-1W.xml"]
+    store.write_batch([("a", "a.xml", result, 1.0)])
+    comp = result["comparables"][0]
+    uses = store.comparable_uses(mls_number=comp["mls_number"])
+    assert [(use["report_id"], use["property_type"]) for use in uses] == [("a", "Comparable 1")]
+    assert store.comparable_uses(address=comp["address"].lower())[0]["mls_number"] == comp["mls_number"]
+    with pytest.raises(ValueError):
+        store.comparable_uses()
+
+
+def test_validation_sweep_over_stored_samples(store, results):
+    store.write_batch([(name, name, result, float(i)) for i, (name, result) in enumerate(results.items())])
+    sweep = validate_portfolio(store.validation_data())
+    assert sweep["reports"] == len(results)
+    assert sweep["comparables"] == sum(len(result["comparables"]) for result in results.values())
+    assert sweep["inconsistent_reports"] == 0
+    assert not any(sweep["counts"][check] for check in CONSISTENCY_CHECKS)
+    # The per-report checks and the sweep agree on the guideline failures
+    assert sweep["counts"]["net_guideline"] == sum(
+        result["validation"]["counts"]["net_guideline"] for result in results.values())
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, stream_with_context
+
+import profiling
+
+
+def slow_chunk(n):
+    time.sleep(0.05)
+    return f"{n}\n"
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "TOKEN", "secret")
+    monkeypatch.setattr(profiling, "ENABLED", True)
+    monkeypatch.setattr(profiling, "store", profiling.ProfileStore(str(tmp_path)))
+    app = Flask(__name__)
+
+    @app.route("/plain")
+    @profiling.profiled
+    def plain():
+        return {"value": slow_chunk(0)}
+
+    @app.route("/streamed")
+    @profiling.profiled
+    def streamed():
+        return app.response_class(stream_with_context(slow_chunk(n) for n in range(4)),
+                                  mimetype="application/x-ndjson")
+
+    profiling.init_app(app)
+    return app.test_client()
+
+
+def names(profile):
+    return {entry["function"] for entry in profile["functions"]}
+
+
+def test_plain_response_is_profiled(client):
+    response = client.get("/plain", headers={"X-Profile-Token": "secret"})
+    profile = profiling.store.get(response.headers["X-Profile-Id"])
+    assert profile["mode"] == "traced"
+    assert not profile["streamed"]
+    assert "slow_chunk" in names(profile)
+
+
+def test_streamed_body_is_covered(client):
+    response = client.get("/streamed", headers={"X-Profile-Token": "secret"})
+    profile_id = response.headers["X-Profile-Id"]
+    assert profiling.store.get(profile_id) is None  # Stored once the body is done
+    assert response.get_data() == b"0\n1\n2\n3\n"
+    response.close()
+    profile = profiling.store.get(profile_id)
+    assert profile["streamed"]
+    assert profile["elapsed_seconds"] >= 0.2
+    slow = next(entry for entry in profile["functions"] if entry["function"] == "slow_chunk")
+    assert slow["calls"] == 4
+    # The trace lock is free again for the next request
+    assert client.get("/plain", headers={"X-Profile-Token": "secret"}).status_code == 200
+
+
+def test_sampled_streamed_body(client, monkeypatch):
+    monkeypatch.setattr(profiling, "SAMPLE_RATE", 1.0)
+    response = client.get("/streamed")
+    assert response.get_data() == b"0\n1\n2\n3\n"
+    response.close()
+    [profile] = profiling.store.list()
+    assert profile["mode"] == "sampled"
+    assert profile["elapsed_seconds"] >= 0.2
+    assert profile["samples"] > 0
+
+
+def test_traced_request_gives_up_while_another_is_traced(client, monkeypatch):
+    monkeypatch.setattr(profiling, "TRACE_WAIT", 0.05)
+    # Holding the lock in another thread, as a traced request in progress would
+    held, done = threading.Event(), threading.Event()
+
+    def hold():
+        with profiling._trace_lock:
+            held.set()
+            done.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    try:
+        assert held.wait(5)
+        response = client.get("/plain", headers={"X-Profile-Token": "secret"})
+        assert response.status_code == 409
+        assert "X-Profile-Id" not in response.headers
+    finally:
+        done.set()
+        holder.join(5)
+    assert client.get("/plain", headers={"X-Profile-Token": "secret"}).status_code == 200
+
+
+def test_list_profiles_validates_the_limit(client):
+    headers = {"X-Profile-Token": "secret"}
+    for _ in range(3):
+        client.get("/plain", headers=headers)
+    assert client.get("/api/admin/profiles?limit=2", headers=headers).get_json()["count"] == 2
+    assert client.get("/api/admin/profiles", headers=headers).get_json()["count"] == 3
+    for limit in ("abc", "0", "-1", "1.5"):
+        response = client.get(f"/api/admin/profiles?limit={limit}", headers=headers)
+        assert response.status_code == 400
+        assert response.get_json() == {"error": "limit must be a positive integer"}
+    assert client.get("/api/admin/profiles?limit=2").status_code == 403
@@ -0,0 +1,111 @@
+import sqlite3
+import time
+
+import pytest
+
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache.sqlite3")
+
+
+def disk_totals(cache):
+    conn = cache._connect()
+    tracked = conn.execute("SELECT total FROM result_bytes").fetchone()[0]
+    actual = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    return tracked, actual
+
+
+def test_hit_and_miss(path, sample_bytes):
+    cache = ResultCache(path, "1")
+    assert cache.get("a") is None
+    cache.put("a", sample_bytes)
+    assert cache.get("a") == sample_bytes
+    # Another worker finds it on disk
+    other = ResultCache(path, "1")
+    assert other.get("a") == sample_bytes
+    assert other.snapshot()["disk_hits"] == 1
+    assert other.get("a") == sample_bytes
+    assert other.snapshot()["memory_hits"] == 1
+
+
+def test_version_bump_invalidates(path):
+    ResultCache(path, "1").put("a", b"old")
+    newer = ResultCache(path, "2")
+    assert newer.get("a") is None
+    newer.put("a", b"new")
+    assert newer.get("a") == b"new"
+    # A worker still on the old version keeps its entries mid-deploy
+    assert ResultCache(path, "1").get("a") == b"old"
+    assert disk_totals(newer) == (6, 6)
+
+
+def test_old_versions_are_evicted_first(path):
+    older = ResultCache(path, "1", max_disk_bytes=300)
+    older.put("a", bytes(100))
+    older.put("b", bytes(100))
+    newer = ResultCache(path, "2", max_disk_bytes=300)
+    newer.put("a", bytes(100))
+    newer.put("b", bytes(100))
+    assert ResultCache(path, "1").get("a") is None
+    assert newer.get("a") is not None and newer.get("b") is not None
+    assert disk_totals(newer) == (300, 300)
+
+
+def test_expired_entries_are_not_served(path):
+    cache = ResultCache(path, "1", max_age=0.05)
+    cache.put("a", b"payload")
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert ResultCache(path, "1", max_age=0.05).get("a") is None
+
+
+def test_memory_tier_is_bounded_by_bytes():
+    cache = ResultCache("", "1", max_entries=100, max_memory_bytes=1000)
+    for n in range(10):
+        cache.put(str(n), bytes(300))
+    assert cache.snapshot()["memory_bytes"] <= 1000
+    assert [cache.get(str(n)) is not None for n in range(10)] == [False] * 7 + [True] * 3
+    cache.put("9", bytes(100))  # Replacing an entry updates the total
+    assert cache.snapshot()["memory_bytes"] == 700
+    cache.put("big", bytes(5000))  # Larger than the whole tier: not kept
+    assert cache.get("big") is None
+    assert cache.get("8") is not None
+
+
+def test_oversized_payload_still_reaches_disk(path):
+    cache = ResultCache(path, "1", max_memory_bytes=10)
+    cache.put("a", bytes(100))
+    assert cache.snapshot()["memory_entries"] == 0
+    assert cache.get("a") == bytes(100)
+
+
+def test_disk_total_is_kept_without_rescanning(path):
+    cache = ResultCache(path, "1", max_disk_bytes=1000)
+    for n in range(6):
+        cache.put(str(n), bytes(300))
+        time.sleep(0.001)
+    tracked, actual = disk_totals(cache)
+    assert tracked == actual <= 1000
+    cache.put("5", bytes(50))  # Replaced in place
+    assert disk_totals(cache)[0] == disk_totals(cache)[1]
+    # Least recently accessed entries went first
+    fresh = ResultCache(path, "1", max_disk_bytes=1000)
+    assert fresh.get("0") is None
+    assert fresh.get("5") == bytes(50)
+
+
+def test_existing_store_gets_its_total(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE results (key TEXT PRIMARY KEY, version TEXT NOT NULL, payload BLOB NOT NULL,"
+                 " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+    now = time.time()
+    conn.execute("INSERT INTO results VALUES ('1:a', '1', ?, 40, ?, ?)", (bytes(40), now, now))
+    conn.commit()
+    conn.close()
+    cache = ResultCache(path, "1")
+    assert disk_totals(cache) == (40, 40)
+    cache.put("b", bytes(60))
+    assert disk_totals(cache) == (100, 100)
@@ -0,0 +1,114 @@
+import copy
+import io
+import os
+
+import pytest
+
+import app as app_module
+from app import calculate_sensitivity
+from conftest import SAMPLES
+from result_cache import ResultCache
+from revision_diff import diff_results, record_digest
+
+
+@pytest.fixture(scope="module")
+def result():
+    return calculate_sensitivity(next(path for path in SAMPLES if os.path.basename(path) == "13-185-1W.xml"))
+
+
+def revise(result):
+    """A revision with comp 1 removed, comp 2's first adjustment changed and comp 3 moved to the end."""
+    revised = copy.deepcopy(result)
+    grid = revised["adjustment_grid"]
+    column = next(j for j, amount in enumerate(grid["amounts"][2]) if amount is not None)
+    grid["amounts"][2][column] += 1000
+    order = [0, 2, 4] + list(range(5, len(revised["comparables"]) + 1)) + [3]
+    for name in ("descriptions", "amounts"):
+        grid[name] = [grid[name][row] for row in order]
+    comparables = [revised["comparables"][row - 1] for row in order[1:]]
+    for number, comp in enumerate(comparables, start=1):
+        comp["property_type"] = f"Comparable {number}"
+    revised["comparables"] = comparables
+    return revised, grid["types"][column]
+
+
+def test_identical_revisions(result):
+    diff, records = diff_results(result, copy.deepcopy(result))
+    assert not diff["comparables"]["added"] and not diff["comparables"]["removed"]
+    assert not diff["comparables"]["changed"]
+    assert len(diff["comparables"]["unchanged"]) == len(result["comparables"])
+    assert {status for _, status in records} == {"unchanged"}
+
+
+def test_changes_are_matched_across_renumbering(result):
+    revised, adj_type = revise(result)
+    diff, records = diff_results(result, revised)
+    removed = diff["comparables"]["removed"]
+    assert [entry["property_type"] for entry in removed] == ["Comparable 1"]
+    [changed] = diff["comparables"]["changed"]
+    assert changed["old_property_type"] == "Comparable 2"
+    assert changed["new_property_type"] == "Comparable 1"
+    assert [line["type"] for line in changed["adjustments"]["changed"]] == [adj_type]
+    moved = {entry["old_property_type"]: entry["new_property_type"] for entry in diff["comparables"]["unchanged"]}
+    assert moved["Comparable 3"] == f"Comparable {len(revised['comparables'])}"
+    assert [status for _, status in records].count("changed") == 1
+
+
+def test_record_digest_follows_content(result):
+    revised, _ = revise(result)
+    _, old_records = diff_results(result, result)
+    _, new_records = diff_results(result, revised)
+    old = {record["row"]["address"]: record_digest(record, [1.0]) for record, _ in old_records}
+    for record, status in new_records:
+        digest = record_digest(record, [1.0])
+        assert (digest == old[record["row"]["address"]]) == (status == "unchanged")
+        assert record_digest(record, [0.5]) != digest
+
+
+def post_diff(client):
+    return client.post("/api/diff", content_type="multipart/form-data", data={
+        "old": (io.BytesIO(b"<old/>"), "old.xml"),
+        "new": (io.BytesIO(b"<new/>"), "new.xml"),
+    }).get_json()
+
+
+def serve_revisions(monkeypatch, old, new):
+    monkeypatch.setattr(app_module, "result_cache", ResultCache("", app_module.RESULT_VERSION))
+    revisions = {"old.xml": old, "new.xml": new}
+    monkeypatch.setattr(app_module, "analyze_upload",
+                        lambda file: (app_module.app.json.dumps(revisions[file.filename]), False))
+    return app_module.app.test_client()
+
+
+def analyzed(diff):
+    return sum(1 for entry in diff["sensitivity"] if entry["analysis"])
+
+
+def test_diff_endpoint_reuses_unchanged_comparables(result, monkeypatch):
+    client = serve_revisions(monkeypatch, result, copy.deepcopy(result))
+    first = post_diff(client)
+    assert not first["comparables"]["changed"]
+    assert first["recomputed"] == 0 and first["reused"] == analyzed(first)
+    second = post_diff(client)
+    assert second["reused"] == first["reused"] and second["recomputed"] == 0
+    assert second["sensitivity"] == first["sensitivity"]
+
+
+def test_diff_endpoint_recomputes_only_changed_and_added(result, monkeypatch):
+    revised, _ = revise(result)
+    added = copy.deepcopy(revised["comparables"][-1])
+    added.update(property_type=f"Comparable {len(revised['comparables']) + 1}",
+                 address="1 Added Way", mls_number="ADDED-1", post_adj=added["post_adj"] + 1234)
+    revised["comparables"].append(added)
+    grid = revised["adjustment_grid"]
+    for name in ("descriptions", "amounts"):
+        grid[name].append(list(grid[name][-1]))
+    client = serve_revisions(monkeypatch, result, revised)
+
+    first = post_diff(client)
+    comparables = first["comparables"]
+    assert len(comparables["changed"]) == 1 and len(comparables["added"]) == 1
+    assert first["recomputed"] == len(comparables["changed"]) + len(comparables["added"])
+    assert first["reused"] == len(comparables["unchanged"])
+    second = post_diff(client)
+    assert second["recomputed"] == 0 and second["reused"] == analyzed(first)
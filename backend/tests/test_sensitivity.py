@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+
+from app import MAX_SCALING_FACTORS, app, calculate_sensitivity, scaling_factors
+from conftest import SAMPLE_DIR
+from sensitivity import adjustment_sensitivity, comparable_arrays
+
+SAMPLE = os.path.join(SAMPLE_DIR, "13-185-1W.xml")
+FACTORS = [0.0, 0.5, 1.0, 1.5, 2.0]
+
+
+@pytest.fixture(scope="module")
+def result():
+    return calculate_sensitivity(SAMPLE)
+
+
+def test_curves_match_a_scalar_loop(result):
+    analysis = adjustment_sensitivity(result, FACTORS)
+    arrays = comparable_arrays(result)
+    for i, adj_type in enumerate(analysis["types"]):
+        j = arrays["types"].index(adj_type)
+        for k, factor in enumerate(FACTORS):
+            prices = [
+                adjusted + (factor - 1.0) * comp_amounts[j]
+                for adjusted, comp_amounts in zip(arrays["adjusted"], arrays["amounts"])
+            ]
+            assert analysis["curves"]["mean"][i][k] == pytest.approx(round(sum(prices) / len(prices), 2))
+            assert analysis["curves"]["min"][i][k] == pytest.approx(round(min(prices), 2))
+            assert analysis["curves"]["max"][i][k] == pytest.approx(round(max(prices), 2))
+            assert analysis["curves"]["range"][i][k] == pytest.approx(round(max(prices) - min(prices), 2))
+
+
+def test_only_types_that_move_a_price_are_analyzed(result):
+    analysis = adjustment_sensitivity(result, FACTORS)
+    arrays = comparable_arrays(result)
+    moving = [t for j, t in enumerate(arrays["types"]) if np.any(arrays["amounts"][:, j] != 0)]
+    assert analysis["types"] == moving
+    # At a factor of 1 every curve is the reported baseline
+    at_one = FACTORS.index(1.0)
+    assert {row[at_one] for row in analysis["curves"]["mean"]} == {analysis["baseline"]["mean"]}
+
+
+def test_tornado_is_ordered_by_swing(result):
+    tornado = adjustment_sensitivity(result, FACTORS)["tornado"]
+    assert len(tornado) > 1
+    swings = [(row["mean_swing"], row["range_swing"]) for row in tornado]
+    assert swings == sorted(swings, reverse=True)
+    for row in tornado:
+        assert row["mean_swing"] == pytest.approx(abs(row["high"]["mean"] - row["low"]["mean"]), abs=0.02)
+        assert (row["low"]["factor"], row["high"]["factor"]) == (0.0, 2.0)
+
+
+def test_no_closed_sales(result):
+    listings = dict(result, comparables=[dict(c, comp_type="Listing") for c in result["comparables"]])
+    assert "error" in adjustment_sensitivity(listings, FACTORS)
+
+
+def test_scaling_factors():
+    assert scaling_factors({}) == [round(0.05 * i, 6) for i in range(41)]
+    assert scaling_factors({"factor_min": "0.5", "factor_max": "1.5", "factor_step": "0.5"}) == [0.5, 1.0, 1.5]
+
+
+@pytest.mark.parametrize("values, message", [
+    ({"factor_step": "0"}, "factor_step"),
+    ({"factor_step": "-0.1"}, "factor_step"),
+    ({"factor_min": "2", "factor_max": "1"}, "factor_max"),
+    ({"factor_step": "0.0001"}, str(MAX_SCALING_FACTORS)),
+    ({"factor_min": "low"}, "could not convert"),
+])
+def test_bad_factor_grid_is_rejected(values, message):
+    with open(SAMPLE, "rb") as f:
+        response = app.test_client().post(
+            "/api/sensitivity", data={"file": (f, "report.xml"), **values},
+            content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert message in response.get_json()["error"]
+
+
+def test_sensitivity_endpoint(result):
+    with open(SAMPLE, "rb") as f:
+        response = app.test_client().post(
+            "/api/sensitivity",
+            data={"file": (f, "report.xml"), "factor_min": "0", "factor_max": "2", "factor_step": "0.5"},
+            content_type="multipart/form-data")
+    assert response.status_code == 200
+    assert response.get_json() == adjustment_sensitivity(result, FACTORS)
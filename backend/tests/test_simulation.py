@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from app import MAX_SIMULATION_CHUNK, app, calculate_sensitivity
+from conftest import SAMPLE_DIR
+from sensitivity import MAX_CHUNK_CELLS, comparable_arrays, monte_carlo
+
+SAMPLE = os.path.join(SAMPLE_DIR, "13-185-1W.xml")
+
+
+@pytest.fixture(scope="module")
+def result():
+    return calculate_sensitivity(SAMPLE)
+
+
+def test_chunks_stay_within_the_cell_budget(result):
+    simulation = monte_carlo(result, samples=50000, chunk_size=50000, seed=1)
+    amounts = comparable_arrays(result)["amounts"]
+    draws = amounts.shape[0] * int((amounts != 0).any(axis=0).sum())
+    assert simulation["chunk_size"] * draws <= MAX_CHUNK_CELLS
+    assert simulation["chunk_size"] < 50000
+    # The results of every sample still fit, so percentiles stay exact
+    assert simulation["percentile_method"] == "exact"
+
+
+def test_seeded_runs_repeat(result):
+    first = monte_carlo(result, samples=20000, seed=7, correlation="type")
+    assert first == monte_carlo(result, samples=20000, seed=7, correlation="type")
+
+
+def test_histogram_percentiles_track_exact_ones(result):
+    exact = monte_carlo(result, samples=40000, seed=3)
+    approximate = monte_carlo(result, samples=40000, chunk_size=10000, seed=3)
+    assert approximate["percentile_method"] == "histogram"
+    for a, b in zip(exact["comparables"], approximate["comparables"]):
+        assert a["bands"]["p50"] == pytest.approx(b["bands"]["p50"], rel=0.01)
+
+
+def test_oversized_chunk_size_is_rejected():
+    with open(SAMPLE, "rb") as f:
+        response = app.test_client().post(
+            "/api/simulate", data={"file": (f, "report.xml"), "chunk_size": str(MAX_SIMULATION_CHUNK + 1)},
+            content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert "chunk_size" in response.get_json()["error"]
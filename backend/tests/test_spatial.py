@@ -0,0 +1,91 @@
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+import app as app_module
+from app import calculate_sensitivity
+from conftest import SAMPLES
+from portfolio import PortfolioStore
+from spatial import GridIndex, NearbySales, haversine_miles, locate_comparables
+
+
+@pytest.fixture(scope="module")
+def results():
+    return {os.path.basename(path): calculate_sensitivity(path) for path in SAMPLES}
+
+
+@pytest.fixture
+def store(tmp_path, results):
+    store = PortfolioStore(str(tmp_path / "portfolio.sqlite3"))
+    store.write_batch([(name, name, result, float(n)) for n, (name, result) in enumerate(results.items())])
+    return store
+
+
+def test_grid_matches_brute_force():
+    rng = np.random.default_rng(7)
+    lat = 41.2 + rng.uniform(-0.1, 0.1, 2000)
+    lon = -111.9 + rng.uniform(-0.1, 0.1, 2000)
+    grid = GridIndex(lat, lon)
+    for radius in (0.1, 0.5, 2.0):
+        positions, distance = grid.query(41.2, -111.9, radius)
+        expected = np.flatnonzero(haversine_miles(41.2, -111.9, lat, lon) <= radius)
+        assert sorted(positions.tolist()) == expected.tolist()
+        assert np.all(distance <= radius)
+
+
+def test_subject_location_source(results):
+    sources = {name: result["subject_property"]["location_source"] for name, result in results.items()}
+    assert set(sources.values()) == {"reported", "estimated"}
+    result = results["13-185-1W.xml"]
+    subject = dict(result["subject_property"], latitude=None, longitude=None)
+    comparables = [dict(comp) for comp in result["comparables"]]
+    locate_comparables(subject, comparables)
+    assert subject["location_source"] == "estimated"
+    assert subject["latitude"] == pytest.approx(result["subject_property"]["latitude"])
+
+
+def test_nearby_sales_nearest_first(store, results):
+    nearby = NearbySales(store)
+    subject = results["15-460-4W (Added Comp 1235668).XML"]["subject_property"]
+    sales = nearby.query(subject["latitude"], subject["longitude"], radius_miles=5)
+    assert sales
+    distances = [sale["distance_miles"] for sale in sales]
+    assert distances == sorted(distances) and distances[-1] <= 5
+    assert all(sale["comp_type"] == "Sale" for sale in sales)
+    assert len({(sale["mls_number"] or sale["address_key"], sale["sale_month"]) for sale in sales}) == len(sales)
+
+
+def test_only_reported_subjects_anchor_a_nearby_search(store, results, monkeypatch):
+    for name, result in results.items():
+        location = store.subject_location(name)
+        if result["subject_property"]["location_source"] == "reported":
+            assert location == (result["subject_property"]["latitude"], result["subject_property"]["longitude"])
+        else:
+            assert location is None
+
+    monkeypatch.setattr(app_module, "portfolio", store)
+    monkeypatch.setattr(app_module, "nearby_sales", NearbySales(store))
+    client = app_module.app.test_client()
+    reported = client.get("/api/portfolio/nearby", query_string={
+        "report": "15-460-4W (Added Comp 1235668).XML", "radius": 5})
+    assert reported.status_code == 200
+    assert all(sale["report_id"] != "15-460-4W (Added Comp 1235668).XML" for sale in reported.get_json()["sales"])
+    estimated = client.get("/api/portfolio/nearby", query_string={"report": "13-185-1W.xml"})
+    assert estimated.status_code == 404
+
+
+def test_store_without_location_source_is_migrated(tmp_path, results):
+    path = str(tmp_path / "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE subjects (report_id TEXT PRIMARY KEY, address TEXT, address_key TEXT,"
+                 " project_name TEXT, sale_price REAL, latitude REAL, longitude REAL)")
+    conn.execute("INSERT INTO subjects VALUES ('old', 'a', 'A', NULL, 1, 41.2, -111.9)")
+    conn.commit()
+    conn.close()
+    store = PortfolioStore(path)
+    assert store.subject_location("old") is None  # Source unknown
+    name = "15-460-4W (Added Comp 1235668).XML"
+    assert store.write_batch([(name, name, results[name], 1.0)]) == (1, 0)
+    assert store.subject_location(name) is not None
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+from conftest import SAMPLE_DIR
+from app import calculate_sensitivity
+from uad_checks import CHECKS, CONSISTENCY_CHECKS, check_arrays, validate_report
+
+SAMPLE_13_185 = os.path.join(SAMPLE_DIR, "13-185-1W.xml")
+
+
+def test_sample_reports_are_consistent(sample):
+    # Line items include the ROOM_ADJUSTMENT and OTHER_FEATURE_ADJUSTMENT
+    # amounts, so every sample's grid adds up to its reported totals
+    validation = calculate_sensitivity(sample)["validation"]
+    assert validation["consistent"], validation["findings"]
+    assert validation["checked"] > 0
+
+
+def test_other_feature_lines_are_in_the_grid():
+    result = calculate_sensitivity(SAMPLE_13_185)
+    grid = result["adjustment_grid"]
+    row = grid["properties"].index("Comparable 1")
+    amounts = dict(zip(grid["types"], grid["amounts"][row]))
+    # The second feature line of the comparable is the subject's "Extras; Etc."
+    assert amounts["Other: Extras; Etc."] == 500
+    assert amounts["Other: RoomAboveGradeLine2"] == 2000
+    assert sum(amount for amount in amounts.values() if amount is not None) == -400
+
+
+def test_guideline_breach_is_reported():
+    validation = calculate_sensitivity(SAMPLE_13_185)["validation"]
+    assert not validation["within_guidelines"]
+    assert validation["findings"] == [{
+        "property_type": "Comparable 5", "check": "net_guideline",
+        "expected": 15.0, "reported": -21.8,
+    }]
+
+
+def test_check_arrays_flags_each_inconsistency():
+    nan = np.nan
+    results = check_arrays(
+        sale=[100000, 100000, 100000],
+        adjusted=[105000, 106000, 105000],
+        total=[5000, 5000, 5000],
+        net_percent=[5.0, 5.0, nan],
+        gross_percent=[nan, 9.0, nan],
+        line_net=[5000, 4000, 5000],
+        line_gross=[5000, 9000, 5000],
+    )
+    failed = {check: results[check][2].tolist() for check in CHECKS}
+    assert failed["line_items_total"] == [False, True, False]
+    assert failed["adjusted_price"] == [False, True, False]
+    # Missing percentages fail no consistency check
+    assert failed["net_percent"] == [False, False, False]
+    assert failed["gross_percent"] == [False, False, False]
+    assert not any(failed["net_guideline"] + failed["gross_guideline"])
+
+
+def test_validate_report_without_comparables():
+    validation = validate_report([], {"amounts": [[]]})
+    assert validation["consistent"] and validation["within_guidelines"]
+    assert validation["counts"] == dict.fromkeys(CHECKS, 0)
+    assert set(CONSISTENCY_CHECKS) <= set(validation["counts"])
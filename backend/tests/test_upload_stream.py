@@ -0,0 +1,82 @@
+import gzip
+import hashlib
+import io
+
+import pytest
+
+import upload_stream
+from upload_stream import Decompressor, UploadError, read_upload_bytes, stream_upload
+
+zstandard = pytest.importorskip("zstandard")
+
+
+def decode(encoding, blob, step=1000, **limits):
+    decompressor = Decompressor(encoding, **limits)
+    pieces = []
+    for start in range(0, len(blob), step):
+        pieces.extend(decompressor.decompress(blob[start:start + step]))
+    decompressor.finish()
+    return pieces
+
+
+def test_multi_member_gzip_is_decoded_in_full(sample_bytes):
+    half = len(sample_bytes) // 2
+    blob = gzip.compress(sample_bytes[:half]) + gzip.compress(sample_bytes[half:])
+    assert b"".join(decode("gzip", blob)) == sample_bytes
+
+
+def test_multi_frame_zstd_is_decoded_in_full(sample_bytes):
+    compressor = zstandard.ZstdCompressor()
+    half = len(sample_bytes) // 2
+    blob = compressor.compress(sample_bytes[:half]) + compressor.compress(sample_bytes[half:])
+    assert b"".join(decode("zstd", blob)) == sample_bytes
+
+
+def test_zstd_output_comes_in_bounded_chunks():
+    blob = zstandard.ZstdCompressor(level=19).compress(b"<x/>" * 2_000_000)
+    pieces = decode("zstd", blob, step=len(blob), chunk_size=65536, max_ratio=1e9)
+    assert b"".join(pieces) == b"<x/>" * 2_000_000
+    assert max(len(piece) for piece in pieces) <= 65536
+
+
+def test_zstd_bomb_is_rejected_before_expanding():
+    blob = zstandard.ZstdCompressor(level=19).compress(b"\0" * (200 * 1024 * 1024))
+    decompressor = Decompressor("zstd", chunk_size=65536)
+    with pytest.raises(UploadError) as error:
+        for _ in decompressor.decompress(blob):
+            pass
+    assert error.value.status == 413
+    assert decompressor.bytes_out <= upload_stream.RATIO_CHECK_FLOOR + 65536
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_truncated_stream_is_rejected(encoding, sample_bytes):
+    if encoding == "gzip":
+        blob = gzip.compress(sample_bytes)
+    else:
+        blob = zstandard.ZstdCompressor(write_checksum=True).compress(sample_bytes)
+    for cut in (10, len(blob) // 2, len(blob) - 2):
+        with pytest.raises(UploadError, match="truncated"):
+            decode(encoding, blob[:cut])
+
+
+def test_compressed_file_is_sniffed_and_hashed_decompressed(sample_bytes):
+    blob = zstandard.ZstdCompressor().compress(sample_bytes)
+    assert read_upload_bytes(io.BytesIO(blob)) == sample_bytes
+    upload = stream_upload(io.BytesIO(blob), "application/xml", filename="report.xml.zst")
+    assert upload.filename == "report.xml"
+    assert upload.digest == hashlib.sha256(sample_bytes).hexdigest()
+    assert upload.size == len(sample_bytes)
+
+
+def test_multipart_upload_with_content_encoding(sample_bytes):
+    boundary = "testboundary"
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+            f"filename=\"report.xml\"\r\nContent-Type: application/xml\r\n\r\n").encode()
+    body += sample_bytes + f"\r\n--{boundary}--\r\n".encode()
+    upload = stream_upload(io.BytesIO(gzip.compress(body)),
+                           f"multipart/form-data; boundary={boundary}",
+                           content_encoding="gzip", chunk_size=4096)
+    assert upload.filename == "report.xml"
+    assert upload.digest == hashlib.sha256(sample_bytes).hexdigest()
+    assert upload.extracted() is not None
@@ -0,0 +1,144 @@
+import numpy as np
+
+# Fannie Mae guidelines on a comparable's total adjustments, as a percent
+# of its sale price
+NET_GUIDELINE = 15.0
+GROSS_GUIDELINE = 25.0
+
+# Differences below these are rounding: amounts are whole dollars and
+# forms report percentages to one decimal
+AMOUNT_TOLERANCE = 1.0
+PERCENT_TOLERANCE = 0.15
+
+# Internal consistency of the adjustment grid
+CONSISTENCY_CHECKS = ("line_items_total", "adjusted_price", "net_percent", "gross_percent")
+GUIDELINE_CHECKS = ("net_guideline", "gross_guideline")
+CHECKS = CONSISTENCY_CHECKS + GUIDELINE_CHECKS
+
+
+def check_arrays(sale, adjusted, total, net_percent, gross_percent, line_net, line_gross):
+    """Run every check over arrays with one entry per comparable.
+
+    `total` is the signed SalePriceTotalAdjustmentAmount, `line_net` and
+    `line_gross` the sum and the sum of absolute values of the
+    SALE_PRICE_ADJUSTMENT amounts. Missing values are NaN and fail no
+    check that needs them. Returns {check: (expected, reported, failed)},
+    where the guideline checks report the limit as expected and the
+    report's percentage (or the one implied by the amounts) as reported.
+    """
+    sale, adjusted, total, net_percent, gross_percent, line_net, line_gross = (
+        np.asarray(values, dtype=float)
+        for values in (sale, adjusted, total, net_percent, gross_percent, line_net, line_gross)
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        implied_net = np.where(sale > 0, 100.0 * total / sale, np.nan)
+        implied_gross = np.where(sale > 0, 100.0 * line_gross / sale, np.nan)
+        expected_adjusted = sale + total
+        net = np.where(np.isnan(net_percent), implied_net, net_percent)
+        gross = np.where(np.isnan(gross_percent), implied_gross, gross_percent)
+        return {
+            "line_items_total": (line_net, total, np.abs(line_net - total) > AMOUNT_TOLERANCE),
+            "adjusted_price": (expected_adjusted, adjusted,
+                               np.abs(expected_adjusted - adjusted) > AMOUNT_TOLERANCE),
+            "net_percent": (implied_net, net_percent, np.abs(implied_net - net_percent) > PERCENT_TOLERANCE),
+            "gross_percent": (implied_gross, gross_percent,
+                              np.abs(implied_gross - gross_percent) > PERCENT_TOLERANCE),
+            "net_guideline": (np.full_like(net, NET_GUIDELINE), net, np.abs(net) > NET_GUIDELINE),
+            "gross_guideline": (np.full_like(gross, GROSS_GUIDELINE), gross, gross > GROSS_GUIDELINE),
+        }
+
+
+def _value(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def findings(results, label, limit=None):
+    """Failed checks as dicts, in order of comparable then check.
+
+    `label(i)` gives the dict (e.g. the property_type) that each finding
+    of the i-th comparable starts from.
+    """
+    failed = np.column_stack([results[check][2] for check in CHECKS])
+    rows, columns = np.nonzero(failed)
+    if limit is not None:
+        rows, columns = rows[:limit], columns[:limit]
+    found = []
+    for row, column in zip(rows.tolist(), columns.tolist()):
+        check = CHECKS[column]
+        expected, reported, _ = results[check]
+        found.append(dict(label(row), check=check,
+                          expected=_value(expected[row]), reported=_value(reported[row])))
+    return found
+
+
+def counts(results):
+    return {check: int(np.count_nonzero(results[check][2])) for check in CHECKS}
+
+
+def validate_report(comparables, grid):
+    """Consistency and guideline checks of one result's comparables.
+
+    The line items come from the adjustment grid, whose first row is the
+    subject.
+    """
+    if not comparables:
+        return {"checked": 0, "consistent": True, "within_guidelines": True,
+                "counts": dict.fromkeys(CHECKS, 0), "findings": []}
+    amounts = np.array(grid["amounts"][1:], dtype=float)
+    results = check_arrays(
+        [_number(comp["pre_adj"]) for comp in comparables],
+        [_number(comp["post_adj"]) for comp in comparables],
+        [_number(comp.get("total_adj_amount")) for comp in comparables],
+        [_number(comp["total_adj_percent"]) for comp in comparables],
+        [_number(comp.get("gross_adj_percent")) for comp in comparables],
+        np.nansum(amounts, axis=1),
+        np.nansum(np.abs(amounts), axis=1),
+    )
+    found = counts(results)
+    return {
+        "checked": len(comparables),
+        "consistent": not any(found[check] for check in CONSISTENCY_CHECKS),
+        "within_guidelines": not any(found[check] for check in GUIDELINE_CHECKS),
+        "counts": found,
+        "findings": findings(results, lambda i: {"property_type": comparables[i]["property_type"]}),
+    }
+
+
+def validate_portfolio(data, limit=100):
+    """Run the checks over every comparable of the portfolio at once.
+
+    `data` is PortfolioStore.validation_data() output. Returns the number
+    of comparables and reports checked, failures per check, the number of
+    reports with any consistency or guideline failure, and the first
+    `limit` findings.
+    """
+    results = check_arrays(data["sale"], data["adjusted"], data["total"], data["net_percent"],
+                           data["gross_percent"], data["line_net"], data["line_gross"])
+    report_index = data["report_index"]
+    n_reports = len(data["report_ids"])
+
+    def reports_failing(checks):
+        failed = np.logical_or.reduce([results[check][2] for check in checks])
+        return int(np.count_nonzero(np.bincount(report_index[failed], minlength=n_reports)))
+
+    def label(i):
+        return {"report_id": data["report_ids"][report_index[i]], "property_type": data["property_types"][i]}
+
+    return {
+        "comparables": len(report_index),
+        "reports": n_reports,
+        "counts": counts(results),
+        "inconsistent_reports": reports_failing(CONSISTENCY_CHECKS),
+        "reports_outside_guidelines": reports_failing(GUIDELINE_CHECKS),
+        "findings": findings(results, label, limit),
+    }
+
+
+def _number(value):
+    # Results use "N/A" and "" for missing values; percentages are strings
+    if value in (None, "", "N/A"):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
@@ -0,0 +1,474 @@
+import hashlib
+import os
+import time
+import xml.etree.ElementTree as ET
+import zlib
+
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+from xml_parsing import CHUNK_SIZE, StreamingReportParser
+
+try:
+    import zstandard
+except ImportError:  # zstd uploads are optional
+    zstandard = None
+
+# Request content types accepted as a bare XML document body
+RAW_CONTENT_TYPES = ("application/xml", "text/xml", "application/octet-stream",
+                     "application/gzip", "application/zstd")
+
+# Limits on compressed uploads. A document may grow at most
+# MAX_DECOMPRESSION_RATIO times its compressed size (checked once it is past
+# RATIO_CHECK_FLOOR bytes) and never beyond MAX_DECOMPRESSED_BYTES.
+MAX_DECOMPRESSED_BYTES = int(os.environ.get("MAX_DECOMPRESSED_BYTES", 256 * 1024 * 1024))
+MAX_DECOMPRESSION_RATIO = float(os.environ.get("MAX_DECOMPRESSION_RATIO", 50))
+RATIO_CHECK_FLOOR = 1024 * 1024
+
+# Pace a request body must keep up: once MIN_UPLOAD_GRACE seconds have
+# passed, at least MIN_UPLOAD_RATE bytes per second on average
+MIN_UPLOAD_RATE = int(os.environ.get("MIN_UPLOAD_RATE", 16 * 1024))
+MIN_UPLOAD_GRACE = float(os.environ.get("MIN_UPLOAD_GRACE", 5))
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Skippable zstd frames start with 0x50..0x5F followed by these
+ZSTD_SKIPPABLE_MAGIC = b"\x2a\x4d\x18"
+
+
+class UploadError(ValueError):
+    """The request body does not carry a usable upload."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _NeedData(Exception):
+    """Raised by _PushedInput when everything fed so far has been read."""
+
+
+class _PushedInput:
+    """Source for a zstd stream_reader that is fed as the upload arrives.
+
+    An empty read would end the reader's input for good, so until close()
+    an exhausted buffer raises _NeedData instead. read1() only reads its
+    source when it has no output to return, so no output is lost.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.closed = False
+
+    def feed(self, data):
+        self._buffer += data
+
+    def read(self, size=-1):
+        if not self._buffer:
+            if self.closed:
+                return b""
+            raise _NeedData
+        size = len(self._buffer) if size < 0 else size
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class ZstdFrames:
+    """Follows the frame and block headers of a zstd stream, without decoding.
+
+    The decoder reports no error when its input stops partway through a
+    frame, so this tells a complete stream (complete is True) from a
+    truncated one.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self._state = "magic"
+        self._need = 4  # Header bytes wanted for the current state
+        self._pending = b""
+        self._skip = 0  # Content bytes still to pass over
+        self._checksum = 0  # Checksum bytes after the last block of the frame
+
+    @property
+    def complete(self):
+        return self.frames > 0 and self._state == "magic" and not self._pending and not self._skip
+
+    def feed(self, data):
+        view = memoryview(data)
+        while view:
+            if self._skip:
+                step = min(self._skip, len(view))
+                self._skip -= step
+                view = view[step:]
+                continue
+            step = min(self._need - len(self._pending), len(view))
+            self._pending += bytes(view[:step])
+            view = view[step:]
+            if len(self._pending) == self._need:
+                header, self._pending = self._pending, b""
+                self._advance(header)
+
+    def _advance(self, header):
+        if self._state == "magic":
+            if header == ZSTD_MAGIC:
+                self._state, self._need = "frame", 1
+            elif header[0] & 0xF0 == 0x50 and header[1:] == ZSTD_SKIPPABLE_MAGIC:
+                self._state, self._need = "skippable", 4
+            else:
+                raise UploadError("Failed to decompress upload: unknown zstd frame")
+        elif self._state == "skippable":
+            self._skip = int.from_bytes(header, "little")
+            self.frames += 1
+            self._state, self._need = "magic", 4
+        elif self._state == "frame":
+            descriptor = header[0]
+            single_segment = descriptor & 0x20
+            content_size = (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6]
+            self._skip = (0 if single_segment else 1) + (0, 1, 2, 4)[descriptor & 0x03] + content_size
+            self._checksum = 4 if descriptor & 0x04 else 0
+            self._state, self._need = "block", 3
+        else:  # Block header
+            value = int.from_bytes(header, "little")
+            block_type = (value >> 1) & 0x03
+            if block_type == 3:
+                raise UploadError("Failed to decompress upload: corrupt zstd block")
+            self._skip = 1 if block_type == 1 else value >> 3
+            if value & 0x01:  # Last block of the frame
+                self._skip += self._checksum
+                self.frames += 1
+                self._state, self._need = "magic", 4
+
+
+class PacedStream:
+    """Request body stream that turns away senders too slow to wait for.
+
+    Reads pass straight through, so the body is still parsed as it
+    arrives. Once `grace` seconds have passed, a body averaging under
+    `min_rate` bytes per second raises UploadError 408, as does a read
+    that fails because the socket timed out. `on_data` is called once,
+    when the first bytes arrive.
+    """
+
+    def __init__(self, stream, min_rate=None, grace=None, on_data=None):
+        self._stream = stream
+        self.min_rate = MIN_UPLOAD_RATE if min_rate is None else min_rate
+        self.grace = MIN_UPLOAD_GRACE if grace is None else grace
+        self._on_data = on_data
+        self._start = time.monotonic()
+        self.received = 0
+
+    def read(self, size=-1):
+        try:
+            data = self._stream.read(size)
+        except (OSError, ClientDisconnected) as e:
+            raise UploadError("The upload stalled or was interrupted", status=408) from e
+        if data:
+            if not self.received and self._on_data is not None:
+                self._on_data()
+            self.received += len(data)
+            elapsed = time.monotonic() - self._start
+            if elapsed > self.grace and self.received < self.min_rate * elapsed:
+                raise UploadError("The upload is arriving too slowly", status=408)
+        return data
+
+
+class Decompressor:
+    """Push-style gzip/zstd decoder that yields output in bounded chunks.
+
+    No call produces more than `chunk_size` bytes at a time, and output is
+    checked against the ratio and size limits as it is produced, so a
+    decompression bomb is rejected long before it is expanded. Streams of
+    several gzip members or zstd frames are decoded in full; finish()
+    rejects a stream that stops partway through one.
+    """
+
+    def __init__(self, encoding, chunk_size=CHUNK_SIZE, max_ratio=None, max_size=None):
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.max_ratio = MAX_DECOMPRESSION_RATIO if max_ratio is None else max_ratio
+        self.max_size = MAX_DECOMPRESSED_BYTES if max_size is None else max_size
+        self.bytes_in = 0
+        self.bytes_out = 0
+        if encoding in ("gzip", "x-gzip"):
+            self._zlib = self._gzip_member()
+        elif encoding == "zstd":
+            if zstandard is None:
+                raise UploadError("zstd uploads are not supported on this server", status=415)
+            self._zlib = None
+            self._input = _PushedInput()
+            self._frames = ZstdFrames()
+            self._zstd = zstandard.ZstdDecompressor().stream_reader(
+                self._input, read_size=chunk_size, read_across_frames=True)
+        else:
+            raise UploadError(f"Unsupported content encoding: {encoding}", status=415)
+
+    @staticmethod
+    def _gzip_member():
+        # 32 + 15: accept both gzip and zlib headers
+        return zlib.decompressobj(wbits=32 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        """Yield the decompressed output of the next compressed block."""
+        self.bytes_in += len(data)
+        try:
+            if self._zlib is not None:
+                while data:
+                    if self._zlib.eof:
+                        # Another gzip member follows the one just finished
+                        self._zlib = self._gzip_member()
+                    out = self._zlib.decompress(data, self.chunk_size)
+                    data = self._zlib.unconsumed_tail or self._zlib.unused_data
+                    if out:
+                        yield self._check(out)
+            else:
+                self._frames.feed(data)
+                self._input.feed(data)
+                yield from self._read_zstd()
+        except (zlib.error, getattr(zstandard, "ZstdError", zlib.error)) as e:
+            raise UploadError(f"Failed to decompress upload: {e}") from e
+
+    def _read_zstd(self):
+        while True:
+            try:
+                out = self._zstd.read1(self.chunk_size)
+            except _NeedData:
+                return
+            if not out:
+                return
+            yield self._check(out)
+
+    def finish(self):
+        """Raise UploadError if the compressed stream was cut short."""
+        if self._zlib is not None:
+            if not self._zlib.eof:
+                raise UploadError("Failed to decompress upload: truncated gzip stream")
+            return
+        self._input.closed = True
+        try:
+            for _ in self._read_zstd():
+                pass  # Everything fed has been read already; nothing to hand on
+        except getattr(zstandard, "ZstdError", zlib.error) as e:
+            raise UploadError(f"Failed to decompress upload: {e}") from e
+        if not self._frames.complete:
+            raise UploadError("Failed to decompress upload: truncated zstd stream")
+
+    def _check(self, out):
+        self.bytes_out += len(out)
+        if self.bytes_out > self.max_size:
+            raise UploadError("Decompressed upload is too large", status=413)
+        if (self.bytes_out > RATIO_CHECK_FLOOR
+                and self.bytes_out > self.max_ratio * max(self.bytes_in, 1)):
+            raise UploadError("Upload decompression ratio is too high", status=413)
+        return out
+
+
+def sniff_encoding(data):
+    """Compression format of a document from its first bytes, or None."""
+    if data.startswith(GZIP_MAGIC):
+        return "gzip"
+    if data.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def strip_compression_suffix(filename):
+    """"report.xml.gz" -> "report.xml"."""
+    for suffix in (".gz", ".zst"):
+        if filename and filename.lower().endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+class DigestOnly:
+    """Parser for StreamedUpload that extracts nothing.
+
+    For a body that only needs its digest and size, such as one checked
+    against a digest the client claims for it.
+    """
+
+    def feed(self, data):
+        pass
+
+    def close(self):
+        return None
+
+
+class StreamedUpload:
+    """Document read straight off the request body.
+
+    Every chunk is hashed and fed to the XML extractor as it arrives, so
+    parsing overlaps with receiving and the body is never held in full.
+    A gzip or zstd compressed document (e.g. report.xml.gz) is recognized
+    by its first bytes and decompressed on the way in; the digest and size
+    are those of the decompressed document. `parser` replaces the default
+    comparable extractor (anything with feed() and close()).
+    """
+
+    def __init__(self, parser=None):
+        self.filename = None
+        self.size = 0
+        self.parse_error = None  # ET.ParseError raised by the extractor, if any
+        self._digest = hashlib.sha256()
+        self._parser = parser if parser is not None else StreamingReportParser()
+        self._extracted = None
+        self._decompressor = None
+        self._started = False
+
+    def feed(self, data):
+        if not self._started:
+            self._started = True
+            encoding = sniff_encoding(data)
+            if encoding:
+                self._decompressor = Decompressor(encoding)
+                self.filename = strip_compression_suffix(self.filename)
+        if self._decompressor is None:
+            self._feed_document(data)
+        else:
+            for out in self._decompressor.decompress(data):
+                self._feed_document(out)
+
+    def _feed_document(self, data):
+        self.size += len(data)
+        self._digest.update(data)
+        if self._parser is None:
+            return  # Already failed; keep hashing so the body is drained
+        try:
+            self._parser.feed(data)
+        except ET.ParseError as e:
+            self.parse_error = e
+            self._parser = None
+
+    def close(self):
+        if self._decompressor is not None:
+            self._decompressor.finish()
+        if self._parser is not None:
+            try:
+                self._extracted = self._parser.close()
+            except ET.ParseError as e:
+                self.parse_error = e
+            self._parser = None
+
+    @property
+    def digest(self):
+        return self._digest.hexdigest()
+
+    def extracted(self):
+        """The parser's close() output; raises the ET.ParseError if parsing failed."""
+        if self.parse_error is not None:
+            raise self.parse_error
+        return self._extracted
+
+
+def stream_upload(stream, content_type, filename=None, field="file",
+                  content_encoding=None, parser=None, chunk_size=CHUNK_SIZE):
+    """Read an upload from a request body stream.
+
+    Accepts multipart/form-data (the first file part named `field`) or a
+    bare XML body (named by `filename`), either of which may be sent with
+    Content-Encoding gzip or zstd. Raises UploadError when no document is
+    present or it cannot be decoded.
+    """
+    for upload in iter_upload(stream, content_type, filename, field,
+                              content_encoding, parser, chunk_size):
+        pass
+    return upload
+
+
+def iter_upload(stream, content_type, filename=None, field="file",
+                content_encoding=None, parser=None, chunk_size=CHUNK_SIZE):
+    """stream_upload() one body chunk at a time.
+
+    Yields the StreamedUpload after each chunk has been fed to the parser,
+    and once more after it is closed, so the caller can act on what has
+    been extracted so far. Errors in the request itself surface on the
+    first next().
+    """
+    mimetype, options = parse_options_header(content_type or "")
+    upload = StreamedUpload(parser)
+
+    encoding = (content_encoding or "identity").strip().lower()
+    decompressor = None if encoding == "identity" else Decompressor(encoding, chunk_size)
+    chunks = _read_chunks(stream, chunk_size, decompressor)
+
+    if mimetype == "multipart/form-data":
+        boundary = options.get("boundary")
+        if not boundary:
+            raise UploadError("No file part")
+        yield from _read_multipart(chunks, boundary.encode("latin-1"), field, upload)
+    elif mimetype in RAW_CONTENT_TYPES:
+        upload.filename = filename or "upload.xml"
+        for chunk in chunks:
+            upload.feed(chunk)
+            yield upload
+        if not upload.size:
+            raise UploadError("No file part")
+    else:
+        raise UploadError("No file part")
+
+    upload.close()
+    yield upload
+
+
+def read_upload_bytes(stream, chunk_size=CHUNK_SIZE):
+    """Read a whole uploaded file, decompressing it if it is gzip or zstd."""
+    first = stream.read(chunk_size)
+    encoding = sniff_encoding(first)
+    if encoding is None:
+        return first + stream.read()
+    decompressor = Decompressor(encoding, chunk_size)
+    parts = list(decompressor.decompress(first))
+    for chunk in _read_chunks(stream, chunk_size, decompressor):
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+def _read_chunks(stream, chunk_size, decompressor=None):
+    """Yield the body in chunks, decompressed when there is a decompressor."""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if decompressor is None:
+            yield chunk
+        else:
+            yield from decompressor.decompress(chunk)
+    if decompressor is not None:
+        decompressor.finish()
+
+
+def _read_multipart(chunks, boundary, field, upload):
+    # Generator; yields the upload after each body chunk
+    decoder = MultipartDecoder(boundary)
+    in_file = False
+    finished = False
+    chunks = iter(chunks)
+    while not finished:
+        chunk = next(chunks, None)
+        try:
+            decoder.receive_data(chunk or None)
+            while True:
+                event = decoder.next_event()
+                if isinstance(event, NeedData):
+                    break
+                if isinstance(event, Epilogue):
+                    finished = True
+                    break
+                if isinstance(event, File) and event.name == field and upload.filename is None:
+                    upload.filename = event.filename
+                    in_file = True
+                elif isinstance(event, Data) and in_file:
+                    upload.feed(event.data)
+                    if not event.more_data:
+                        in_file = False
+        except UploadError:
+            raise
+        except ValueError as e:
+            raise UploadError(f"Malformed multipart body: {e}") from e
+        if not chunk:
+            break
+        yield upload
+
+    if upload.filename is None:
+        raise UploadError("No file part")
@@ -0,0 +1,337 @@
+import binascii
+import os
+import xml.etree.ElementTree as ET
+
+from field_spec import DEFAULT_PROFILE, REPORT_SPEC, extract, market_value, profile_for, to_float
+
+# Size of the blocks fed to the parser. Only one block is held at a time.
+CHUNK_SIZE = 64 * 1024
+
+# Deepest element nesting accepted; MISMO reports stay well under 20 levels
+MAX_DEPTH = int(os.environ.get("XML_MAX_DEPTH", 64))
+
+
+class XMLLimitError(ET.ParseError):
+    """Raised when a document exceeds a parser limit."""
+
+
+def reject_doctype(name, pubid, system):
+    """Refuse documents with a DOCTYPE.
+
+    Reports never carry one, and without a DTD there are no entity
+    declarations to expand, so no document can grow while parsing.
+    """
+    raise XMLLimitError("XML documents with a DOCTYPE are not accepted")
+
+
+def too_deep():
+    return XMLLimitError(f"XML nesting is deeper than {MAX_DEPTH} levels")
+
+
+def adjustment_key(attrib):
+    """Name of the adjustment line described by a SALE_PRICE_ADJUSTMENT.
+
+    "Other" lines are told apart by their _TypeOtherDescription, e.g.
+    "Other: Fireplaces".
+    """
+    adj_type = attrib.get("_Type", "Unknown")
+    other = attrib.get("_TypeOtherDescription")
+    if adj_type == "Other" and other:
+        return f"Other: {other}"
+    return adj_type
+
+
+# Grid line of the room count row. ROOM_ADJUSTMENT carries its amount as
+# RoomAdjustmentAmount, which most forms repeat as a SALE_PRICE_ADJUSTMENT
+# of this name; whichever comes first is kept.
+ROOM_LINE = "Other: RoomAboveGradeLine2"
+
+
+def room_line(attrib):
+    """(description, amount) of a ROOM_ADJUSTMENT, e.g. ("4/2/1.0", 2000.0)."""
+    counts = [attrib.get(name) for name in ("TotalRoomCount", "TotalBedroomCount", "TotalBathroomCount")]
+    description = "/".join(counts) if all(counts) else None
+    return description, to_float(attrib.get("RoomAdjustmentAmount"))
+
+
+def feature_key(attrib, names):
+    """Name of the adjustment line described by an OTHER_FEATURE_ADJUSTMENT.
+
+    The n-th feature of a comparable is the n-th "Other" line of the
+    subject (e.g. "Other: Fireplaces"), whose names are in `names`;
+    without one it is "Other feature n".
+    """
+    sequence = attrib.get("PropertyFeatureSequenceIdentifier", "")
+    if sequence.isdigit() and 0 < int(sequence) <= len(names):
+        return names[int(sequence) - 1]
+    return f"Other feature {sequence or '?'}"
+
+
+def sale_month(sale_date):
+    """Convert a UAD "mm/yy" sale date to "yyyy-mm", or None if unparseable."""
+    if not sale_date:
+        return None
+    parts = sale_date.split("/")
+    if len(parts) != 2 or not all(part.strip().isdigit() for part in parts):
+        return None
+    month, year = int(parts[0]), int(parts[1])
+    if not 1 <= month <= 12:
+        return None
+    return f"{2000 + year:04d}-{month:02d}"
+
+
+class ReportTarget:
+    """Parser target that keeps the comparable sale data and nothing else.
+
+    No element tree is built: the fields named by the extraction profile
+    (see field_spec) are copied out as each element opens, and character
+    data (including the base64 PDF inside EMBEDDED_FILE) is discarded as
+    it arrives. The profile is chosen by the primary FORM, which precedes
+    the comparables; the first occurrence of an element within a
+    comparable wins.
+
+    Besides the SALE_PRICE_ADJUSTMENT lines, a comparable's adjustments
+    include its ROOM_ADJUSTMENT amount and its OTHER_FEATURE_ADJUSTMENT
+    lines (fireplaces, extras, landscaping), which some forms only
+    report there.
+
+    MARKET_INVENTORY lines (the form's market conditions grid) are kept as
+    (scope, type, month range, value, trend) tuples, with scope "project"
+    for the condo project grid under SUBJECT_PROJECT and "neighborhood"
+    otherwise.
+    """
+
+    doctype = staticmethod(reject_doctype)
+
+    def __init__(self):
+        self.report = {}  # Report level fields
+        self.profile = DEFAULT_PROFILE
+        self.comparables = []
+        self.market = []  # MARKET_INVENTORY lines
+        self._report_seen = set()  # Tags already extracted for the report
+        self._project_depth = 0  # Nesting depth inside SUBJECT_PROJECT
+        self._comp = None  # COMPARABLE_SALE currently being read
+        self._seen = None  # Tags already extracted for the current comparable
+        self._feature_names = ()  # The subject's "Other" lines, in order
+        self._form_found = False
+        self._skip_depth = 0  # Nesting depth inside EMBEDDED_FILE
+        self._depth = 0  # Nesting depth in the document
+
+    def start(self, tag, attrib):
+        self._depth += 1
+        if self._depth > MAX_DEPTH:
+            raise too_deep()
+        # Ignore everything below EMBEDDED_FILE
+        if self._skip_depth:
+            self._skip_depth += 1
+            return
+        if tag == "EMBEDDED_FILE":
+            self._skip_depth = 1
+            return
+
+        if self._project_depth or tag == "SUBJECT_PROJECT":
+            self._project_depth += 1
+
+        comp = self._comp
+        if comp is not None:
+            if tag == "SALE_PRICE_ADJUSTMENT":
+                # Index the line by type; the first line of a type wins
+                key = adjustment_key(attrib)
+                if key not in comp["adjustments"]:
+                    comp["adjustments"][key] = (attrib.get("_Description"), to_float(attrib.get("_Amount")))
+                    handlers = self.profile.adjustments.get(key)
+                    if handlers:
+                        extract(handlers, attrib, comp["fields"])
+            elif tag == "ROOM_ADJUSTMENT":
+                line = room_line(attrib)
+                if line[1] is not None:
+                    comp["adjustments"].setdefault(ROOM_LINE, line)
+            elif tag == "OTHER_FEATURE_ADJUSTMENT":
+                line = (attrib.get("PropertyFeatureDescription"),
+                        to_float(attrib.get("PropertyFeatureAdjustmentAmount")))
+                if line != (None, None):
+                    comp["adjustments"].setdefault(feature_key(attrib, self._feature_names), line)
+            elif tag not in self._seen:
+                handlers = self.profile.elements.get(tag)
+                if handlers:
+                    self._seen.add(tag)
+                    extract(handlers, attrib, comp["fields"])
+        elif tag == "COMPARABLE_SALE":
+            self._comp = {"fields": {}, "adjustments": {}}  # adjustment key -> (description, amount)
+            self._seen = {tag}
+            extract(self.profile.elements.get(tag, ()), attrib, self._comp["fields"])
+        elif tag == "MARKET_INVENTORY":
+            self.market.append((
+                "project" if self._project_depth else "neighborhood",
+                attrib.get("_Type"), attrib.get("_MonthRangeType"),
+                market_value(attrib), attrib.get("_TrendType"),
+            ))
+        elif tag in REPORT_SPEC.elements and tag not in self._report_seen:
+            self._report_seen.add(tag)
+            extract(REPORT_SPEC.elements[tag], attrib, self.report)
+        elif (tag == "FORM" and not self._form_found
+              and attrib.get("AppraisalReportContentIsPrimaryFormIndicator") == "Y"):
+            self._form_found = True
+            form_name = attrib.get("AppraisalReportContentName")
+            self.profile = profile_for(form_name)
+            self.report["form_name"] = form_name
+
+    def end(self, tag):
+        self._depth -= 1
+        if self._skip_depth:
+            self._skip_depth -= 1
+            return
+        if tag == "COMPARABLE_SALE" and self._comp is not None:
+            # The comparable is complete; fill in defaults, hand it over
+            # and drop our reference
+            fields = self._comp["fields"]
+            for name, default in self.profile.defaults.items():
+                fields.setdefault(name, default)
+            if fields["sequence"] == "0":
+                self._feature_names = tuple(
+                    key for key in self._comp["adjustments"]
+                    if key.startswith("Other: ") and not key.startswith("Other: RoomAboveGrade")
+                )
+            self.comparables.append(self._comp)
+            self._comp = None
+        if self._project_depth:
+            self._project_depth -= 1
+
+    def data(self, data):
+        # Text content is never needed for the analysis
+        pass
+
+    def close(self):
+        return {
+            "report": self.report,
+            "profile": self.profile,
+            "comparables": self.comparables,
+            "market": self.market,
+        }
+
+
+class StreamingReportParser:
+    """Incremental extractor for MISMO appraisal XML.
+
+    Feed the document in chunks as it becomes available, then call close()
+    to get the REPORT attributes and the list of comparable sale records.
+    """
+
+    def __init__(self):
+        self.target = ReportTarget()
+        self._parser = ET.XMLParser(target=self.target)
+
+    def feed(self, data):
+        self._parser.feed(data)
+
+    def close(self):
+        return self._parser.close()
+
+
+class Base64Decoder:
+    """Incremental base64 decoder for text that arrives in arbitrary pieces.
+
+    Whitespace (the 76-column line breaks) is dropped and any incomplete
+    4-character group is held back until the next piece.
+    """
+
+    def __init__(self):
+        self._pending = ""
+
+    def decode(self, text):
+        text = self._pending + "".join(text.split())
+        usable = len(text) - len(text) % 4
+        self._pending = text[usable:]
+        return binascii.a2b_base64(text[:usable]) if usable else b""
+
+    def finish(self):
+        if self._pending:
+            raise ValueError("Embedded file ends with incomplete base64 data")
+
+
+class EmbeddedFileTarget:
+    """Parser target that decodes the first embedded file into a sink.
+
+    The base64 text inside the first EMBEDDED_FILE whose MIMEType matches is
+    decoded as it arrives and written to `sink` (anything with write()), so
+    only one piece of it is in memory at a time. Everything else in the
+    document is ignored.
+    """
+
+    doctype = staticmethod(reject_doctype)
+
+    def __init__(self, sink, mime_type="application/pdf"):
+        self.sink = sink
+        self.mime_type = mime_type
+        self.attributes = None  # Attributes of the EMBEDDED_FILE, once found
+        self.size = 0  # Decoded bytes written
+        self._decoder = None
+        self._depth = 0  # Nesting depth inside the EMBEDDED_FILE
+        self._done = False
+        self._level = 0  # Nesting depth in the document
+
+    def start(self, tag, attrib):
+        self._level += 1
+        if self._level > MAX_DEPTH:
+            raise too_deep()
+        if self._depth:
+            self._depth += 1
+        elif (tag == "EMBEDDED_FILE" and not self._done
+              and attrib.get("MIMEType", "").lower() == self.mime_type):
+            self.attributes = dict(attrib)
+            self._decoder = Base64Decoder()
+            self._depth = 1
+
+    def end(self, tag):
+        self._level -= 1
+        if self._depth:
+            self._depth -= 1
+            if not self._depth:
+                self._decoder.finish()
+                self._done = True
+
+    def data(self, data):
+        if self._depth:
+            decoded = self._decoder.decode(data)
+            if decoded:
+                self.sink.write(decoded)
+                self.size += len(decoded)
+
+    def close(self):
+        if self.attributes is None:
+            return None
+        return {"attributes": self.attributes, "size": self.size}
+
+
+class EmbeddedFileParser(StreamingReportParser):
+    """Incremental extractor for the embedded PDF of an appraisal.
+
+    close() returns the EMBEDDED_FILE attributes and decoded size, or None
+    when the document has no embedded file of that type.
+    """
+
+    def __init__(self, sink, mime_type="application/pdf"):
+        self.target = EmbeddedFileTarget(sink, mime_type)
+        self._parser = ET.XMLParser(target=self.target)
+
+
+def parse_report(source, chunk_size=CHUNK_SIZE):
+    """Extract the report and its comparable sales from a path or file-like object.
+
+    Raises ET.ParseError if the document is not well-formed, or
+    XMLLimitError (a ParseError) if it exceeds a parser limit.
+    """
+    parser = StreamingReportParser()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return _feed_all(parser, f, chunk_size)
+    return _feed_all(parser, source, chunk_size)
+
+
+def _feed_all(parser, stream, chunk_size):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    return parser.close()
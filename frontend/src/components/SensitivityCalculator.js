@@ -22,10 +22,73 @@ ChartJS.register(
   Legend
 );
 
+// Backend location, how long each job status poll may be held open and
+// how long a job is polled for in all before giving up on it
+const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:8080';
+const JOB_POLL_WAIT_SECONDS = 25;
+const JOB_DEADLINE_SECONDS = 300;
+
+// Read the analysis as newline-delimited JSON where the browser can read a
+// response body as it arrives, so rows render while the report is parsed;
+// otherwise submit it as a job and poll for the result
+const STREAM_RESULTS =
+  process.env.REACT_APP_STREAM_RESULTS !== '0' && typeof ReadableStream !== 'undefined';
+
+// Gzip the report in the browser before uploading; the server recognizes
+// the compressed file and decompresses it as it streams in. Browsers
+// without CompressionStream send the file as is.
+const compressForUpload = async (file) => {
+  if (typeof CompressionStream === 'undefined') return file;
+  const compressed = file.stream().pipeThrough(new CompressionStream('gzip'));
+  const blob = await new Response(compressed).blob();
+  return new File([blob], `${file.name}.gz`, { type: 'application/gzip' });
+};
+
+// SHA-256 of the uncompressed report as hex, or null where the browser has
+// no Web Crypto (e.g. plain http on another host). The server answers a
+// request carrying it from its result cache without parsing the upload.
+const reportDigest = async (file) => {
+  if (!window.crypto || !window.crypto.subtle) return null;
+  const hash = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(hash), (byte) => byte.toString(16).padStart(2, '0')).join('');
+};
+
+// POST the report to /api/calculate?format=ndjson and call onRecord with
+// each record (subject, comparable..., summary or error) as it arrives.
+// Returns the error message of a rejected request, if any. Aborting
+// `signal` cancels the request and the read.
+const streamAnalysis = async (upload, digest, onRecord, signal) => {
+  const formData = new FormData();
+  formData.append('file', upload);
+  const response = await fetch(`${API_BASE_URL}/api/calculate?format=ndjson`, {
+    method: 'POST',
+    body: formData,
+    headers: digest ? { 'X-Report-Digest': digest } : {},
+    signal,
+  });
+  if (!response.ok) {
+    const body = await response.json().catch(() => ({}));
+    return body.error || `Server error: ${response.status}`;
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    buffered += decoder.decode(value, { stream: !done });
+    const lines = buffered.split('\n');
+    buffered = done ? '' : lines.pop(); // Keep a partial last line for the next read
+    lines.filter((line) => line.trim()).forEach((line) => onRecord(JSON.parse(line)));
+    if (done) return null;
+  }
+};
+
 const SensitivityCalculator = ({ userEmail, initialFile }) => {
   const [file, setFile] = useState(initialFile || null);
   const [subjectProperty, setSubjectProperty] = useState(null);
   const [comparables, setComparables] = useState([]);
+  const [summary, setSummary] = useState(null);
   const [error, setError] = useState(null);
   const [loading, setLoading] = useState(false);
 
@@ -35,8 +98,12 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
     console.log('SensitivityCalculator - Received Initial File:', initialFile);
   }, [userEmail, initialFile]);
 
-  // Process uploaded file when initialFile changes
+  // Process uploaded file when initialFile changes. Unmounting or a new
+  // file cancels the requests in flight and stops the polling.
   useEffect(() => {
+    const controller = new AbortController();
+    const cancelled = () => controller.signal.aborted;
+
     const processUploadedFile = async () => {
       if (!initialFile) return;
 
@@ -44,27 +111,85 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
       setError(null);
 
       try {
+        const upload = await compressForUpload(initialFile);
+        if (cancelled()) return;
+        setSubjectProperty(null);
+        setComparables([]);
+        setSummary(null);
+
+        if (STREAM_RESULTS) {
+          // Rows are added as the server parses them; distances from the
+          // subject come with the summary, once every comparable is in
+          const digest = await reportDigest(initialFile);
+          if (cancelled()) return;
+          const failure = await streamAnalysis(upload, digest, (record) => {
+            if (record.type === 'subject') {
+              setSubjectProperty(record.property);
+            } else if (record.type === 'comparable') {
+              setComparables((rows) => [...rows, record.property]);
+            } else if (record.type === 'summary') {
+              const { locations } = record;
+              setSubjectProperty((subject) => ({ ...subject, ...locations.subject }));
+              setComparables((rows) =>
+                rows.map((row, index) => ({ ...row, ...locations.comparables[index] }))
+              );
+              setSummary(record.summary);
+            } else if (record.type === 'error') {
+              setError(record.error);
+            }
+          }, controller.signal);
+          if (failure) setError(failure);
+          return;
+        }
+
         const formData = new FormData();
-        formData.append('file', initialFile);
+        formData.append('file', upload);
 
-        // Configurable axios call with full URL and timeout
-        const response = await axios({
+        // Submit the file as an analysis job; the server answers right away
+        const submitted = await axios({
           method: 'post',
-          url: process.env.REACT_APP_UPLOAD_URL || 'http://localhost:8080/api/upload',
+          url: `${API_BASE_URL}/api/jobs`,
           data: formData,
           headers: {
             'Content-Type': 'multipart/form-data'
           },
-          timeout: 10000 // 10 seconds timeout
+          timeout: 10000, // 10 seconds timeout for the upload itself
+          signal: controller.signal
         });
 
-        if (response.data) {
-          setSubjectProperty(response.data.subjectProperty);
-          setComparables(response.data.comparables);
-        } else {
+        // Long-poll the job until it finishes or the deadline passes
+        const deadline = Date.now() + JOB_DEADLINE_SECONDS * 1000;
+        let job = submitted.data;
+        while (job.status !== 'done' && job.status !== 'failed') {
+          const remaining = Math.ceil((deadline - Date.now()) / 1000);
+          if (remaining <= 0) {
+            setError('The analysis is taking too long. Please try again later.');
+            return;
+          }
+          const wait = Math.min(JOB_POLL_WAIT_SECONDS, remaining);
+          const polled = await axios.get(
+            `${API_BASE_URL}/api/jobs/${job.job_id}`,
+            {
+              params: { wait },
+              timeout: (wait + 10) * 1000,
+              signal: controller.signal
+            }
+          );
+          job = polled.data;
+        }
+
+        const result = job.result;
+        if (!result) {
           setError('No data received from the server');
+        } else if (result.error) {
+          setError(result.error);
+        } else {
+          setSubjectProperty(result.subject_property);
+          setComparables(result.comparables);
+          setSummary(result.summary);
         }
       } catch (err) {
+        if (cancelled()) return; // Unmounted or replaced; nothing to report
         console.error('File processing error:', err);
         
         // More detailed error logging
@@ -83,11 +208,12 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
           setError(`Request setup error: ${err.message}`);
         }
       } finally {
-        setLoading(false);
+        if (!cancelled()) setLoading(false);
       }
     };
 
     processUploadedFile();
+    return () => controller.abort();
   }, [initialFile]);
 
   const scatterData = () => {
@@ -177,7 +303,7 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
   };
 
   const formatCurrency = (value) => {
-    if (value === "N/A") return value; // Handle "N/A" values
+    if (value === "N/A" || value === null || value === undefined) return "N/A"; // Handle missing values
     return new Intl.NumberFormat("en-US", {
       style: "currency",
       currency: "USD",
@@ -185,7 +311,7 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
   };
 
   const formatPercent = (value, multiplyBy100 = true) => {
-    if (value === "N/A") return value; // Handle "N/A" values
+    if (value === "N/A" || value === null || value === undefined) return "N/A"; // Handle missing values
     const percentValue = multiplyBy100
       ? parseFloat(value) * 100
       : parseFloat(value);
@@ -289,9 +415,25 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
     };
   };
 
+  // Summary statistics are computed by the server in one pass
+  const preAdj = summary?.pre_adj || {};
+  const postAdj = summary?.post_adj || {};
+  const explanationText = `A good indication that the individual adjustments represent the market reaction can be seen in the difference between the pre-adjusted sale price range of ${formatCurrency(
+    preAdj.range
+  )} or ${formatPercent(
+    preAdj.range_percent,
+    false
+  )} to the post-adjusted sale price range of ${formatCurrency(
+    postAdj.range
+  )} or ${formatPercent(
+    postAdj.range_percent,
+    false
+  )}. The tighter the adjusted range suggests that the adjustments are more credible and reflective of the market.`;
+  const chartData = scatterData();
+
   return (
     <div className="container mt-5">
-      {loading ? (
+      {loading && !subjectProperty ? (
         <div className="text-center">
           <div className="spinner-border text-primary" role="status">
             <span className="sr-only">Loading...</span>
@@ -302,7 +444,7 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
         <div className="alert alert-danger" role="alert">
           {error}
         </div>
-      ) : !subjectProperty || comparables.length === 0 ? (
+      ) : !subjectProperty || (!loading && (!summary || comparables.length === 0)) ? (
         <div className="alert alert-warning" role="alert">
           No data available. Please ensure you've uploaded a valid XML file.
         </div>
@@ -312,8 +454,17 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
           <div className="row">
             {/* Right Column: Results and Charts */}
             <div className="col-md-8">
+              {/* Streamed rows show up before the summary; keep the spinner until it arrives */}
+              {loading && (
+                <div className="text-center mb-4">
+                  <div className="spinner-border spinner-border-sm text-primary" role="status">
+                    <span className="sr-only">Loading...</span>
+                  </div>{" "}
+                  Reading comparables... {comparables.length} so far
+                </div>
+              )}
               {/* Results Summary Card */}
-              {comparables.length > 0 && (
+              {summary && comparables.length > 0 && (
                 <div className="card mb-4 border-info">
                   <div className="card-header text-white bg-info">
                     <h2>Summary Results</h2>
@@ -330,130 +481,54 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
                       <tbody>
                         <tr>
                           <td>Maximum Sale Price</td>
-                          <td>
-                            {formatCurrency(
-                              Math.max(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.pre_adj)
-                              )
-                            )}
-                          </td>
-                          <td>
-                            {formatCurrency(
-                              Math.max(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.post_adj)
-                              )
-                            )}
-                          </td>
+                          <td>{formatCurrency(preAdj.max)}</td>
+                          <td>{formatCurrency(postAdj.max)}</td>
                         </tr>
                         <tr>
                           <td>Minimum Sale Price</td>
-                          <td>
-                            {formatCurrency(
-                              Math.min(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.pre_adj)
-                              )
-                            )}
-                          </td>
-                          <td>
-                            {formatCurrency(
-                              Math.min(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.post_adj)
-                              )
-                            )}
-                          </td>
+                          <td>{formatCurrency(preAdj.min)}</td>
+                          <td>{formatCurrency(postAdj.min)}</td>
                         </tr>
                         <tr>
                           <td>Range of Sale Prices</td>
-                          <td>
-                            {formatCurrency(
-                              Math.max(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.pre_adj)
-                              ) -
-                                Math.min(
-                                  ...comparables
-                                    .filter((c) => c.comp_type === "Sale")
-                                    .map((c) => c.pre_adj)
-                                )
-                            )}
-                          </td>
-                          <td>
-                            {formatCurrency(
-                              Math.max(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.post_adj)
-                              ) -
-                                Math.min(
-                                  ...comparables
-                                    .filter((c) => c.comp_type === "Sale")
-                                    .map((c) => c.post_adj)
-                                )
-                            )}
-                          </td>
+                          <td>{formatCurrency(preAdj.range)}</td>
+                          <td>{formatCurrency(postAdj.range)}</td>
                         </tr>
                         <tr>
                           <td>Percent Change</td>
-                          <td>
-                            {formatPercent(
-                              (Math.max(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.pre_adj)
-                              ) -
-                                Math.min(
-                                  ...comparables
-                                    .filter((c) => c.comp_type === "Sale")
-                                    .map((c) => c.pre_adj)
-                                )) /
-                                Math.min(
-                                  ...comparables
-                                    .filter((c) => c.comp_type === "Sale")
-                                    .map((c) => c.pre_adj)
-                                )
-                            )}
-                          </td>
-                          <td>
-                            {formatPercent(
-                              (Math.max(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.post_adj)
-                              ) -
-                                Math.min(
-                                  ...comparables
-                                    .filter((c) => c.comp_type === "Sale")
-                                    .map((c) => c.post_adj)
-                                )) /
-                                Math.min(
-                                  ...comparables
-                                    .filter((c) => c.comp_type === "Sale")
-                                    .map((c) => c.post_adj)
-                                )
-                            )}
-                          </td>
+                          <td>{formatPercent(preAdj.range_percent, false)}</td>
+                          <td>{formatPercent(postAdj.range_percent, false)}</td>
+                        </tr>
+                        <tr>
+                          <td>Mean Sale Price</td>
+                          <td>{formatCurrency(preAdj.mean)}</td>
+                          <td>{formatCurrency(postAdj.mean)}</td>
+                        </tr>
+                        <tr>
+                          <td>Median Sale Price</td>
+                          <td>{formatCurrency(preAdj.median)}</td>
+                          <td>{formatCurrency(postAdj.median)}</td>
                         </tr>
                         <tr>
                           <td>Included Properties</td>
-                          <td colSpan="2">
-                            {comparables.filter((c) => c.comp_type === "Sale").length}
-                          </td>
+                          <td colSpan="2">{summary.sale_count}</td>
                         </tr>
                         <tr>
                           <td>Excluded Properties (Listings)</td>
-                          <td colSpan="2">
-                            {comparables.filter((c) => c.comp_type !== "Sale").length}
-                          </td>
+                          <td colSpan="2">{summary.listing_count}</td>
                         </tr>
+                        {summary.other_count > 0 && (
+                          <tr>
+                            <td>Excluded Properties (Other)</td>
+                            <td colSpan="2">
+                              {summary.other_count} (
+                              {Object.entries(summary.other_types)
+                                .map(([type, count]) => `${type}: ${count}`)
+                                .join(", ")}
+                              )
+                            </td>
+                          </tr>
+                        )}
                       </tbody>
                     </table>
                   </div>
@@ -461,7 +536,7 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
               )}
 
               {/* Analysis Explanation Card */}
-              {comparables.length > 0 && (
+              {summary && comparables.length > 0 && (
                 <div className="card mb-4 border-info">
                   <div className="card-header text-white bg-info">
                     <h2>Analysis Explanation</h2>
@@ -471,122 +546,12 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
                       className="form-control"
                       rows="5"
                       readOnly
-                      value={`A good indication that the individual adjustments represent the market reaction can be seen in the difference between the pre-adjusted sale price range of ${formatCurrency(
-                        Math.max(
-                          ...comparables
-                            .filter((c) => c.comp_type === "Sale")
-                            .map((c) => c.pre_adj)
-                        ) -
-                          Math.min(
-                            ...comparables
-                              .filter((c) => c.comp_type === "Sale")
-                              .map((c) => c.pre_adj)
-                          )
-                      )} or ${formatPercent(
-                        (Math.max(
-                          ...comparables
-                            .filter((c) => c.comp_type === "Sale")
-                            .map((c) => c.pre_adj)
-                        ) -
-                          Math.min(
-                            ...comparables
-                              .filter((c) => c.comp_type === "Sale")
-                              .map((c) => c.pre_adj)
-                          )) /
-                          Math.min(
-                            ...comparables
-                              .filter((c) => c.comp_type === "Sale")
-                              .map((c) => c.pre_adj)
-                          )
-                      )} to the post-adjusted sale price range of ${formatCurrency(
-                        Math.max(
-                          ...comparables
-                            .filter((c) => c.comp_type === "Sale")
-                            .map((c) => c.post_adj)
-                        ) -
-                          Math.min(
-                            ...comparables
-                              .filter((c) => c.comp_type === "Sale")
-                              .map((c) => c.post_adj)
-                          )
-                      )} or ${formatPercent(
-                        (Math.max(
-                          ...comparables
-                            .filter((c) => c.comp_type === "Sale")
-                            .map((c) => c.post_adj)
-                        ) -
-                          Math.min(
-                            ...comparables
-                              .filter((c) => c.comp_type === "Sale")
-                              .map((c) => c.post_adj)
-                          )) /
-                          Math.min(
-                            ...comparables
-                              .filter((c) => c.comp_type === "Sale")
-                              .map((c) => c.post_adj)
-                          )
-                      )}. The tighter the adjusted range suggests that the adjustments are more credible and reflective of the market.`}
+                      value={explanationText}
                     ></textarea>
                     <button
                       className="btn btn-primary mt-3"
                       onClick={() => {
-                        navigator.clipboard.writeText(
-                          `A good indication that the individual adjustments represent the market reaction can be seen in the difference between the pre-adjusted sale price range of ${formatCurrency(
-                            Math.max(
-                              ...comparables
-                                .filter((c) => c.comp_type === "Sale")
-                                .map((c) => c.pre_adj)
-                            ) -
-                              Math.min(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.pre_adj)
-                              )
-                          )} or ${formatPercent(
-                            (Math.max(
-                              ...comparables
-                                .filter((c) => c.comp_type === "Sale")
-                                .map((c) => c.pre_adj)
-                            ) -
-                              Math.min(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.pre_adj)
-                              )) /
-                              Math.min(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.pre_adj)
-                              )
-                          )} to the post-adjusted sale price range of ${formatCurrency(
-                            Math.max(
-                              ...comparables
-                                .filter((c) => c.comp_type === "Sale")
-                                .map((c) => c.post_adj)
-                            ) -
-                              Math.min(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.post_adj)
-                              )
-                          )} or ${formatPercent(
-                            (Math.max(
-                              ...comparables
-                                .filter((c) => c.comp_type === "Sale")
-                                .map((c) => c.post_adj)
-                            ) -
-                              Math.min(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.post_adj)
-                              )) /
-                              Math.min(
-                                ...comparables
-                                  .filter((c) => c.comp_type === "Sale")
-                                  .map((c) => c.post_adj)
-                              )
-                          )}. The tighter the adjusted range suggests that the adjustments are more credible and reflective of the market.`
-                        );
+                        navigator.clipboard.writeText(explanationText);
                         alert("Text copied to clipboard!");
                       }}
                     >
@@ -597,13 +562,13 @@ const SensitivityCalculator = ({ userEmail, initialFile }) => {
               )}
 
               {/* Scatter Plot Card */}
-              {scatterData() && (
+              {chartData && (
                 <div className="card mb-4 border-info">
                   <div className="card-header bg-info text-white">
                     <h2>Comparable Property Adjustments</h2>
                   </div>
                   <div className="card-body">
-                    <Scatter data={scatterData()} options={scatterOptions} />
+                    <Scatter data={chartData} options={scatterOptions} />
                   </div>
                 </div>
               )}